@@ -1,13 +1,26 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from sentence_transformers import SentenceTransformer
-import chromadb
-from chromadb.config import Settings
-import hashlib
+import json
 import os
 from functools import wraps
+from bulk_ingest import parse_ndjson
+from document_engine import DocumentEngine
+from listing import DEFAULT_PAGE_SIZE
+from lazy import start_warm_up
+from metrics import CONTENT_TYPE, finish_request, render as render_metrics, stage, start_request
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """jsonify() timed as the response stage"""
+
+    def response(self, *args, **kwargs):
+        with stage("response"):
+            return super().response(*args, **kwargs)
+
 
 app = Flask(__name__)
+app.json = TimedJSONProvider(app)
 CORS(app)
 
 # API Key Authentication
@@ -22,132 +35,225 @@ def require_api_key(f):
         return f(*args, **kwargs)
     return decorated_function
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
+MODEL_NAME = "all-MiniLM-L6-v2"
+EMBEDDING_CACHE_PATH = os.environ.get('EMBEDDING_CACHE_PATH', '/tmp/embedding_cache.db')
+NEAR_DUP_PATH = os.environ.get('NEAR_DUP_PATH', '/tmp/near_duplicates.db')
+LEXICAL_PATH = os.environ.get('LEXICAL_PATH', '/tmp/lexical_index.db')
+CHROMA_PATH = os.environ.get('CHROMA_PATH', '/tmp/chroma_db')
+COMPACT_STORE_PATH = os.environ.get('COMPACT_STORE_PATH', '/tmp/compact_store.db')
 
-chroma_client = chromadb.PersistentClient(
-    path="/tmp/chroma_db",
-    settings=Settings(anonymized_telemetry=False)
+# The engine builds the model (ENCODER_BACKEND), batching/caching encoder and
+# Chroma on first use or in the background warm-up, so the worker answers
+# health checks as soon as it boots. Routes only parse requests and map
+# ValueError to 400 and KeyError to 404
+engine = DocumentEngine(
+    MODEL_NAME,
+    persist_dir=CHROMA_PATH,
+    cache_path=EMBEDDING_CACHE_PATH,
+    collection_name="documents",
+    indexed=True,
+    near_dup_path=NEAR_DUP_PATH,
+    lexical_path=LEXICAL_PATH,
+    compact_path=COMPACT_STORE_PATH
 )
 
-collection = chroma_client.get_or_create_collection(
-    name="documents",
-    metadata={"hnsw:space": "cosine"}
-)
+warm_up = start_warm_up(engine.resources(), after=lambda: engine.model.encode(["warm up"]))
+
+def wants_timings() -> bool:
+    return request.args.get('timings', '').lower() in ('1', 'true', 'yes')
+
+@app.before_request
+def start_timing():
+    g.timings, g.timings_token = start_request(request.endpoint or "unknown")
+
+@app.after_request
+def finish_timing(response):
+    timings = g.pop('timings', None)
+    if timings is None:
+        return response
+    finish_request(timings, g.pop('timings_token'), response.status_code)
+    
+    # ?timings=1 returns the per-stage breakdown as a Server-Timing header,
+    # and in the body of JSON object responses
+    if wants_timings():
+        response.headers['Server-Timing'] = timings.server_timing()
+        if response.is_json and not response.is_streamed:
+            body = response.get_json(silent=True)
+            if isinstance(body, dict):
+                response.set_data(json.dumps({**body, "timings": timings.breakdown()}))
+    return response
+
+@app.teardown_request
+def abandon_timing(error=None):
+    # after_request doesn't run when a view raises
+    timings = g.pop('timings', None)
+    if timings is not None:
+        finish_request(timings, g.pop('timings_token'), 500)
 
-def generate_doc_id(content: str) -> str:
-    return hashlib.md5(content.encode()).hexdigest()[:16]
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
 
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({"status": "healthy", "documents": collection.count()})
+    status = warm_up.status()
+    if not status["ready"]:
+        return jsonify({"status": "starting", **status})
+    return jsonify({"status": "healthy", **status, "documents": engine.count()})
+
+@app.route('/health/live', methods=['GET'])
+def liveness():
+    return jsonify({"status": "alive"})
+
+@app.route('/health/ready', methods=['GET'])
+def readiness():
+    status = warm_up.status()
+    return jsonify(status), 200 if status["ready"] else 503
 
 @app.route('/add', methods=['POST'])
 @require_api_key
 def add_document():
-    data = request.json
-    content = data.get('content', '')
-    metadata = data.get('metadata', {})
+    data = request.json or {}
     
-    if not content:
-        return jsonify({"error": "Content is required"}), 400
+    try:
+        result = engine.add_document(data.get('content', ''), data.get('metadata', {}))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
-    doc_id = generate_doc_id(content)
-    
-    existing = collection.get(ids=[doc_id])
-    if existing['ids']:
-        return jsonify({"message": "Document already exists", "id": doc_id}), 200
-    
-    embedding = model.encode(content).tolist()
+    near_duplicate = {key: result[key] for key in ("near_duplicate_of", "jaccard") if key in result}
+    if not result["added"]:
+        message = "Near-duplicate already exists" if near_duplicate else "Document already exists"
+        return jsonify({"message": message, "id": result["id"], **near_duplicate}), 200
+    return jsonify({"message": "Document added", "id": result["id"], **near_duplicate}), 201
+
+@app.route('/add_batch', methods=['POST'])
+@require_api_key
+def add_documents_batch():
+    # A JSON array is parsed up front; anything else is read as NDJSON
+    # straight off the request stream so large uploads aren't buffered
+    if request.is_json:
+        items = request.get_json()
+        if not isinstance(items, list):
+            return jsonify({"error": "Expected a JSON array of documents"}), 400
+    else:
+        items = parse_ndjson(request.stream)
     
-    collection.add(
-        embeddings=[embedding],
-        documents=[content],
-        metadatas=[metadata],
-        ids=[doc_id]
-    )
+    def generate():
+        for result in engine.add_documents(items):
+            yield json.dumps(result) + "\n"
     
-    return jsonify({"message": "Document added", "id": doc_id}), 201
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 @app.route('/search', methods=['POST'])
 @require_api_key
 def search():
-    data = request.json
-    query = data.get('query', '')
-    n_results = min(data.get('n_results', 5), collection.count())
+    data = request.json or {}
     
-    if not query:
-        return jsonify({"error": "Query is required"}), 400
-    
-    if collection.count() == 0:
-        return jsonify({"results": [], "message": "No documents in database"}), 200
-    
-    query_embedding = model.encode(query).tolist()
-    
-    results = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=n_results
-    )
-    
-    formatted_results = []
-    for i in range(len(results['ids'][0])):
-        formatted_results.append({
-            "id": results['ids'][0][i],
-            "similarity": 1 - results['distances'][0][i],
-            "content": results['documents'][0][i],
-            "metadata": results['metadatas'][0][i]
-        })
+    try:
+        return jsonify(engine.search(
+            data.get('query', ''),
+            data.get('n_results', 5),
+            where=data.get('where'),
+            mode=data.get('mode'),
+            where_document=data.get('where_document')
+        ))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/search_batch', methods=['POST'])
+@require_api_key
+def search_many():
+    data = request.json or {}
     
-    return jsonify({"results": formatted_results, "query": query})
+    try:
+        return jsonify(engine.search_batch(data.get('queries'), data.get('n_results', 5)))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
 
 @app.route('/compare', methods=['POST'])
 @require_api_key
 def compare():
-    data = request.json
-    doc1 = data.get('doc1', '')
-    doc2 = data.get('doc2', '')
+    data = request.json or {}
     
-    if not doc1 or not doc2:
-        return jsonify({"error": "Both documents are required"}), 400
+    try:
+        return jsonify(engine.compare(data.get('doc1', ''), data.get('doc2', '')))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/compare_matrix', methods=['POST'])
+@require_api_key
+def compare_many():
+    data = request.json or {}
     
-    embedding1 = model.encode(doc1)
-    embedding2 = model.encode(doc2)
+    try:
+        result = engine.compare_matrix(
+            data.get('queries') or [],
+            data.get('references') or [],
+            top_k=data.get('top_k'),
+            threshold=data.get('threshold')
+        )
+    except KeyError as e:
+        return jsonify({"error": e.args[0]}), 404
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
     
-    from numpy import dot
-    from numpy.linalg import norm
+    return jsonify(result)
+
+@app.route('/locate', methods=['POST'])
+@require_api_key
+def locate_passages():
+    data = request.json or {}
     
-    similarity = float(dot(embedding1, embedding2) / (norm(embedding1) * norm(embedding2)))
+    try:
+        result = engine.locate_passages(data.get('content', ''), data.get('id', ''), data.get('threshold'))
+    except KeyError as e:
+        return jsonify({"error": e.args[0]}), 404
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
     
-    return jsonify({
-        "similarity": similarity,
-        "percentage": similarity * 100,
-        "doc1_preview": doc1[:100],
-        "doc2_preview": doc2[:100]
-    })
+    return jsonify(result)
+
+@app.route('/near_duplicates', methods=['POST'])
+@require_api_key
+def near_duplicates():
+    data = request.json or {}
+    
+    try:
+        return jsonify(engine.near_duplicate_candidates(
+            data.get('content', ''),
+            data.get('threshold'),
+            data.get('limit', 20)
+        ))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
 
 @app.route('/documents', methods=['GET'])
 @require_api_key
 def get_all_documents():
-    all_docs = collection.get()
-    
-    documents = []
-    for i in range(len(all_docs['ids'])):
-        documents.append({
-            "id": all_docs['ids'][i],
-            "content": all_docs['documents'][i],
-            "metadata": all_docs['metadatas'][i]
-        })
-    
-    return jsonify({"documents": documents, "count": len(documents)})
+    fields = request.args.get('fields')
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        offset = int(request.args.get('offset', 0))
+        preview_length = int(request.args.get('preview_length', 0)) or None
+        
+        if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+            # NDJSON, one document per line, read from Chroma a page at a time
+            documents = engine.iter_documents(offset, fields, preview_length)
+            
+            def generate():
+                for document in documents:
+                    yield json.dumps(document) + "\n"
+            
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        
+        return jsonify(engine.list_documents(limit, offset, fields, preview_length))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
 @app.route('/clear', methods=['DELETE'])
 @require_api_key
 def clear_database():
-    global collection
-    chroma_client.delete_collection("documents")
-    collection = chroma_client.create_collection(
-        name="documents",
-        metadata={"hnsw:space": "cosine"}
-    )
+    engine.clear()
     return jsonify({"message": "Database cleared"})
 
 if __name__ == '__main__':
@@ -1,86 +1,93 @@
 import gradio as gr
-from sentence_transformers import SentenceTransformer
-import chromadb
-from chromadb.config import Settings
-import hashlib
 import json
 import os
 # Flask imports removed - using Gradio API instead
 # from flask import Flask, request, jsonify
 # from functools import wraps
-import pdfplumber
-import io
-import requests
 import xml.etree.ElementTree as ET
 from urllib.parse import quote
-import random
-import time
 from datetime import datetime
+from arxiv_harvester import (
+    ARXIV_API_URL, ARXIV_BURST, ARXIV_RATE_PER_SEC, RateLimitedClient, TokenBucket, harvest, submitted_date_query
+)
+from bulk_ingest import INGEST_BATCH_SIZE, parse_documents_payload
+from document_engine import DocumentEngine, generate_doc_id
+from lexical_index import SEARCH_MODE
+from listing import DEFAULT_PAGE_SIZE
+from pdf_extract import get_extractor
+from lazy import start_warm_up
+from metrics import METRICS_PORT, serve as serve_metrics, stage, timed_endpoint
 
 # API Key Authentication for Gradio API endpoints
 API_KEY = os.environ.get('API_KEY', 'demo-api-key-change-in-production')
 CRON_COUNT = int(os.environ.get('CRON_COUNT', '10'))  # Default 10 papers per query for cron runs
+ARXIV_PAGE_SIZE = 50
+DISPLAY_PAGE_SIZE = 50  # Documents rendered in the demo's document list
+ARXIV_MAX_PAGES = int(os.environ.get('ARXIV_MAX_PAGES', '5'))  # Pages scanned per query per run
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
+MODEL_NAME = "all-MiniLM-L6-v2"
+EMBEDDING_CACHE_PATH = os.environ.get('EMBEDDING_CACHE_PATH', './embedding_cache.db')
 
-# Separate ChromaDB clients for demo UI vs production API
-chroma_client = chromadb.PersistentClient(
-    path="./chroma_db",
-    settings=Settings(
-        anonymized_telemetry=False,
-        allow_reset=True,
-        is_persistent=True
-    )
-)
+# All front ends go through DocumentEngine. The model, Chroma and the metadata
+# index are built on first use (or by the background warm-up below) so the app
+# can bind its port and answer health checks straight away; the engines share
+# one model, encoder and Chroma client
 
 # Demo collection (for public UI)
-demo_collection = chroma_client.get_or_create_collection(
-    name="demo_documents",
-    metadata={"hnsw:space": "cosine"}
+demo_engine = DocumentEngine(
+    MODEL_NAME,
+    persist_dir="./chroma_db",
+    cache_path=EMBEDDING_CACHE_PATH,
+    collection_name="demo_documents",
+    allow_reset=True
 )
 
-# Production collection (for API)
-api_collection = chroma_client.get_or_create_collection(
-    name="api_documents", 
-    metadata={"hnsw:space": "cosine"}
-)
+# Production collection (for API), with the arxiv_id / source /
+# subject_matter index
+api_engine = demo_engine.sibling("api_documents", indexed=True)
+
+model = demo_engine.model
+encoder = demo_engine.encoder
+api_collection = api_engine.collection
+api_index = api_engine.index
 
 # arXiv queries collection (for managing search queries)
-arxiv_queries_collection = chroma_client.get_or_create_collection(
-    name="arxiv_queries",
-    metadata={"hnsw:space": "cosine"}
-)
+arxiv_queries_collection = demo_engine.sibling("arxiv_queries", near_dup_action="off").collection
 
-# Use demo collection for Gradio functions
-collection = demo_collection
+# Load everything in the background (WARM_UP=0 to load on first request);
+# the final encode pays for the model's first-call overhead
+warm_up = start_warm_up(
+    {
+        **demo_engine.resources(),
+        **api_engine.resources(),
+        "arxiv_queries": arxiv_queries_collection
+    },
+    after=lambda: model.encode(["warm up"])
+)
 
-def generate_doc_id(content: str) -> str:
-    return hashlib.md5(content.encode()).hexdigest()[:16]
+# Every arXiv request (searches and PDF downloads) shares one pooled,
+# rate-limited client
+arxiv_client = RateLimitedClient(TokenBucket(ARXIV_RATE_PER_SEC, ARXIV_BURST))
 
 def extract_text_from_pdf(pdf_bytes: bytes) -> str:
     """Extract text content from PDF bytes"""
     try:
-        with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
-            text_parts = []
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text_parts.append(page_text)
-            
-            full_text = '\n\n'.join(text_parts)
-            return full_text.strip()
+        # Runs in the extraction process pool so the request thread doesn't
+        # hold the GIL for the whole parse
+        return get_extractor().extract_text(pdf_bytes)
     except Exception as e:
         raise ValueError(f"Failed to extract text from PDF: {str(e)}")
 
-def search_arxiv_papers(query: str, max_results: int = 100) -> list:
-    """Search arXiv for papers matching the query"""
+def search_arxiv_papers(query: str, max_results: int = 100, start: int = 0, sort_order: str = "descending",
+                        submitted_after: str = "", submitted_before: str = "") -> list:
+    """Search arXiv for papers matching the query, optionally within a submission date range"""
     try:
         # Format query for arXiv API
-        encoded_query = quote(query)
-        url = f"https://export.arxiv.org/api/query?search_query={encoded_query}&max_results={max_results}&sortBy=submittedDate&sortOrder=descending"
+        encoded_query = quote(submitted_date_query(query, submitted_after, submitted_before))
+        url = f"{ARXIV_API_URL}?search_query={encoded_query}&start={start}&max_results={max_results}&sortBy=submittedDate&sortOrder={sort_order}"
         
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
+        with stage("arxiv_search"):
+            response = arxiv_client.get(url, timeout=30)
         
         # Parse XML response
         root = ET.fromstring(response.content)
@@ -115,49 +122,147 @@ def search_arxiv_papers(query: str, max_results: int = 100) -> list:
     except Exception as e:
         raise ValueError(f"Failed to search arXiv: {str(e)}")
 
-def download_and_process_arxiv_paper(paper: dict, subject_matter: str) -> tuple:
+def arxiv_paper_exists(arxiv_id: str) -> bool:
+    """Check whether a paper with this arXiv ID is already stored"""
+    return api_index.contains("arxiv_id", arxiv_id)
+
+def collect_unseen_papers(query: str, budget: int, sort_order: str, **date_range) -> tuple:
+    """Page through search results until budget unseen papers are found.
+
+    Returns (papers, exhausted) where exhausted means the result set ran out.
+    """
+    papers = []
+    for page in range(ARXIV_MAX_PAGES):
+        results = search_arxiv_papers(
+            query,
+            max_results=ARXIV_PAGE_SIZE,
+            start=page * ARXIV_PAGE_SIZE,
+            sort_order=sort_order,
+            **date_range
+        )
+        for paper in results:
+            if not arxiv_paper_exists(paper['arxiv_id']):
+                papers.append(paper)
+                if len(papers) >= budget:
+                    return papers, False
+        if len(results) < ARXIV_PAGE_SIZE:
+            return papers, True
+    return papers, False
+
+def sync_arxiv_query(metadata: dict, budget: int) -> tuple:
+    """Pick up to budget unseen papers for a query using its stored cursors.
+
+    hwm_published is the newest submission already taken. Papers newer than it
+    are taken oldest first so the mark only ever moves forward without gaps.
+    Any budget left over walks the backlog newest first from lwm_published,
+    the oldest submission taken, until backlog_done. Each paper is tagged with
+    the walk that found it. Returns (papers, the walks that ran out of results)
+    for arxiv_cursor once the papers are processed.
+    """
+    query = metadata['query']
+    hwm = metadata.get('hwm_published') or ''
+    lwm = metadata.get('lwm_published') or ''
+    exhausted_walks = set()
+
+    if hwm:
+        walk = "forward"
+        papers, _ = collect_unseen_papers(query, budget, "ascending", submitted_after=hwm)
+    else:
+        # First sync starts from the newest papers; the backlog walk covers the rest
+        walk = "newest"
+        papers, exhausted = collect_unseen_papers(query, budget, "descending")
+        if exhausted:
+            exhausted_walks.add(walk)
+    for paper in papers:
+        paper['walk'] = walk
+
+    remaining = budget - len(papers)
+    if remaining > 0 and lwm and not metadata.get('backlog_done'):
+        backlog, exhausted = collect_unseen_papers(query, remaining, "descending", submitted_before=lwm)
+        for paper in backlog:
+            paper['walk'] = "backlog"
+        papers.extend(backlog)
+        if exhausted:
+            exhausted_walks.add("backlog")
+    return papers, exhausted_walks
+
+def arxiv_cursor(metadata: dict, exhausted_walks: set, settled: list, failed: list) -> dict:
+    """Cursor fields to merge into a query's metadata after a run.
+
+    Only settled papers (stored, or skipped for good: already stored,
+    near-duplicate, no text) move the marks, and never past a paper that
+    failed: the forward walk stops short of its oldest failure and the
+    newest-first walks stop short of their newest one, so the next run
+    fetches the failed papers again.
+    """
+    hwm = metadata.get('hwm_published') or ''
+    lwm = metadata.get('lwm_published') or ''
+    cursor = {}
+
+    def published(papers, walks):
+        return [paper['published'] for paper in papers if paper.get('walk') in walks and paper['published']]
+
+    # Ascending from hwm: settled papers older than the first failure
+    failed_forward = published(failed, ("forward",))
+    forward = [value for value in published(settled, ("forward",))
+               if not failed_forward or value < min(failed_forward)]
+    if forward:
+        cursor['hwm_published'] = max(forward + ([hwm] if hwm else []))
+
+    # Descending (first sync and backlog): settled papers newer than the last failure
+    failed_descending = published(failed, ("newest", "backlog"))
+    descending = [value for value in published(settled, ("newest", "backlog"))
+                  if not failed_descending or value > max(failed_descending)]
+    if descending:
+        cursor['lwm_published'] = min(descending + ([lwm] if lwm else []))
+        newest = [value for value in published(settled, ("newest",)) if value in descending]
+        if newest:
+            cursor['hwm_published'] = max(newest)
+
+    # A walk that ran out of results only finishes the backlog if nothing in it failed
+    if any(not any(paper.get('walk') == walk for paper in failed) for walk in exhausted_walks):
+        cursor['backlog_done'] = True
+    return cursor
+
+def download_arxiv_paper(paper: dict) -> str:
     """Download arXiv paper PDF and extract text"""
+    with stage("arxiv_download"):
+        pdf_response = arxiv_client.get(paper['pdf_url'], timeout=60)
+    return extract_text_from_pdf(pdf_response.content)
+
+def store_arxiv_paper(paper: dict, extracted_text: str, subject_matter: str) -> tuple:
+    """Embed extracted paper text and add it to the API collection"""
+    if not extracted_text.strip():
+        return False, f"No text found in PDF for {paper['arxiv_id']}"
+    
+    # Create metadata
+    metadata = {
+        "source": "arxiv_auto",
+        "subject_matter": subject_matter,
+        "title": paper['title'],
+        "arxiv_id": paper['arxiv_id'],
+        "pdf_url": paper['pdf_url'],
+        "published": paper['published'],
+        "query": paper['query'],
+        "text_length": len(extracted_text),
+        "added_date": datetime.now().isoformat()
+    }
+    
+    # Add the paper plus its chunks
+    result = api_engine.add_document(extracted_text, metadata, chunk=True)
+    if not result["added"]:
+        return False, f"Paper {paper['arxiv_id']} already exists"
+    
+    return True, f"✅ Added: {paper['title'][:100]}..."
+
+def download_and_process_arxiv_paper(paper: dict, subject_matter: str) -> tuple:
+    """Download, extract and store a single arXiv paper"""
     try:
         # Check if paper already exists (by arXiv ID)
-        existing = api_collection.get(where={"arxiv_id": paper['arxiv_id']})
-        if existing['ids']:
+        if arxiv_paper_exists(paper['arxiv_id']):
             return False, f"Paper {paper['arxiv_id']} already exists"
         
-        # Download PDF
-        pdf_response = requests.get(paper['pdf_url'], timeout=60)
-        pdf_response.raise_for_status()
-        
-        # Extract text
-        extracted_text = extract_text_from_pdf(pdf_response.content)
-        
-        if not extracted_text.strip():
-            return False, f"No text found in PDF for {paper['arxiv_id']}"
-        
-        # Create metadata
-        metadata = {
-            "source": "arxiv_auto",
-            "subject_matter": subject_matter,
-            "title": paper['title'],
-            "arxiv_id": paper['arxiv_id'],
-            "pdf_url": paper['pdf_url'],
-            "published": paper['published'],
-            "query": paper['query'],
-            "text_length": len(extracted_text),
-            "added_date": datetime.now().isoformat()
-        }
-        
-        # Generate doc ID and add to collection
-        doc_id = generate_doc_id(extracted_text)
-        embedding = model.encode(extracted_text).tolist()
-        
-        api_collection.add(
-            embeddings=[embedding],
-            documents=[extracted_text],
-            metadatas=[metadata],
-            ids=[doc_id]
-        )
-        
-        return True, f"✅ Added: {paper['title'][:100]}..."
+        return store_arxiv_paper(paper, download_arxiv_paper(paper), subject_matter)
         
     except Exception as e:
         return False, f"❌ Error processing {paper.get('arxiv_id', 'unknown')}: {str(e)}"
@@ -181,7 +286,7 @@ def add_arxiv_query(query: str, subject_matter: str) -> str:
         }
         
         # Add query (using subject matter as document for searching)
-        embedding = model.encode(f"{query} {subject_matter}").tolist()
+        embedding = encoder.encode(f"{query} {subject_matter}").tolist()
         
         arxiv_queries_collection.add(
             embeddings=[embedding],
@@ -204,53 +309,58 @@ def fetch_arxiv_papers(max_papers_per_query: int = 3) -> str:
         if not all_queries['ids']:
             return "No arXiv queries configured. Please add some queries first."
         
+        jobs = [
+            {"id": query_id, "metadata": all_queries['metadatas'][i]}
+            for i, query_id in enumerate(all_queries['ids'])
+        ]
+        
+        def search(job):
+            # Only papers past the query's cursors are fetched; the cursor
+            # moves below, once the run shows which papers were settled
+            papers, job['exhausted_walks'] = sync_arxiv_query(job['metadata'], max_papers_per_query)
+            return papers
+        
+        def store(job, paper, extracted_text):
+            return store_arxiv_paper(paper, extracted_text, job['metadata']['subject_matter'])
+        
+        # Searches, downloads and writes overlap; the shared rate limiter
+        # keeps the request rate polite without per-paper sleeps
+        reports = harvest(jobs, search, download_arxiv_paper, store)
+        
         total_added = 0
         results = []
         
-        for i, query_id in enumerate(all_queries['ids']):
-            metadata = all_queries['metadatas'][i]
+        for report in reports:
+            query_id = report['job']['id']
+            metadata = report['job']['metadata']
             query = metadata['query']
-            subject_matter = metadata['subject_matter']
             
             results.append(f"\n🔍 Processing query: {query}")
             
-            try:
-                # Search for papers
-                papers = search_arxiv_papers(query, max_results=50)
-                
-                if not papers:
-                    results.append("  No papers found")
-                    continue
-                
-                # Randomly select a few papers to avoid overwhelming
-                selected_papers = random.sample(papers, min(max_papers_per_query, len(papers)))
-                
-                query_added = 0
-                for paper in selected_papers:
-                    success, message = download_and_process_arxiv_paper(paper, subject_matter)
-                    results.append(f"  {message}")
-                    
-                    if success:
-                        query_added += 1
-                        total_added += 1
-                    
-                    # Small delay to be respectful
-                    time.sleep(1)
-                
-                # Update query metadata
-                updated_metadata = metadata.copy()
-                updated_metadata['last_run'] = datetime.now().isoformat()
-                updated_metadata['papers_added'] = updated_metadata.get('papers_added', 0) + query_added
-                
-                arxiv_queries_collection.update(
-                    ids=[query_id],
-                    metadatas=[updated_metadata]
-                )
-                
-                results.append(f"  Added {query_added} papers for this query")
-                
-            except Exception as e:
-                results.append(f"  ❌ Error with query '{query}': {str(e)}")
+            if report['error']:
+                results.append(f"  ❌ Error with query '{query}': {report['error']}")
+                continue
+            
+            for message in report['messages']:
+                results.append(f"  {message}")
+            
+            query_added = report['added']
+            total_added += query_added
+            
+            # Update query metadata
+            updated_metadata = metadata.copy()
+            updated_metadata['last_run'] = datetime.now().isoformat()
+            updated_metadata['papers_added'] = updated_metadata.get('papers_added', 0) + query_added
+            updated_metadata.update(arxiv_cursor(
+                metadata, report['job'].get('exhausted_walks', set()), report['settled'], report['failed']
+            ))
+            
+            arxiv_queries_collection.update(
+                ids=[query_id],
+                metadatas=[updated_metadata]
+            )
+            
+            results.append(f"  Added {query_added} papers for this query")
         
         summary = f"\n📊 Summary: Added {total_added} new papers total"
         return "\n".join(results) + summary
@@ -258,73 +368,58 @@ def fetch_arxiv_papers(max_papers_per_query: int = 3) -> str:
     except Exception as e:
         return f"❌ Error fetching papers: {str(e)}"
 
-def add_document(content: str, metadata: str = ""):
-    if not content.strip():
-        return "Please enter document content", display_all_documents()
-    
-    doc_id = generate_doc_id(content)
-    
-    existing = collection.get(ids=[doc_id])
-    if existing['ids']:
-        return f"Document already exists with ID: {doc_id}", display_all_documents()
-    
-    embedding = model.encode(content).tolist()
-    
-    meta_dict = {"source": "user_input"}  # Always have at least one metadata field
+def parse_metadata_text(metadata: str, base: dict) -> dict:
+    """Merge JSON typed into a metadata box into base; non-JSON text becomes a note"""
+    meta_dict = dict(base)
     if metadata.strip():
         try:
-            user_meta = json.loads(metadata)
-            meta_dict.update(user_meta)
+            meta_dict.update(json.loads(metadata))
         except:
             meta_dict["note"] = metadata
+    return meta_dict
+
+def add_document(content: str, metadata: str = ""):
+    if not content.strip():
+        return "Please enter document content", display_all_documents()
     
-    collection.add(
-        embeddings=[embedding],
-        documents=[content],
-        metadatas=[meta_dict],
-        ids=[doc_id]
-    )
+    # Always have at least one metadata field
+    result = demo_engine.add_document(content, parse_metadata_text(metadata, {"source": "user_input"}))
+    if not result["added"]:
+        if "near_duplicate_of" in result:
+            return f"Near-duplicate of {result['id']} ({result['jaccard']:.0%} shingle overlap), not added", display_all_documents()
+        return f"Document already exists with ID: {result['id']}", display_all_documents()
     
-    return f"✅ Added document with ID: {doc_id}", display_all_documents()
+    if "near_duplicate_of" in result:
+        return f"✅ Added document with ID: {result['id']} (near-duplicate of {result['near_duplicate_of']})", display_all_documents()
+    return f"✅ Added document with ID: {result['id']}", display_all_documents()
 
-def search_similar(query: str, n_results: int = 5):
+def search_similar(query: str, n_results: int = 5, mode: str = SEARCH_MODE):
     if not query.strip():
         return "Please enter a search query"
     
     # Check if collection is empty
-    doc_count = collection.count()
-    if doc_count == 0:
+    if demo_engine.count() == 0:
         return "No documents in database. Please add some documents first!"
     
-    query_embedding = model.encode(query).tolist()
-    
-    # Ensure n_results is at least 1 and not more than available docs
-    n_results = max(1, min(n_results, doc_count))
+    results = demo_engine.search(query, n_results, mode=mode)['results']
     
-    results = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=n_results
-    )
-    
-    if not results['ids'][0]:
+    if not results:
         return "No documents found. Add some documents first!"
     
     output = f"🔍 **Search Query:** {query}\n\n"
     output += "## Similar Documents:\n\n"
     
-    for i in range(len(results['ids'][0])):
-        similarity = 1 - results['distances'][0][i]
-        doc_id = results['ids'][0][i]
-        content = results['documents'][0][i]
-        metadata = results['metadatas'][0][i]
-        
+    for i, result in enumerate(results):
+        content = result['content']
         preview = content[:200] + "..." if len(content) > 200 else content
         
-        output += f"### {i+1}. Document ID: {doc_id}\n"
-        output += f"**Similarity:** {similarity:.2%}\n"
+        output += f"### {i+1}. Document ID: {result['id']}\n"
+        output += f"**Similarity:** {result['similarity']:.2%}\n"
+        if 'bm25' in result:
+            output += f"**Keyword score (BM25):** {result['bm25']:.2f}\n"
         output += f"**Content:** {preview}\n"
-        if metadata:
-            output += f"**Metadata:** {json.dumps(metadata)}\n"
+        if result['metadata']:
+            output += f"**Metadata:** {json.dumps(result['metadata'])}\n"
         output += "\n---\n\n"
     
     return output
@@ -333,18 +428,12 @@ def compare_two_documents(doc1: str, doc2: str):
     if not doc1.strip() or not doc2.strip():
         return "Please enter both documents"
     
-    embedding1 = model.encode(doc1)
-    embedding2 = model.encode(doc2)
-    
-    from numpy import dot
-    from numpy.linalg import norm
-    
-    similarity = dot(embedding1, embedding2) / (norm(embedding1) * norm(embedding2))
+    similarity = demo_engine.compare(doc1, doc2)['similarity']
     
     output = "## Document Comparison\n\n"
     output += f"**Document 1:** {doc1[:100]}{'...' if len(doc1) > 100 else ''}\n\n"
     output += f"**Document 2:** {doc2[:100]}{'...' if len(doc2) > 100 else ''}\n\n"
-    output += f"### Similarity Score: {float(similarity):.4f} ({float(similarity)*100:.1f}%)\n\n"
+    output += f"### Similarity Score: {similarity:.4f} ({similarity*100:.1f}%)\n\n"
     
     if similarity > 0.9:
         output += "🟢 **Very Similar** - Documents are nearly identical in meaning"
@@ -358,34 +447,28 @@ def compare_two_documents(doc1: str, doc2: str):
     return output
 
 def display_all_documents():
-    all_docs = collection.get()
+    # Only the first page is rendered; the full list can be huge
+    page = demo_engine.list_documents(limit=DISPLAY_PAGE_SIZE, preview_length=150)
     
-    if not all_docs['ids']:
+    if not page['documents']:
         return "📂 No documents in database"
     
-    output = f"📚 **Total Documents:** {len(all_docs['ids'])}\n\n"
+    output = f"📚 **Total Documents:** {page['total']}\n\n"
+    if page['total'] > page['count']:
+        output += f"*Showing the first {page['count']}*\n\n"
     
-    for i in range(len(all_docs['ids'])):
-        content = all_docs['documents'][i]
-        preview = content[:150] + "..." if len(content) > 150 else content
-        output += f"**ID:** {all_docs['ids'][i]}\n"
+    for document in page['documents']:
+        preview = document['content'] + ("..." if document['truncated'] else "")
+        output += f"**ID:** {document['id']}\n"
         output += f"**Content:** {preview}\n"
-        if all_docs['metadatas'][i]:
-            output += f"**Metadata:** {json.dumps(all_docs['metadatas'][i])}\n"
+        if document['metadata']:
+            output += f"**Metadata:** {json.dumps(document['metadata'])}\n"
         output += "\n---\n"
     
     return output
 
 def clear_database():
-    global collection
-    try:
-        chroma_client.delete_collection("documents")
-    except:
-        pass
-    collection = chroma_client.create_collection(
-        name="documents",
-        metadata={"hnsw:space": "cosine"}
-    )
+    demo_engine.clear()
     return "🗑️ Database cleared", display_all_documents()
 
 def add_pdf_document(pdf_file, metadata: str = ""):
@@ -397,41 +480,11 @@ def add_pdf_document(pdf_file, metadata: str = ""):
         with open(pdf_file.name, 'rb') as f:
             pdf_bytes = f.read()
         
-        # Extract text
-        extracted_text = extract_text_from_pdf(pdf_bytes)
+        result = demo_engine.add_pdf(pdf_bytes, pdf_file.name.split('/')[-1], parse_metadata_text(metadata, {}))
+        if not result["added"]:
+            return f"Document already exists with ID: {result['id']}", display_all_documents()
         
-        if not extracted_text.strip():
-            return "No text found in PDF", display_all_documents()
-        
-        # Process metadata
-        meta_dict = {"source": "pdf_upload", "filename": pdf_file.name.split('/')[-1]}
-        if metadata.strip():
-            try:
-                user_meta = json.loads(metadata)
-                meta_dict.update(user_meta)
-            except:
-                meta_dict["note"] = metadata
-        
-        # Add text length info
-        meta_dict["text_length"] = len(extracted_text)
-        meta_dict["pages"] = len(extracted_text.split('\n\n'))
-        
-        doc_id = generate_doc_id(extracted_text)
-        
-        existing = collection.get(ids=[doc_id])
-        if existing['ids']:
-            return f"Document already exists with ID: {doc_id}", display_all_documents()
-        
-        embedding = model.encode(extracted_text).tolist()
-        
-        collection.add(
-            embeddings=[embedding],
-            documents=[extracted_text],
-            metadatas=[meta_dict],
-            ids=[doc_id]
-        )
-        
-        return f"✅ PDF processed and added with ID: {doc_id}\nExtracted {len(extracted_text)} characters", display_all_documents()
+        return f"✅ PDF processed and added with ID: {result['id']}\nExtracted {result['text_length']} characters", display_all_documents()
         
     except Exception as e:
         return f"Error processing PDF: {str(e)}", display_all_documents()
@@ -447,20 +500,254 @@ def load_sample_data():
         ("Gradient descent optimizes machine learning model parameters.", {"category": "ML", "topic": "optimization"}),
     ]
     
-    for content, metadata in samples:
-        doc_id = generate_doc_id(content)
-        existing = collection.get(ids=[doc_id])
-        if not existing['ids']:
-            embedding = model.encode(content).tolist()
-            collection.add(
-                embeddings=[embedding],
-                documents=[content],
-                metadatas=[metadata],
-                ids=[doc_id]
-            )
+    # One existence check and one encode call for all samples
+    list(demo_engine.add_documents({"content": content, "metadata": metadata} for content, metadata in samples))
     
     return "✅ Sample documents loaded", display_all_documents()
 
+# Gradio API handlers: auth and argument coercion only, the work is done by
+# api_engine. Registered as API endpoints on the main demo and used by the
+# API documentation and testing tabs.
+def check_auth(api_key: str):
+    if api_key != API_KEY:
+        return {"error": "Invalid or missing API key"}
+    return None
+
+def check_health():
+    # Never blocks on loading: answering at all is liveness, "ready" is readiness
+    status = warm_up.status()
+    if not status["ready"]:
+        return {"status": "starting", "live": True, **status}
+    return {
+        "status": "healthy", 
+        "live": True,
+        **status,
+        "api_documents": api_engine.count(),
+        "demo_documents": demo_engine.count()
+    }
+
+@timed_endpoint("add")
+def api_add_document(content: str, metadata: dict = None, api_key: str = ""):
+    if check_auth(api_key):
+        return check_auth(api_key)
+    
+    meta_dict = {"source": "api"}
+    if metadata:
+        meta_dict.update(metadata)
+    
+    try:
+        result = api_engine.add_document(content, meta_dict)
+    except ValueError as e:
+        return {"error": str(e)}
+    
+    near_duplicate = {key: result[key] for key in ("near_duplicate_of", "jaccard") if key in result}
+    if not result["added"]:
+        return {"message": "Near-duplicate already exists" if near_duplicate else "Document already exists", "id": result["id"], **near_duplicate}
+    return {"message": "Document added", "id": result["id"], **near_duplicate}
+
+@timed_endpoint("search")
+def api_search_documents(query: str, n_results: int = 5, api_key: str = "", mode: str = "",
+                         where: dict = None, where_document: dict = None):
+    if check_auth(api_key):
+        return check_auth(api_key)
+    
+    try:
+        return api_engine.search(
+            query,
+            int(n_results or 5),
+            where=where or None,
+            mode=mode or None,
+            where_document=where_document or None
+        )
+    except ValueError as e:
+        return {"error": str(e)}
+
+@timed_endpoint("search_batch")
+def api_search_batch(queries: list = None, n_results: int = 5, api_key: str = ""):
+    if check_auth(api_key):
+        return check_auth(api_key)
+    
+    try:
+        return api_engine.search_batch(queries, int(n_results or 5))
+    except (TypeError, ValueError) as e:
+        return {"error": str(e)}
+
+@timed_endpoint("compare")
+def api_compare_documents(doc1: str, doc2: str, api_key: str = ""):
+    if check_auth(api_key):
+        return check_auth(api_key)
+    
+    try:
+        return api_engine.compare(doc1, doc2)
+    except ValueError as e:
+        return {"error": str(e)}
+
+@timed_endpoint("compare_matrix")
+def api_compare_matrix(queries: list = None, references: list = None, top_k: int = None,
+                       threshold: float = None, api_key: str = ""):
+    if check_auth(api_key):
+        return check_auth(api_key)
+    
+    try:
+        return api_engine.compare_matrix(
+            queries or [],
+            references or [],
+            top_k=int(top_k) if top_k else None,
+            threshold=threshold if threshold not in (None, "") else None
+        )
+    except KeyError as e:
+        return {"error": e.args[0]}
+    except (TypeError, ValueError) as e:
+        return {"error": str(e)}
+
+@timed_endpoint("locate")
+def api_locate_passages(content: str, doc_id: str, threshold: float = None, api_key: str = ""):
+    if check_auth(api_key):
+        return check_auth(api_key)
+    
+    try:
+        return api_engine.locate_passages(content, doc_id, threshold if threshold not in (None, "") else None)
+    except KeyError as e:
+        return {"error": e.args[0]}
+    except (TypeError, ValueError) as e:
+        return {"error": str(e)}
+
+@timed_endpoint("documents")
+def api_list_documents(api_key: str = "", limit: int = DEFAULT_PAGE_SIZE, offset: int = 0,
+                       fields: str = "content,metadata", preview_length: int = 0):
+    if check_auth(api_key):
+        return check_auth(api_key)
+    
+    try:
+        return api_engine.list_documents(
+            int(limit or DEFAULT_PAGE_SIZE),
+            int(offset or 0),
+            fields,
+            int(preview_length or 0) or None
+        )
+    except ValueError as e:
+        return {"error": str(e)}
+
+@timed_endpoint("delete")
+def api_delete_document(doc_id: str, api_key: str = ""):
+    if check_auth(api_key):
+        return check_auth(api_key)
+    
+    try:
+        return api_engine.delete(doc_id)
+    except KeyError as e:
+        return {"error": e.args[0]}
+    except Exception as e:
+        return {"error": f"Failed to delete document: {str(e)}"}
+
+@timed_endpoint("add_pdf")
+def api_add_pdf_document(pdf_file, metadata: dict = None, api_key: str = ""):
+    if check_auth(api_key):
+        return check_auth(api_key)
+    
+    if pdf_file is None:
+        return {"error": "No PDF file provided"}
+    
+    try:
+        with open(pdf_file.name, 'rb') as f:
+            pdf_bytes = f.read()
+        
+        filename = pdf_file.name.split('/')[-1]
+        result = api_engine.add_pdf(pdf_bytes, filename, metadata)
+        if not result["added"]:
+            return {"message": "Document already exists", "id": result["id"], "filename": filename}
+        
+        return {
+            "message": "PDF processed and document added",
+            "id": result["id"],
+            "filename": filename,
+            "text_length": result["text_length"],
+            "pages": result["pages"]
+        }
+        
+    except ValueError as e:
+        return {"error": str(e)}
+    except Exception as e:
+        return {"error": f"Failed to process PDF: {str(e)}"}
+
+@timed_endpoint("lookup")
+def api_lookup_documents(filters: dict = None, api_key: str = ""):
+    if check_auth(api_key):
+        return check_auth(api_key)
+    
+    try:
+        return api_engine.lookup(filters)
+    except ValueError as e:
+        return {"error": str(e)}
+
+@timed_endpoint("near_duplicates")
+def api_near_duplicates(content: str, threshold: float = None, limit: int = 20, api_key: str = ""):
+    if check_auth(api_key):
+        return check_auth(api_key)
+    
+    try:
+        return api_engine.near_duplicate_candidates(
+            content,
+            threshold if threshold not in (None, "") else None,
+            int(limit or 20)
+        )
+    except ValueError as e:
+        return {"error": str(e)}
+
+def api_add_documents_batch(documents: str, api_key: str = ""):
+    # Generator endpoint: yields each batch's per-item results with running
+    # counts, so clients see progress while a large back-fill is in flight
+    # without every update resending all earlier results
+    if check_auth(api_key):
+        yield check_auth(api_key)
+        return
+    
+    if not documents or not documents.strip():
+        yield {"error": "Documents are required"}
+        return
+    
+    try:
+        items = parse_documents_payload(documents)
+    except Exception as e:
+        yield {"error": f"Invalid documents payload: {str(e)}"}
+        return
+    
+    results = []
+    counts = {"added": 0, "exists": 0, "duplicate": 0, "near_duplicate": 0, "error": 0}
+    for result in api_engine.add_documents(items, {"source": "api"}):
+        results.append(result)
+        counts[result["status"]] += 1
+        if len(results) == INGEST_BATCH_SIZE:
+            yield {"results": results, **counts, "done": False}
+            results = []
+    
+    yield {"results": results, **counts, "done": True}
+
+def trigger_fetch(max_papers, api_key=""):
+    # Determine which storage to use based on API key
+    if api_key == API_KEY:
+        # Authenticated: production API storage, normal limits
+        if max_papers < 1 or max_papers > 50:
+            return {"error": "Papers count must be between 1 and 50"}
+        storage_type = "API storage (production)"
+        # For now, just simulate - we'd need to modify fetch_arxiv_papers to accept target collection
+        result = f"Would fetch {max_papers} papers to API storage (production data)"
+    else:
+        # Public demo: limit to 1 paper only
+        if max_papers != 1:
+            return {"error": "Public demo limited to 1 paper. Use API key for higher limits."}
+        storage_type = "Demo storage (public)"
+        result = "Would fetch 1 paper to demo storage (public playground)"
+        max_papers = 1  # Enforce limit
+
+    return {
+        "message": result,
+        "storage_used": storage_type,
+        "papers_requested": max_papers,
+        "authenticated": api_key == API_KEY,
+        "limit_applied": "1 paper max" if api_key != API_KEY else f"{max_papers} papers max"
+    }
+
 with gr.Blocks(title="Document Similarity Demo", theme=gr.themes.Soft()) as demo:
     gr.Markdown("""
     # 📄 Document Similarity Search Demo
@@ -484,6 +771,11 @@ with gr.Blocks(title="Document Similarity Demo", theme=gr.themes.Soft()) as demo
                     minimum=1, maximum=10, value=5, step=1,
                     label="Number of Results"
                 )
+                search_mode = gr.Radio(
+                    ["vector", "hybrid", "lexical"], value=SEARCH_MODE,
+                    label="Ranking",
+                    info="hybrid fuses semantic and keyword (BM25) rankings"
+                )
                 search_btn = gr.Button("Search", variant="primary")
             
             with gr.Column():
@@ -491,7 +783,7 @@ with gr.Blocks(title="Document Similarity Demo", theme=gr.themes.Soft()) as demo
         
         search_btn.click(
             search_similar,
-            inputs=[search_input, num_results],
+            inputs=[search_input, num_results, search_mode],
             outputs=search_output
         )
     
@@ -620,7 +912,7 @@ with gr.Blocks(title="Document Similarity Demo", theme=gr.themes.Soft()) as demo
                 papers_per_query = gr.Slider(
                     minimum=1, maximum=50, value=CRON_COUNT, step=1,
                     label="Papers per Query (per run)",
-                    info=f"Number of random papers to fetch from each query (default: {CRON_COUNT})"
+                    info=f"Number of new papers to fetch from each query (default: {CRON_COUNT})"
                 )
                 fetch_btn = gr.Button("🔄 Fetch Papers Now", variant="secondary")
                 
@@ -659,7 +951,11 @@ with gr.Blocks(title="Document Similarity Demo", theme=gr.themes.Soft()) as demo
                     output += f"**{i+1}. {query}**\n"
                     output += f"- Subject: {subject}\n"
                     output += f"- Papers Added: {papers_added}\n"
-                    output += f"- Last Run: {last_run}\n\n"
+                    output += f"- Last Run: {last_run}\n"
+                    if metadata.get('hwm_published'):
+                        backlog = "done" if metadata.get('backlog_done') else f"back to {metadata.get('lwm_published', '')[:10]}"
+                        output += f"- Synced Through: {metadata['hwm_published'][:10]} (backlog {backlog})\n"
+                    output += "\n"
                 
                 return output
             except Exception as e:
@@ -667,24 +963,28 @@ with gr.Blocks(title="Document Similarity Demo", theme=gr.themes.Soft()) as demo
         
         def display_arxiv_papers():
             try:
-                # Get recent arXiv papers from API collection
-                all_docs = api_collection.get(where={"source": "arxiv_auto"})
+                # Recent arXiv papers come from the index; only the 10 shown
+                # have their metadata fetched from the API collection
+                paper_ids = api_index.lookup(source="arxiv_auto")
                 
-                if not all_docs['ids']:
+                if not paper_ids:
                     return "No arXiv papers added yet."
                 
                 # Sort by added_date (most recent first)
-                papers_with_dates = []
-                for i, doc_id in enumerate(all_docs['ids']):
-                    metadata = all_docs['metadatas'][i]
-                    papers_with_dates.append((metadata.get('added_date', ''), metadata, doc_id))
+                papers_with_dates = sorted(
+                    ((api_index.get(doc_id).get('added_date', ''), doc_id) for doc_id in paper_ids),
+                    reverse=True
+                )
                 
-                papers_with_dates.sort(reverse=True)
+                recent_ids = [doc_id for _, doc_id in papers_with_dates[:10]]
+                recent = api_collection.get(ids=recent_ids, include=["metadatas"])
+                recent_metadata = dict(zip(recent['ids'], recent['metadatas']))
                 
                 output = f"## Recent arXiv Papers ({len(papers_with_dates)} total)\n\n"
                 
                 # Show last 10 papers
-                for added_date, metadata, doc_id in papers_with_dates[:10]:
+                for added_date, doc_id in papers_with_dates[:10]:
+                    metadata = recent_metadata.get(doc_id) or {}
                     title = metadata.get('title', 'Unknown Title')[:100]
                     subject = metadata.get('subject_matter', 'Unknown')
                     arxiv_id = metadata.get('arxiv_id', 'Unknown')
@@ -760,16 +1060,24 @@ def create_api_demo():
             gr.Markdown("""
             **Endpoint**: `GET /api/health`  
             **Authentication**: None required  
-            **Description**: Check API status and document counts
+            **Description**: Check API status and document counts. Answers immediately, even while
+            the model and database are still loading; `ready` says whether they are
             
             ### Response Example:
             ```json
             {
               "status": "healthy",
+              "live": true,
+              "ready": true,
+              "loaded": {"model": true, "encoder": true, "chroma": true, "...": true},
+              "uptime_sec": 41.2,
+              "warm_up_sec": 9.8,
               "api_documents": 42,
               "demo_documents": 7
             }
             ```
+            
+            While loading, `status` is `"starting"`, `ready` is `false` and the counts are omitted.
             """)
             
             with gr.Row():
@@ -833,6 +1141,9 @@ def create_api_demo():
             - `query` (string, required): Search query text
             - `n_results` (integer, optional): Number of results to return (default: 5)
             - `api_key` (string, required): Your API authentication key
+            - `mode` (string, optional): `vector` (default), `hybrid` or `lexical`
+            - `where` (object, optional): Metadata filter, e.g. `{"$and": [{"source": "arxiv_auto"}, {"published": {"$gte": "2024-01-01"}}]}`
+            - `where_document` (object, optional): Text filter, e.g. `{"$contains": "transformer"}`
             
             **Response Example**:
             ```json
@@ -850,6 +1161,29 @@ def create_api_demo():
             ```
             """)
             
+            gr.Markdown("""
+            ### Batch Search
+            **Endpoint**: `POST /api/search_batch`  
+            **Authentication**: Required  
+            **Description**: Run many searches at once; queries are encoded together and sent to the index in one call
+            
+            **Parameters**:
+            - `queries` (list, required): Query strings, or objects with `query`, optional `n_results` and optional `where` metadata filter
+            - `n_results` (integer, optional): Default results per query (default: 5)
+            - `api_key` (string, required): Your API authentication key
+            
+            **Response Example**:
+            ```json
+            {
+              "results": [
+                {"query": "neural networks", "results": [{"id": "doc123", "similarity": 0.81, "content": "...", "metadata": {}}]},
+                {"query": "gradient descent", "where": {"source": "arxiv"}, "results": []}
+              ],
+              "count": 2
+            }
+            ```
+            """)
+            
             gr.Markdown("""
             ### Compare Documents
             **Endpoint**: `POST /api/compare`  
@@ -873,13 +1207,42 @@ def create_api_demo():
             """)
             
             gr.Markdown("""
-            ### List All Documents
-            **Endpoint**: `GET /api/documents`  
+            ### Compare Many Documents
+            **Endpoint**: `POST /api/compare_matrix`  
+            **Authentication**: Required  
+            **Description**: Score every query document against every reference document in one call
+            
+            **Parameters**:
+            - `queries` (list, required): Document texts, or `{"id": "..."}` for stored documents
+            - `references` (list, optional): Same format; if omitted the queries are compared with each other
+            - `top_k` (integer, optional): Best references returned per query (default: 5)
+            - `threshold` (number, optional): Instead of top-k, return every pair scoring at least this
+            - `api_key` (string, required): Your API authentication key
+            
+            **Response Example**:
+            ```json
+            {
+              "queries": [{"index": 0, "preview": "Submitted essay text..."}],
+              "references": [{"index": 0, "id": "a1b2c3d4e5f6g7h8", "preview": "Source paper..."}],
+              "shape": [1, 1],
+              "top_k": 5,
+              "matches": [[{"reference": 0, "similarity": 0.8123}]]
+            }
+            ```
+            """)
+            
+            gr.Markdown("""
+            ### List Documents
+            **Endpoint**: `GET /api/documents` (first page) or `POST /api/documents_page`  
             **Authentication**: Required  
-            **Description**: Retrieve all documents in the database
+            **Description**: Retrieve documents a page at a time
             
             **Parameters**:
             - `api_key` (string, required): Your API authentication key
+            - `limit` (integer, optional): Page size, up to 1000 (default: 100)
+            - `offset` (integer, optional): Position to start from; pass the previous `next_offset`
+            - `fields` (string, optional): Comma-separated `content`, `metadata` (default: both; empty for ids only)
+            - `preview_length` (integer, optional): Truncate content to this many characters
             
             **Response Example**:
             ```json
@@ -891,7 +1254,11 @@ def create_api_demo():
                   "metadata": {"source": "api", "category": "ML"}
                 }
               ],
-              "count": 1
+              "count": 1,
+              "total": 250,
+              "limit": 100,
+              "offset": 0,
+              "next_offset": 100
             }
             ```
             """)
@@ -1027,196 +1394,6 @@ def create_api_demo():
             - **GitHub**: [Source Code](https://github.com/your-repo)
             """)
         
-        # Function definitions for API testing
-        def check_health():
-            return {
-                "status": "healthy", 
-                "api_documents": api_collection.count(),
-                "demo_documents": demo_collection.count()
-            }
-        
-        def api_add_document(content: str, metadata: dict = None, api_key: str = ""):
-            if api_key != API_KEY:
-                return {"error": "Invalid or missing API key"}
-            
-            if not content:
-                return {"error": "Content is required"}
-            
-            doc_id = generate_doc_id(content)
-            existing = api_collection.get(ids=[doc_id])
-            if existing['ids']:
-                return {"message": "Document already exists", "id": doc_id}
-            
-            embedding = model.encode(content).tolist()
-            meta_dict = {"source": "api"}
-            if metadata:
-                meta_dict.update(metadata)
-            
-            api_collection.add(
-                embeddings=[embedding],
-                documents=[content],
-                metadatas=[meta_dict],
-                ids=[doc_id]
-            )
-            
-            return {"message": "Document added", "id": doc_id}
-        
-        def api_search_documents(query: str, n_results: int = 5, api_key: str = ""):
-            if api_key != API_KEY:
-                return {"error": "Invalid or missing API key"}
-            
-            if not query:
-                return {"error": "Query is required"}
-            
-            doc_count = api_collection.count()
-            if doc_count == 0:
-                return {"results": [], "message": "No documents in database"}
-            
-            n_results = max(1, min(n_results, doc_count))
-            query_embedding = model.encode(query).tolist()
-            
-            results = api_collection.query(
-                query_embeddings=[query_embedding],
-                n_results=n_results
-            )
-            
-            formatted_results = []
-            for i in range(len(results['ids'][0])):
-                formatted_results.append({
-                    "id": results['ids'][0][i],
-                    "similarity": 1 - results['distances'][0][i],
-                    "content": results['documents'][0][i],
-                    "metadata": results['metadatas'][0][i]
-                })
-            
-            return {"results": formatted_results, "query": query}
-        
-        def api_compare_documents(doc1: str, doc2: str, api_key: str = ""):
-            if api_key != API_KEY:
-                return {"error": "Invalid or missing API key"}
-            
-            if not doc1 or not doc2:
-                return {"error": "Both documents are required"}
-            
-            embedding1 = model.encode(doc1)
-            embedding2 = model.encode(doc2)
-            
-            from numpy import dot
-            from numpy.linalg import norm
-            
-            similarity = float(dot(embedding1, embedding2) / (norm(embedding1) * norm(embedding2)))
-            
-            return {
-                "similarity": similarity,
-                "percentage": similarity * 100,
-                "doc1_preview": doc1[:100],
-                "doc2_preview": doc2[:100]
-            }
-        
-        def api_list_documents(api_key: str = ""):
-            if api_key != API_KEY:
-                return {"error": "Invalid or missing API key"}
-            
-            all_docs = api_collection.get()
-            
-            documents = []
-            for i in range(len(all_docs['ids'])):
-                documents.append({
-                    "id": all_docs['ids'][i],
-                    "content": all_docs['documents'][i],
-                    "metadata": all_docs['metadatas'][i]
-                })
-            
-            return {"documents": documents, "count": len(documents)}
-        
-        def api_delete_document(doc_id: str, api_key: str = ""):
-            if api_key != API_KEY:
-                return {"error": "Invalid or missing API key"}
-            
-            try:
-                existing = api_collection.get(ids=[doc_id])
-                if not existing['ids']:
-                    return {"error": "Document not found"}
-                
-                api_collection.delete(ids=[doc_id])
-                return {"message": "Document deleted", "id": doc_id}
-                
-            except Exception as e:
-                return {"error": f"Failed to delete document: {str(e)}"}
-        
-        def api_add_pdf_document(pdf_file, metadata: dict = None, api_key: str = ""):
-            if api_key != API_KEY:
-                return {"error": "Invalid or missing API key"}
-            
-            if pdf_file is None:
-                return {"error": "No PDF file provided"}
-            
-            try:
-                with open(pdf_file.name, 'rb') as f:
-                    pdf_bytes = f.read()
-                
-                extracted_text = extract_text_from_pdf(pdf_bytes)
-                
-                if not extracted_text.strip():
-                    return {"error": "No text found in PDF"}
-                
-                meta_dict = {"source": "pdf_upload", "filename": pdf_file.name.split('/')[-1]}
-                if metadata:
-                    meta_dict.update(metadata)
-                
-                meta_dict["text_length"] = len(extracted_text)
-                meta_dict["pages"] = len(extracted_text.split('\n\n'))
-                
-                doc_id = generate_doc_id(extracted_text)
-                existing = api_collection.get(ids=[doc_id])
-                if existing['ids']:
-                    return {"message": "Document already exists", "id": doc_id, "filename": pdf_file.name}
-                
-                embedding = model.encode(extracted_text).tolist()
-                
-                api_collection.add(
-                    embeddings=[embedding],
-                    documents=[extracted_text],
-                    metadatas=[meta_dict],
-                    ids=[doc_id]
-                )
-                
-                return {
-                    "message": "PDF processed and document added",
-                    "id": doc_id,
-                    "filename": pdf_file.name.split('/')[-1],
-                    "text_length": len(extracted_text),
-                    "pages": meta_dict["pages"]
-                }
-                
-            except Exception as e:
-                return {"error": f"Failed to process PDF: {str(e)}"}
-        
-        def trigger_fetch(max_papers, api_key=""):
-            # Determine which storage to use based on API key
-            if api_key == API_KEY:
-                # Authenticated: production API storage, normal limits
-                if max_papers < 1 or max_papers > 50:
-                    return {"error": "Papers count must be between 1 and 50"}
-                storage_type = "API storage (production)"
-                # For now, just simulate - we'd need to modify fetch_arxiv_papers to accept target collection
-                result = f"Would fetch {max_papers} papers to API storage (production data)"
-            else:
-                # Public demo: limit to 1 paper only
-                if max_papers != 1:
-                    return {"error": "Public demo limited to 1 paper. Use API key for higher limits."}
-                storage_type = "Demo storage (public)"
-                result = "Would fetch 1 paper to demo storage (public playground)"
-                max_papers = 1  # Enforce limit
-            
-            return {
-                "message": result,
-                "storage_used": storage_type,
-                "papers_requested": max_papers,
-                "authenticated": api_key == API_KEY,
-                "limit_applied": "1 paper max" if api_key != API_KEY else f"{max_papers} papers max"
-            }
-        
         # Connect button handlers
         health_btn.click(check_health, outputs=health_output)
         fetch_papers_btn.click(trigger_fetch, inputs=[fetch_papers_input, api_key_input], outputs=fetch_output)
@@ -1236,207 +1413,31 @@ with demo:
     hidden_list_btn = gr.Button("List Documents", visible=False)
     hidden_delete_btn = gr.Button("Delete Document", visible=False)
     hidden_pdf_btn = gr.Button("Add PDF", visible=False)
+    hidden_add_batch_btn = gr.Button("Add Documents Batch", visible=False)
+    hidden_lookup_btn = gr.Button("Lookup Documents", visible=False)
+    hidden_list_page_btn = gr.Button("List Documents Page", visible=False)
+    hidden_compare_matrix_btn = gr.Button("Compare Matrix", visible=False)
+    hidden_search_batch_btn = gr.Button("Search Batch", visible=False)
+    hidden_near_duplicates_btn = gr.Button("Near Duplicates", visible=False)
+    hidden_locate_btn = gr.Button("Locate Passages", visible=False)
     
     # Hidden outputs for API endpoints
     hidden_output = gr.JSON(visible=False)
     
-    # Function definitions for API endpoints
-    def check_health():
-        return {
-            "status": "healthy", 
-            "api_documents": api_collection.count(),
-            "demo_documents": demo_collection.count()
-        }
-    
-    def api_add_document(content: str, metadata: dict = None, api_key: str = ""):
-        if api_key != API_KEY:
-            return {"error": "Invalid or missing API key"}
-        
-        if not content:
-            return {"error": "Content is required"}
-        
-        doc_id = generate_doc_id(content)
-        existing = api_collection.get(ids=[doc_id])
-        if existing['ids']:
-            return {"message": "Document already exists", "id": doc_id}
-        
-        embedding = model.encode(content).tolist()
-        meta_dict = {"source": "api"}
-        if metadata:
-            meta_dict.update(metadata)
-        
-        api_collection.add(
-            embeddings=[embedding],
-            documents=[content],
-            metadatas=[meta_dict],
-            ids=[doc_id]
-        )
-        
-        return {"message": "Document added", "id": doc_id}
-    
-    def api_search_documents(query: str, n_results: int = 5, api_key: str = ""):
-        if api_key != API_KEY:
-            return {"error": "Invalid or missing API key"}
-        
-        if not query:
-            return {"error": "Query is required"}
-        
-        doc_count = api_collection.count()
-        if doc_count == 0:
-            return {"results": [], "message": "No documents in database"}
-        
-        n_results = max(1, min(n_results, doc_count))
-        query_embedding = model.encode(query).tolist()
-        
-        results = api_collection.query(
-            query_embeddings=[query_embedding],
-            n_results=n_results
-        )
-        
-        formatted_results = []
-        for i in range(len(results['ids'][0])):
-            formatted_results.append({
-                "id": results['ids'][0][i],
-                "similarity": 1 - results['distances'][0][i],
-                "content": results['documents'][0][i],
-                "metadata": results['metadatas'][0][i]
-            })
-        
-        return {"results": formatted_results, "query": query}
-    
-    def api_compare_documents(doc1: str, doc2: str, api_key: str = ""):
-        if api_key != API_KEY:
-            return {"error": "Invalid or missing API key"}
-        
-        if not doc1 or not doc2:
-            return {"error": "Both documents are required"}
-        
-        embedding1 = model.encode(doc1)
-        embedding2 = model.encode(doc2)
-        
-        from numpy import dot
-        from numpy.linalg import norm
-        
-        similarity = float(dot(embedding1, embedding2) / (norm(embedding1) * norm(embedding2)))
-        
-        return {
-            "similarity": similarity,
-            "percentage": similarity * 100,
-            "doc1_preview": doc1[:100],
-            "doc2_preview": doc2[:100]
-        }
-    
-    def api_list_documents(api_key: str = ""):
-        if api_key != API_KEY:
-            return {"error": "Invalid or missing API key"}
-        
-        all_docs = api_collection.get()
-        
-        documents = []
-        for i in range(len(all_docs['ids'])):
-            documents.append({
-                "id": all_docs['ids'][i],
-                "content": all_docs['documents'][i],
-                "metadata": all_docs['metadatas'][i]
-            })
-        
-        return {"documents": documents, "count": len(documents)}
-    
-    def api_delete_document(doc_id: str, api_key: str = ""):
-        if api_key != API_KEY:
-            return {"error": "Invalid or missing API key"}
-        
-        try:
-            existing = api_collection.get(ids=[doc_id])
-            if not existing['ids']:
-                return {"error": "Document not found"}
-            
-            api_collection.delete(ids=[doc_id])
-            return {"message": "Document deleted", "id": doc_id}
-            
-        except Exception as e:
-            return {"error": f"Failed to delete document: {str(e)}"}
-    
-    def api_add_pdf_document(pdf_file, metadata: dict = None, api_key: str = ""):
-        if api_key != API_KEY:
-            return {"error": "Invalid or missing API key"}
-        
-        if pdf_file is None:
-            return {"error": "No PDF file provided"}
-        
-        try:
-            with open(pdf_file.name, 'rb') as f:
-                pdf_bytes = f.read()
-            
-            extracted_text = extract_text_from_pdf(pdf_bytes)
-            
-            if not extracted_text.strip():
-                return {"error": "No text found in PDF"}
-            
-            meta_dict = {"source": "pdf_upload", "filename": pdf_file.name.split('/')[-1]}
-            if metadata:
-                meta_dict.update(metadata)
-            
-            meta_dict["text_length"] = len(extracted_text)
-            meta_dict["pages"] = len(extracted_text.split('\n\n'))
-            
-            doc_id = generate_doc_id(extracted_text)
-            existing = api_collection.get(ids=[doc_id])
-            if existing['ids']:
-                return {"message": "Document already exists", "id": doc_id, "filename": pdf_file.name}
-            
-            embedding = model.encode(extracted_text).tolist()
-            
-            api_collection.add(
-                embeddings=[embedding],
-                documents=[extracted_text],
-                metadatas=[meta_dict],
-                ids=[doc_id]
-            )
-            
-            return {
-                "message": "PDF processed and document added",
-                "id": doc_id,
-                "filename": pdf_file.name.split('/')[-1],
-                "text_length": len(extracted_text),
-                "pages": meta_dict["pages"]
-            }
-            
-        except Exception as e:
-            return {"error": f"Failed to process PDF: {str(e)}"}
-    
-    def trigger_fetch(max_papers, api_key=""):
-        # Determine which storage to use based on API key
-        if api_key == API_KEY:
-            # Authenticated: production API storage, normal limits
-            if max_papers < 1 or max_papers > 50:
-                return {"error": "Papers count must be between 1 and 50"}
-            storage_type = "API storage (production)"
-            # For now, just simulate - we'd need to modify fetch_arxiv_papers to accept target collection
-            result = f"Would fetch {max_papers} papers to API storage (production data)"
-        else:
-            # Public demo: limit to 1 paper only
-            if max_papers != 1:
-                return {"error": "Public demo limited to 1 paper. Use API key for higher limits."}
-            storage_type = "Demo storage (public)"
-            result = "Would fetch 1 paper to demo storage (public playground)"
-            max_papers = 1  # Enforce limit
-        
-        return {
-            "message": result,
-            "storage_used": storage_type,
-            "papers_requested": max_papers,
-            "authenticated": api_key == API_KEY,
-            "limit_applied": "1 paper max" if api_key != API_KEY else f"{max_papers} papers max"
-        }
-    
     # Register the API endpoints
     hidden_add_btn.click(api_add_document, inputs=[gr.Textbox(visible=False), gr.JSON(visible=False), gr.Textbox(visible=False)], outputs=hidden_output, api_name="add")
-    hidden_search_btn.click(api_search_documents, inputs=[gr.Textbox(visible=False), gr.Number(visible=False), gr.Textbox(visible=False)], outputs=hidden_output, api_name="search")
+    hidden_search_btn.click(api_search_documents, inputs=[gr.Textbox(visible=False), gr.Number(visible=False), gr.Textbox(visible=False), gr.Textbox(visible=False), gr.JSON(visible=False), gr.JSON(visible=False)], outputs=hidden_output, api_name="search")
     hidden_compare_btn.click(api_compare_documents, inputs=[gr.Textbox(visible=False), gr.Textbox(visible=False), gr.Textbox(visible=False)], outputs=hidden_output, api_name="compare")
     hidden_list_btn.click(api_list_documents, inputs=[gr.Textbox(visible=False)], outputs=hidden_output, api_name="documents")
     hidden_delete_btn.click(api_delete_document, inputs=[gr.Textbox(visible=False), gr.Textbox(visible=False)], outputs=hidden_output, api_name="delete")
     hidden_pdf_btn.click(api_add_pdf_document, inputs=[gr.File(visible=False), gr.JSON(visible=False), gr.Textbox(visible=False)], outputs=hidden_output, api_name="add_pdf")
+    hidden_add_batch_btn.click(api_add_documents_batch, inputs=[gr.Textbox(visible=False), gr.Textbox(visible=False)], outputs=hidden_output, api_name="add_batch")
+    hidden_list_page_btn.click(api_list_documents, inputs=[gr.Textbox(visible=False), gr.Number(visible=False), gr.Number(visible=False), gr.Textbox(visible=False), gr.Number(visible=False)], outputs=hidden_output, api_name="documents_page")
+    hidden_lookup_btn.click(api_lookup_documents, inputs=[gr.JSON(visible=False), gr.Textbox(visible=False)], outputs=hidden_output, api_name="lookup")
+    hidden_compare_matrix_btn.click(api_compare_matrix, inputs=[gr.JSON(visible=False), gr.JSON(visible=False), gr.Number(visible=False), gr.Number(visible=False), gr.Textbox(visible=False)], outputs=hidden_output, api_name="compare_matrix")
+    hidden_search_batch_btn.click(api_search_batch, inputs=[gr.JSON(visible=False), gr.Number(visible=False), gr.Textbox(visible=False)], outputs=hidden_output, api_name="search_batch")
+    hidden_near_duplicates_btn.click(api_near_duplicates, inputs=[gr.Textbox(visible=False), gr.Number(visible=False), gr.Number(visible=False), gr.Textbox(visible=False)], outputs=hidden_output, api_name="near_duplicates")
+    hidden_locate_btn.click(api_locate_passages, inputs=[gr.Textbox(visible=False), gr.Textbox(visible=False), gr.Number(visible=False), gr.Textbox(visible=False)], outputs=hidden_output, api_name="locate")
     
     # Also register health and arxiv_fetch endpoints
     gr.Button("Health", visible=False).click(check_health, outputs=hidden_output, api_name="health")
@@ -1634,11 +1635,19 @@ with demo:
         | `/api/health` | GET | None | Health check and document counts |
         | `/api/add` | POST | Required | Add text document |
         | `/api/add_pdf` | POST | Required | Upload and process PDF |
-        | `/api/search` | POST | Required | Search similar documents |
+        | `/api/add_batch` | POST | Required | Add many documents (JSON array or NDJSON) |
+        | `/api/lookup` | POST | Required | Document ids by `arxiv_id`, `source` and/or `subject_matter` |
+        | `/api/search` | POST | Required | Search similar documents, optionally filtered by `where` metadata and `where_document` text |
+        | `/api/search_batch` | POST | Required | Run up to 50 searches (each with its own `n_results` and `where`) in one call |
         | `/api/compare` | POST | Required | Compare two documents |
-        | `/api/documents` | GET | Required | List all documents |
+        | `/api/compare_matrix` | POST | Required | Compare N documents against M (texts or stored ids): top-k per row or pairs above a threshold |
+        | `/api/locate` | POST | Required | Aligned passage pairs between a submission and a stored document |
+        | `/api/near_duplicates` | POST | Required | Stored documents lexically close to a text (MinHash/LSH, no embedding) |
+        | `/api/documents` | GET | Required | First page of documents (100) |
+        | `/api/documents_page` | POST | Required | Page of documents: `limit`, `offset`, `fields`, `preview_length` |
         | `/api/delete` | DELETE | Required | Delete document |
         | `/api/arxiv_fetch` | POST | Optional | Fetch arXiv papers |
+        | `/metrics` (port `METRICS_PORT`, 9464) | GET | None | Prometheus histograms of per-stage latency (encode, Chroma, PDF extraction, arXiv) and requests |
         
         ## 📝 NextJS Integration Examples
         
@@ -1692,4 +1701,8 @@ with demo:
         """)
 
 if __name__ == "__main__":
+    # /metrics gets its own port so Gradio keeps its own launch and bind
+    # behaviour; it binds wherever Gradio does
+    if METRICS_PORT:
+        serve_metrics(METRICS_PORT, os.environ.get('GRADIO_SERVER_NAME', '127.0.0.1'))
     demo.launch()
\ No newline at end of file
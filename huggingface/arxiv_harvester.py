@@ -0,0 +1,166 @@
+"""
+Concurrent arXiv harvesting.
+
+fetch_arxiv_papers used to run every query, download and encode back to back
+with a fixed sleep between papers. The harvester overlaps the stages instead:
+
+    search (thread pool) -> download + extract (bounded thread pool) -> store (caller's thread)
+
+All HTTP traffic goes through one pooled requests.Session and a shared token
+bucket, so concurrency never raises the request rate. arXiv's API terms ask
+for at most one request every three seconds, which is the default; the
+overlap still hides download and extraction time behind that wait.
+Storing stays on the calling thread so Chroma only ever sees one writer.
+
+ARXIV_API_URL can point at a local stand-in server that serves Atom feeds and
+PDFs for testing; PDF links are taken from the feed entries.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+import requests
+from requests.adapters import HTTPAdapter
+
+ARXIV_API_URL = os.environ.get('ARXIV_API_URL', 'https://export.arxiv.org/api/query')
+# arXiv asks for no more than one request every three seconds, without bursts
+ARXIV_RATE_PER_SEC = float(os.environ.get('ARXIV_RATE_PER_SEC', str(1 / 3)))
+ARXIV_BURST = int(os.environ.get('ARXIV_BURST', '1'))
+ARXIV_SEARCH_WORKERS = int(os.environ.get('ARXIV_SEARCH_WORKERS', '2'))
+ARXIV_DOWNLOAD_WORKERS = int(os.environ.get('ARXIV_DOWNLOAD_WORKERS', '4'))
+
+
+# Bounds used when only one side of a submittedDate range is known
+_EARLIEST_SUBMISSION = "199101010000"
+_LATEST_SUBMISSION = "209912312359"
+
+
+def arxiv_timestamp(published: str) -> str:
+    """Convert an Atom published timestamp (2024-01-15T10:30:00Z) to arXiv's YYYYMMDDHHMM"""
+    digits = "".join(ch for ch in published if ch.isdigit())
+    return digits[:12]
+
+
+def submitted_date_query(query: str, after: str = "", before: str = "") -> str:
+    """Restrict a search_query to papers submitted between two published timestamps"""
+    if not after and not before:
+        return query
+    low = arxiv_timestamp(after) if after else _EARLIEST_SUBMISSION
+    high = arxiv_timestamp(before) if before else _LATEST_SUBMISSION
+    return f"({query}) AND submittedDate:[{low} TO {high}]"
+
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a token is available"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimitedClient:
+    """Pooled HTTP session whose requests all draw from one token bucket"""
+
+    def __init__(self, limiter: TokenBucket, pool_size: int = ARXIV_DOWNLOAD_WORKERS + ARXIV_SEARCH_WORKERS):
+        self.limiter = limiter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        self.limiter.acquire()
+        response = self.session.get(url, **kwargs)
+        response.raise_for_status()
+        return response
+
+
+def harvest(jobs: List[Dict],
+            search: Callable[[Dict], List[Dict]],
+            fetch: Callable[[Dict], str],
+            store: Callable[[Dict, Dict, str], tuple],
+            search_workers: int = ARXIV_SEARCH_WORKERS,
+            download_workers: int = ARXIV_DOWNLOAD_WORKERS) -> List[Dict]:
+    """Run search -> fetch -> store for every job with the stages overlapped.
+
+    search(job) returns the papers to fetch for a job (already filtered for
+    papers we have), fetch(paper) downloads and extracts a paper's text, and
+    store(job, paper, text) writes it and returns (success, message). Returns
+    one report per job, in job order, with "messages", "added" and "error",
+    plus the papers that are "settled" (store returned, whether it added the
+    paper or skipped it for good) and those that "failed" (fetch or store
+    raised, so a later run should retry them).
+    """
+    reports = [
+        {"job": job, "messages": [], "added": 0, "error": None, "settled": [], "failed": []}
+        for job in jobs
+    ]
+    events = queue.Queue()
+
+    with ThreadPoolExecutor(max_workers=max(1, search_workers)) as search_pool, \
+            ThreadPoolExecutor(max_workers=max(1, download_workers)) as download_pool:
+
+        def run_search(index):
+            # Runs on a search worker; hands each paper straight to the
+            # download pool so downloads start before other searches finish
+            try:
+                papers = search(jobs[index])
+            except Exception as e:
+                events.put(("searched", index, 0, e))
+                return
+            for paper in papers:
+                future = download_pool.submit(fetch, paper)
+                future.add_done_callback(lambda f, p=paper: events.put(("fetched", index, p, f)))
+            events.put(("searched", index, len(papers), None))
+
+        for index in range(len(jobs)):
+            search_pool.submit(run_search, index)
+
+        searches_left = len(jobs)
+        fetches_left = 0
+        while searches_left or fetches_left:
+            kind, index, payload, extra = events.get()
+            report = reports[index]
+
+            if kind == "searched":
+                searches_left -= 1
+                fetches_left += payload
+                if extra is not None:
+                    report["error"] = str(extra)
+                elif payload == 0:
+                    report["messages"].append("No new papers found")
+                continue
+
+            fetches_left -= 1
+            paper = payload
+            try:
+                text = extra.result()
+                success, message = store(report["job"], paper, text)
+                report["settled"].append(paper)
+            except Exception as e:
+                success, message = False, f"❌ Error processing {paper.get('arxiv_id', 'unknown')}: {str(e)}"
+                report["failed"].append(paper)
+            report["messages"].append(message)
+            if success:
+                report["added"] += 1
+
+    return reports
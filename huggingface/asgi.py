@@ -0,0 +1,438 @@
+"""
+ASGI variant of the document API (api.py).
+
+Serves every route of the Flask app (/add, /add_batch, /search,
+/search_batch, /compare, /compare_matrix, /locate, /near_duplicates,
+/documents, /clear, /health, the /health/live and /health/ready probes and
+/metrics) with the same request and response shapes, on the same
+DocumentEngine. The event loop
+never blocks:
+
+- Search and compare await their encodes through the batching engine's
+  asyncio front end (aencode), so concurrent requests share forward passes
+  without holding a thread while they wait. The rest of the engine's calls
+  (Chroma, sqlite) run on a thread pool.
+- At most ASGI_MAX_INFLIGHT encode-bound requests are admitted at once.
+  Past that the server answers 429 with Retry-After, so latency for admitted
+  requests stays flat instead of every request slowing down together. The
+  thread pool has ASGI_THREADS threads (ASGI_MAX_INFLIGHT + 8 by default), so
+  every admitted request gets a thread.
+
+Run with:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8080
+    python asgi.py                      # same, ASGI_WORKERS processes
+
+One worker process serves many concurrent clients through one model copy.
+More workers each load their own model. Preloading it with
+`gunicorn -k uvicorn.workers.UvicornWorker --preload` and ASGI_PRELOAD_MODEL=1
+shares the weights copy-on-write. A local PersistentClient must only be opened
+by one process, so several workers need a Chroma server (CHROMA_HOST).
+"""
+
+import json
+import os
+from contextlib import asynccontextmanager
+
+import anyio.from_thread
+import anyio.to_thread
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from bulk_ingest import parse_ndjson
+from document_engine import DocumentEngine
+from lazy import WARM_UP, WarmUp
+from listing import DEFAULT_PAGE_SIZE
+from metrics import CONTENT_TYPE, finish_request, render as render_metrics, start_request
+
+API_KEY = os.environ.get('API_KEY', 'your-secret-api-key-here')
+ASGI_MAX_INFLIGHT = int(os.environ.get('ASGI_MAX_INFLIGHT', '64'))
+# Worker threads for engine calls: one per admitted request, plus headroom for
+# the routes that aren't admission-controlled (/documents, /clear, /health)
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', str(ASGI_MAX_INFLIGHT + 8)))
+ASGI_WORKERS = int(os.environ.get('ASGI_WORKERS', '1'))
+ASGI_PRELOAD_MODEL = os.environ.get('ASGI_PRELOAD_MODEL', '0').lower() in ('1', 'true', 'yes')
+CHROMA_HOST = os.environ.get('CHROMA_HOST', '')
+CHROMA_PORT = int(os.environ.get('CHROMA_PORT', '8000'))
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+EMBEDDING_CACHE_PATH = os.environ.get('EMBEDDING_CACHE_PATH', '/tmp/embedding_cache.db')
+NEAR_DUP_PATH = os.environ.get('NEAR_DUP_PATH', '/tmp/near_duplicates.db')
+LEXICAL_PATH = os.environ.get('LEXICAL_PATH', '/tmp/lexical_index.db')
+CHROMA_PATH = os.environ.get('CHROMA_PATH', '/tmp/chroma_db')
+COMPACT_STORE_PATH = os.environ.get('COMPACT_STORE_PATH', '/tmp/compact_store.db')
+
+# Same engine as api.py; the warm-up starts in lifespan so each worker
+# process builds its own encoder thread and Chroma connection
+engine = DocumentEngine(
+    MODEL_NAME,
+    persist_dir=CHROMA_PATH,
+    cache_path=EMBEDDING_CACHE_PATH,
+    collection_name="documents",
+    indexed=True,
+    near_dup_path=NEAR_DUP_PATH,
+    lexical_path=LEXICAL_PATH,
+    compact_path=COMPACT_STORE_PATH,
+    chroma_host=CHROMA_HOST,
+    chroma_port=CHROMA_PORT
+)
+
+warm_up = WarmUp(engine.resources(), after=lambda: engine.model.encode(["warm up"]))
+
+if ASGI_PRELOAD_MODEL:
+    # Load weights in the parent so forked workers share them; nothing is
+    # encoded before the fork
+    engine.model.resolve()
+
+
+class Backpressure:
+    """Counts admitted requests and refuses new ones past a limit"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.inflight = 0
+        self.rejected = 0
+
+    def try_acquire(self) -> bool:
+        # Only touched from the event loop thread, so no lock is needed
+        if self.inflight >= self.limit:
+            self.rejected += 1
+            return False
+        self.inflight += 1
+        return True
+
+    def release(self):
+        self.inflight -= 1
+
+
+backpressure = Backpressure(ASGI_MAX_INFLIGHT)
+
+
+def error(message: str, status_code: int, headers: dict = None) -> JSONResponse:
+    return JSONResponse({"error": message}, status_code=status_code, headers=headers)
+
+
+def require_api_key(handler):
+    async def wrapped(request: Request):
+        api_key = request.headers.get('X-API-Key') or request.query_params.get('api_key')
+        if not api_key or api_key != API_KEY:
+            return error('Invalid or missing API key', 401)
+        return await handler(request)
+    return wrapped
+
+
+def admitted(handler):
+    """Shed load with 429 once ASGI_MAX_INFLIGHT encode-bound requests are running"""
+    async def wrapped(request: Request):
+        if not warm_up.ready:
+            return error("Service is starting", 503, {"Retry-After": "5"})
+        if not backpressure.try_acquire():
+            return error("Too many requests in flight, retry shortly", 429, {"Retry-After": "1"})
+        try:
+            return await handler(request)
+        finally:
+            backpressure.release()
+    return wrapped
+
+
+def timed(endpoint: str):
+    """Request metrics for a route; ?timings=1 adds the per-stage Server-Timing header"""
+    def decorate(handler):
+        async def wrapped(request: Request):
+            # Engine calls on the thread pool run in a copy of this context,
+            # so their stages still add up into these timings
+            timings, token = start_request(endpoint)
+            status = 500
+            try:
+                response = await handler(request)
+                status = response.status_code
+            finally:
+                finish_request(timings, token, status)
+            if request.query_params.get('timings', '').lower() in ('1', 'true', 'yes'):
+                response.headers['Server-Timing'] = timings.server_timing()
+            return response
+        return wrapped
+    return decorate
+
+
+async def read_json(request: Request) -> dict:
+    try:
+        data = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def body_lines(request: Request):
+    """The request body's lines as they arrive; iterated on a worker thread"""
+    chunks = request.stream().__aiter__()
+    pending = b""
+    while True:
+        try:
+            chunk = anyio.from_thread.run(chunks.__anext__)
+        except StopAsyncIteration:
+            break
+        *lines, pending = (pending + chunk).split(b"\n")
+        yield from lines
+    if pending:
+        yield pending
+
+
+async def health(request: Request):
+    status = warm_up.status()
+    if not status["ready"]:
+        return JSONResponse({"status": "starting", **status})
+    documents = await run_in_threadpool(engine.count)
+    return JSONResponse({
+        "status": "healthy",
+        **status,
+        "documents": documents,
+        "inflight": backpressure.inflight,
+        "rejected": backpressure.rejected
+    })
+
+
+async def liveness(request: Request):
+    return JSONResponse({"status": "alive"})
+
+
+async def readiness(request: Request):
+    status = warm_up.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+async def metrics(request: Request):
+    return Response(render_metrics(), media_type=CONTENT_TYPE)
+
+
+@timed("add")
+@require_api_key
+@admitted
+async def add_document(request: Request):
+    data = await read_json(request)
+    if data is None:
+        return error("Expected a JSON object", 400)
+
+    try:
+        result = await run_in_threadpool(engine.add_document, data.get('content', ''), data.get('metadata', {}))
+    except ValueError as e:
+        return error(str(e), 400)
+
+    near_duplicate = {key: result[key] for key in ("near_duplicate_of", "jaccard") if key in result}
+    if not result["added"]:
+        message = "Near-duplicate already exists" if near_duplicate else "Document already exists"
+        return JSONResponse({"message": message, "id": result["id"], **near_duplicate}, status_code=200)
+    return JSONResponse({"message": "Document added", "id": result["id"], **near_duplicate}, status_code=201)
+
+
+@timed("add_batch")
+@require_api_key
+@admitted
+async def add_documents_batch(request: Request):
+    # A JSON array is parsed up front; anything else is read as NDJSON
+    # straight off the request stream so large uploads aren't buffered
+    if request.headers.get('content-type', '').startswith('application/json'):
+        try:
+            items = await request.json()
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            items = None
+        if not isinstance(items, list):
+            return error("Expected a JSON array of documents", 400)
+    else:
+        items = parse_ndjson(body_lines(request))
+
+    # Starlette iterates sync generators on its thread pool
+    def generate():
+        for result in engine.add_documents(items):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(generate(), media_type='application/x-ndjson')
+
+
+@timed("search")
+@require_api_key
+@admitted
+async def search(request: Request):
+    data = await read_json(request)
+    if data is None:
+        return error("Expected a JSON object", 400)
+
+    query = data.get('query', '')
+    try:
+        # The encode is awaited on the loop; only the index and Chroma reads
+        # take a thread. An empty query is left for the engine to reject
+        embedding = await engine.encoder.aencode(query) if isinstance(query, str) and query.strip() else None
+        return JSONResponse(await run_in_threadpool(
+            engine.search, query, data.get('n_results', 5),
+            where=data.get('where'), mode=data.get('mode'), where_document=data.get('where_document'),
+            query_embedding=embedding
+        ))
+    except ValueError as e:
+        return error(str(e), 400)
+
+
+@timed("search_batch")
+@require_api_key
+@admitted
+async def search_batch(request: Request):
+    data = await read_json(request)
+    if data is None:
+        return error("Expected a JSON object", 400)
+
+    try:
+        return JSONResponse(await run_in_threadpool(engine.search_batch, data.get('queries'), data.get('n_results', 5)))
+    except (TypeError, ValueError) as e:
+        return error(str(e), 400)
+
+
+@timed("compare")
+@require_api_key
+@admitted
+async def compare(request: Request):
+    data = await read_json(request)
+    if data is None:
+        return error("Expected a JSON object", 400)
+
+    doc1, doc2 = data.get('doc1', ''), data.get('doc2', '')
+    if not all(isinstance(doc, str) and doc.strip() for doc in (doc1, doc2)):
+        return error("Both documents are required", 400)
+    # Nothing but the encode is slow here, and it is awaited, not run on a thread
+    return JSONResponse(engine.compare(doc1, doc2, embeddings=await engine.encoder.aencode([doc1, doc2])))
+
+
+@timed("compare_matrix")
+@require_api_key
+@admitted
+async def compare_matrix(request: Request):
+    data = await read_json(request)
+    if data is None:
+        return error("Expected a JSON object", 400)
+
+    try:
+        return JSONResponse(await run_in_threadpool(
+            engine.compare_matrix, data.get('queries') or [], data.get('references') or [],
+            top_k=data.get('top_k'), threshold=data.get('threshold')
+        ))
+    except KeyError as e:
+        return error(e.args[0], 404)
+    except (TypeError, ValueError) as e:
+        return error(str(e), 400)
+
+
+@timed("locate")
+@require_api_key
+@admitted
+async def locate_passages(request: Request):
+    data = await read_json(request)
+    if data is None:
+        return error("Expected a JSON object", 400)
+
+    try:
+        return JSONResponse(await run_in_threadpool(
+            engine.locate_passages, data.get('content', ''), data.get('id', ''), data.get('threshold')
+        ))
+    except KeyError as e:
+        return error(e.args[0], 404)
+    except (TypeError, ValueError) as e:
+        return error(str(e), 400)
+
+
+@timed("near_duplicates")
+@require_api_key
+async def near_duplicates(request: Request):
+    data = await read_json(request)
+    if data is None:
+        return error("Expected a JSON object", 400)
+
+    try:
+        return JSONResponse(await run_in_threadpool(
+            engine.near_duplicate_candidates, data.get('content', ''), data.get('threshold'), data.get('limit', 20)
+        ))
+    except (TypeError, ValueError) as e:
+        return error(str(e), 400)
+
+
+@timed("documents")
+@require_api_key
+async def get_all_documents(request: Request):
+    params = request.query_params
+    fields = params.get('fields')
+    try:
+        limit = int(params.get('limit', DEFAULT_PAGE_SIZE))
+        offset = int(params.get('offset', 0))
+        preview_length = int(params.get('preview_length', 0)) or None
+
+        if params.get('stream', '').lower() in ('1', 'true', 'yes'):
+            documents = engine.iter_documents(offset, fields, preview_length)
+
+            # Starlette iterates sync generators on its thread pool
+            def generate():
+                for document in documents:
+                    yield json.dumps(document) + "\n"
+
+            return StreamingResponse(generate(), media_type='application/x-ndjson')
+
+        return JSONResponse(await run_in_threadpool(engine.list_documents, limit, offset, fields, preview_length))
+    except ValueError as e:
+        return error(str(e), 400)
+
+
+@timed("clear")
+@require_api_key
+async def clear_database(request: Request):
+    await run_in_threadpool(engine.clear)
+    return JSONResponse({"message": "Database cleared"})
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # run_in_threadpool shares anyio's default limiter, 40 threads unless
+    # raised. Requests admitted past that would queue behind it unseen
+    # instead of getting a 429
+    anyio.to_thread.current_default_thread_limiter().total_tokens = ASGI_THREADS
+    # Without a warm-up, resources load on first request
+    if WARM_UP:
+        warm_up.start()
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route('/health', health, methods=['GET']),
+        Route('/health/live', liveness, methods=['GET']),
+        Route('/health/ready', readiness, methods=['GET']),
+        Route('/metrics', metrics, methods=['GET']),
+        Route('/add', add_document, methods=['POST']),
+        Route('/add_batch', add_documents_batch, methods=['POST']),
+        Route('/search', search, methods=['POST']),
+        Route('/search_batch', search_batch, methods=['POST']),
+        Route('/compare', compare, methods=['POST']),
+        Route('/compare_matrix', compare_matrix, methods=['POST']),
+        Route('/locate', locate_passages, methods=['POST']),
+        Route('/near_duplicates', near_duplicates, methods=['POST']),
+        Route('/documents', get_all_documents, methods=['GET']),
+        Route('/clear', clear_database, methods=['DELETE'])
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    workers = ASGI_WORKERS
+    if workers > 1 and not CHROMA_HOST:
+        print("⚠️ A local Chroma database can only be opened by one process; set CHROMA_HOST to run several workers")
+        workers = 1
+    uvicorn.run(
+        "asgi:app",
+        host='0.0.0.0',
+        port=int(os.environ.get('PORT', 8080)),
+        workers=workers
+    )
@@ -0,0 +1,105 @@
+"""
+Batched semantic search.
+
+A manuscript upload fans out into 10-20 searches, each of which paid for its
+own encode call and its own HNSW query. search_batch encodes every query text
+in one call and runs all queries sharing a filter together: as a single
+multi-vector Chroma query, or as one matrix product when the filter is
+selective enough for an exact scan (see filtered_search).
+"""
+
+import json
+import os
+from typing import Dict, List
+
+from filtered_search import filtered_search_many, plan_search
+
+SEARCH_BATCH_MAX_QUERIES = int(os.environ.get('SEARCH_BATCH_MAX_QUERIES', '50'))
+DEFAULT_N_RESULTS = 5
+
+
+def parse_queries(queries: List, default_n_results: int = DEFAULT_N_RESULTS) -> List[Dict]:
+    """Normalise strings and {"query", "n_results", "where", "where_document"} objects"""
+    if not isinstance(queries, list) or not queries:
+        raise ValueError("queries must be a non-empty list")
+    if len(queries) > SEARCH_BATCH_MAX_QUERIES:
+        raise ValueError(f"At most {SEARCH_BATCH_MAX_QUERIES} queries per batch")
+
+    parsed = []
+    for position, item in enumerate(queries):
+        if isinstance(item, str):
+            item = {"query": item}
+        if not isinstance(item, dict) or not isinstance(item.get("query"), str) or not item["query"].strip():
+            raise ValueError(f"Query {position}: query text is required")
+        where = item.get("where") or item.get("filters") or None
+        if where is not None and not isinstance(where, dict):
+            raise ValueError(f"Query {position}: where must be an object")
+        where_document = item.get("where_document") or None
+        if where_document is not None and not isinstance(where_document, dict):
+            raise ValueError(f"Query {position}: where_document must be an object")
+        parsed.append({
+            "query": item["query"],
+            "n_results": int(item.get("n_results") or default_n_results),
+            "where": where,
+            "where_document": where_document
+        })
+    return parsed
+
+
+def search_batch(collection, chunk_collection, encoder, queries: List,
+                 default_n_results: int = DEFAULT_N_RESULTS, index=None) -> Dict:
+    """Run many searches with one encode call and one search per distinct filter.
+
+    index (a MetadataIndex) lets selective filters use an exact scan.
+    """
+    parsed = parse_queries(queries, default_n_results)
+
+    doc_count = collection.count()
+    if doc_count == 0:
+        return {
+            "results": [{"query": item["query"], "results": []} for item in parsed],
+            "count": len(parsed),
+            "message": "No documents in database"
+        }
+
+    embeddings = encoder.encode([item["query"] for item in parsed]).tolist()
+
+    # Chroma applies one where clause per call, so group queries by filter
+    groups: Dict[str, List[int]] = {}
+    for position, item in enumerate(parsed):
+        key = json.dumps([item["where"], item["where_document"]], sort_keys=True)
+        groups.setdefault(key, []).append(position)
+
+    responses = [None] * len(parsed)
+    for positions in groups.values():
+        where = parsed[positions[0]]["where"]
+        where_document = parsed[positions[0]]["where_document"]
+        plan = plan_search(where, where_document, index)
+        results = filtered_search_many(
+            collection,
+            chunk_collection,
+            [embeddings[position] for position in positions],
+            [max(1, min(parsed[position]["n_results"], doc_count)) for position in positions],
+            plan
+        )
+        for q, position in enumerate(positions):
+            responses[position] = {
+                "query": parsed[position]["query"],
+                "results": [
+                    {
+                        "id": results['ids'][q][i],
+                        "similarity": 1 - results['distances'][q][i],
+                        "content": results['documents'][q][i],
+                        "metadata": results['metadatas'][q][i]
+                    }
+                    for i in range(len(results['ids'][q]))
+                ]
+            }
+            if where:
+                responses[position]["where"] = where
+            if where_document:
+                responses[position]["where_document"] = where_document
+            if where or where_document:
+                responses[position]["filter"] = plan.describe()
+
+    return {"results": responses, "count": len(responses)}
@@ -0,0 +1,701 @@
+"""
+End-to-end benchmarks for the ingest, search and compare paths.
+
+hnsw_tuning.py and encoder_backends.py each measure one layer. This module
+drives the functions the front ends actually call, so a regression anywhere
+between the request and Chroma shows up:
+
+    add          app.add_document (demo collection)
+    add_pdf      app.add_pdf_document with generated PDFs
+    search       app.search_similar, once per search mode
+    compare      app.compare_two_documents
+    fetch_arxiv  app.fetch_arxiv_papers against a local stand-in arXiv server
+    flask        api.py's /add, /search, /compare and /documents through Flask's test client
+
+Everything runs offline in a scratch directory. Documents come from a fixed
+pseudo-word vocabulary with Zipf word frequencies and per-topic skew, so a
+given --seed always produces the same corpus. Collections are preloaded
+through bulk ingest with --corpus documents (1000 up to 1000000). Pass
+--workdir to keep the preloaded collections and reuse them between runs.
+
+Each scenario reports ops/s, p50/p95/p99 latency and the peak RSS of the
+process (and of the PDF worker processes) once it has finished. Peak RSS only
+ever rises, so run a scenario on its own to attribute memory to it. --json
+writes the results. --baseline compares the run against an earlier file, and
+with --fail-over the script exits non-zero on a regression:
+
+    python benchmark.py --corpus 10000 --json base.json
+    python benchmark.py --corpus 10000 --baseline base.json --fail-over 10
+    python benchmark.py --corpus 1000000 --workdir ./bench --scenarios search flask
+    python benchmark.py --corpus 100000 --write-corpus corpus.ndjson
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Callable, Dict, Iterator, List, Optional
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+SCENARIOS = ("add", "add_pdf", "search", "compare", "fetch_arxiv", "flask")
+BENCH_API_KEY = "benchmark-api-key"
+
+_CONSONANTS = "bcdfghjklmnprstvz"
+_VOWELS = "aeiou"
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    """Peak resident set size so far, in MiB"""
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _percentile_ms(sorted_samples: List[float], percentile: float) -> float:
+    """Nearest-rank percentile of samples in seconds, in milliseconds"""
+    if not sorted_samples:
+        return 0.0
+    rank = min(len(sorted_samples), max(1, math.ceil(percentile / 100 * len(sorted_samples)))) - 1
+    return round(sorted_samples[rank] * 1000, 3)
+
+
+def summarize(name: str, latencies: List[float], seconds: float, errors: int = 0, **extra) -> Dict:
+    """Throughput, latency percentiles and peak RSS for one scenario; prints a one-line summary"""
+    ordered = sorted(latencies)
+    report = {
+        "ops": len(latencies),
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "ops_per_sec": round(len(latencies) / seconds, 2) if seconds else 0.0,
+        "p50_ms": _percentile_ms(ordered, 50),
+        "p95_ms": _percentile_ms(ordered, 95),
+        "p99_ms": _percentile_ms(ordered, 99),
+        "peak_rss_mb": peak_rss_mb(),
+        "children_peak_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+        **extra
+    }
+    print(
+        f"{name:18s} {report['ops']:6d} ops  {report['ops_per_sec']:9.2f} ops/s  "
+        f"p50 {report['p50_ms']:9.2f} ms  p95 {report['p95_ms']:9.2f} ms  p99 {report['p99_ms']:9.2f} ms  "
+        f"rss {report['peak_rss_mb']:.0f} MiB" + (f"  errors {errors}" if errors else "")
+    )
+    return report
+
+
+def measure(name: str, operation: Callable[[object], bool], inputs: List, concurrency: int = 1) -> Dict:
+    """Time operation(item) for every input; operation returns False (or raises) on failure"""
+    latencies = [0.0] * len(inputs)
+
+    def run(i):
+        start = time.perf_counter()
+        try:
+            ok = operation(inputs[i])
+        except Exception:
+            ok = False
+        latencies[i] = time.perf_counter() - start
+        return ok
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(run, range(len(inputs))))
+    else:
+        outcomes = [run(i) for i in range(len(inputs))]
+    return summarize(name, latencies, time.perf_counter() - start, errors=outcomes.count(False))
+
+
+class SyntheticCorpus:
+    """Deterministic documents over a pseudo-word vocabulary.
+
+    Word frequencies follow a Zipf distribution and every document leans on
+    one topic's words, so nearest neighbours and BM25 scores are not uniform
+    noise. document(n) depends only on the seed and n, which lets queries be
+    drawn from stored documents without keeping the corpus in memory.
+    """
+
+    def __init__(self, vocabulary: int = 5000, topics: int = 50, topic_words: int = 200,
+                 doc_words: int = 200, seed: int = 0):
+        rng = random.Random(seed)
+        words = set()
+        while len(words) < vocabulary:
+            syllables = rng.randint(2, 4)
+            words.add("".join(rng.choice(_CONSONANTS) + rng.choice(_VOWELS) for _ in range(syllables)))
+        self.vocabulary = sorted(words)
+        rng.shuffle(self.vocabulary)
+        self.topics = [rng.sample(self.vocabulary, topic_words) for _ in range(topics)]
+        self.doc_words = doc_words
+        self.seed = seed
+        self._weights = self._zipf(vocabulary)
+        self._topic_weights = self._zipf(topic_words)
+
+    @staticmethod
+    def _zipf(size: int, exponent: float = 1.1) -> List[float]:
+        total = 0.0
+        cumulative = []
+        for rank in range(1, size + 1):
+            total += 1 / rank ** exponent
+            cumulative.append(total)
+        return cumulative
+
+    def _rng(self, n: int) -> random.Random:
+        return random.Random(self.seed * 1000003 + n)
+
+    def topic(self, n: int) -> int:
+        return self._rng(n).randrange(len(self.topics))
+
+    def words(self, n: int, count: Optional[int] = None) -> List[str]:
+        rng = self._rng(n)
+        topic = self.topics[rng.randrange(len(self.topics))]
+        if count is None:
+            count = max(8, int(self.doc_words * rng.uniform(0.5, 1.5)))
+        from_topic = count // 2
+        words = (rng.choices(topic, cum_weights=self._topic_weights, k=from_topic)
+                 + rng.choices(self.vocabulary, cum_weights=self._weights, k=count - from_topic))
+        rng.shuffle(words)
+        return words
+
+    def document(self, n: int, words: Optional[int] = None) -> str:
+        """Text of document n, in sentences of 8 to 18 words"""
+        tokens = self.words(n, words)
+        rng = self._rng(-n - 1)
+        sentences = []
+        position = 0
+        while position < len(tokens):
+            length = rng.randint(8, 18)
+            sentence = tokens[position:position + length]
+            sentences.append(" ".join(sentence).capitalize() + ".")
+            position += length
+        return " ".join(sentences)
+
+    def metadata(self, n: int) -> Dict:
+        return {"source": "benchmark", "subject_matter": f"topic-{self.topic(n)}", "sequence": n}
+
+    def items(self, start: int, count: int) -> Iterator[Dict]:
+        """{"content", "metadata"} items as accepted by bulk ingest and /add_batch"""
+        for n in range(start, start + count):
+            yield {"content": self.document(n), "metadata": self.metadata(n)}
+
+    def query(self, n: int, words: int = 12, seed: int = 0) -> str:
+        """A short excerpt of document n with a couple of words swapped, like a search a user would type"""
+        rng = random.Random(seed * 7919 + n)
+        tokens = self.words(n)
+        start = rng.randrange(max(1, len(tokens) - words))
+        excerpt = tokens[start:start + words]
+        for _ in range(max(1, len(excerpt) // 6)):
+            excerpt[rng.randrange(len(excerpt))] = rng.choice(self.vocabulary)
+        return " ".join(excerpt)
+
+    def perturbed(self, n: int, share: float = 0.1, seed: int = 0) -> str:
+        """Document n with a share of its words replaced, a paraphrase-like near copy"""
+        rng = random.Random(seed * 104729 + n)
+        tokens = self.document(n).split(" ")
+        for _ in range(int(len(tokens) * share)):
+            tokens[rng.randrange(len(tokens))] = rng.choice(self.vocabulary)
+        return " ".join(tokens)
+
+
+def _pdf_escape(line: str) -> str:
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(text: str, line_chars: int = 90, lines_per_page: int = 50) -> bytes:
+    """A minimal multi-page PDF with a Helvetica text layer, readable by every PDF_BACKEND"""
+    lines = textwrap.wrap(text, line_chars) or [""]
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)]
+
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    }
+    kids = []
+    for n, page in enumerate(pages):
+        page_id, content_id = 4 + 2 * n, 5 + 2 * n
+        body = "BT /F1 10 Tf 12 TL 50 770 Td\n" + "".join(f"({_pdf_escape(line)}) Tj T*\n" for line in page) + "ET"
+        stream = body.encode("latin-1", errors="replace")
+        objects[content_id] = b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"
+        objects[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode()
+        kids.append(f"{page_id} 0 R")
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(pages)} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for number in sorted(objects):
+        offsets[number] = len(out)
+        out += b"%d 0 obj\n" % number + objects[number] + b"\nendobj\n"
+    xref = len(out)
+    size = max(objects) + 1
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % size
+    for number in range(1, size):
+        out += b"%010d 00000 n \n" % offsets[number]
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref)
+    return bytes(out)
+
+
+class FakeArxivServer:
+    """Local stand-in for export.arxiv.org serving Atom search results and generated PDFs.
+
+    Each distinct query gets papers_per_query papers published an hour apart.
+    The server honours start, max_results, sortOrder and the submittedDate
+    range that sync_arxiv_query adds, so cursor handling runs as it would
+    against arXiv. Point ARXIV_API_URL at api_url.
+    """
+
+    _DATE_RANGE = re.compile(r"^\((.*)\) AND submittedDate:\[(\d{12}) TO (\d{12})\]$")
+    _EPOCH = datetime(2024, 1, 1)
+
+    def __init__(self, corpus: SyntheticCorpus, papers_per_query: int = 200, pdf_words: int = 3000):
+        self.corpus = corpus
+        self.papers_per_query = papers_per_query
+        self.pdf_words = pdf_words
+        self.requests = 0
+        self._queries = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def api_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/query"
+
+    def start(self) -> "FakeArxivServer":
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with fake._lock:
+                    fake.requests += 1
+                url = urlparse(self.path)
+                if url.path == "/api/query":
+                    body, content_type = fake.feed(parse_qs(url.query)), "application/atom+xml"
+                elif url.path.startswith("/pdf/"):
+                    body, content_type = fake.pdf(url.path[len("/pdf/"):]), "application/pdf"
+                else:
+                    body = None
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _query_number(self, query: str) -> int:
+        with self._lock:
+            return self._queries.setdefault(query, len(self._queries))
+
+    def _published(self, i: int) -> str:
+        return (self._EPOCH + timedelta(hours=i)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    def _paper_index(self, query_number: int, i: int) -> int:
+        return query_number * self.papers_per_query + i
+
+    def feed(self, params: Dict[str, List[str]]) -> bytes:
+        search_query = params.get("search_query", [""])[0]
+        low, high = "", ""
+        date_range = self._DATE_RANGE.match(search_query)
+        if date_range:
+            search_query, low, high = date_range.groups()
+        start = int(params.get("start", ["0"])[0])
+        max_results = int(params.get("max_results", ["10"])[0])
+        descending = params.get("sortOrder", ["descending"])[0] == "descending"
+
+        query_number = self._query_number(search_query)
+        matches = []
+        for i in range(self.papers_per_query):
+            stamp = (self._EPOCH + timedelta(hours=i)).strftime("%Y%m%d%H%M")
+            if (not low or stamp >= low) and (not high or stamp <= high):
+                matches.append(i)
+        if descending:
+            matches.reverse()
+
+        base = self.api_url[:-len("/api/query")]
+        entries = []
+        for i in matches[start:start + max_results]:
+            words = self.corpus.words(self._paper_index(query_number, i), 60)
+            arxiv_id = f"{2400 + query_number:04d}.{i:05d}v1"
+            entries.append(
+                "<entry>"
+                f"<id>http://arxiv.org/abs/{arxiv_id}</id>"
+                f"<published>{self._published(i)}</published>"
+                f"<title>{escape(' '.join(words[:8]).title())}</title>"
+                f"<summary>{escape(' '.join(words))}</summary>"
+                f'<link href="{base}/pdf/{arxiv_id}" rel="related" type="application/pdf"/>'
+                "</entry>"
+            )
+        return ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<feed xmlns="http://www.w3.org/2005/Atom">' + "".join(entries) + "</feed>").encode()
+
+    def pdf(self, arxiv_id: str) -> Optional[bytes]:
+        match = re.match(r"^(\d{4})\.(\d{5})(v\d+)?$", arxiv_id)
+        if not match:
+            return None
+        query_number, i = int(match.group(1)) - 2400, int(match.group(2))
+        if not 0 <= query_number < len(self._queries) or i >= self.papers_per_query:
+            return None
+        return make_pdf(self.corpus.document(self._paper_index(query_number, i), self.pdf_words))
+
+
+def configure_environment(workdir: str, arxiv_url: str, arxiv_rate: float):
+    """Point every store at workdir before app.py / api.py are imported.
+
+    Their settings are read at import time, so this must run first.
+    """
+    os.environ.update({
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.db"),
+        "NEAR_DUP_PATH": os.path.join(workdir, "near_duplicates.db"),
+        "LEXICAL_PATH": os.path.join(workdir, "lexical_index.db"),
+        "COMPACT_STORE_PATH": os.path.join(workdir, "compact_store.db"),
+        "CHROMA_PATH": os.path.join(workdir, "api_chroma_db"),
+        "ARXIV_API_URL": arxiv_url,
+        "ARXIV_RATE_PER_SEC": str(arxiv_rate),
+        "ARXIV_BURST": str(max(4, int(arxiv_rate))),
+        "API_KEY": BENCH_API_KEY,
+        # Resources are loaded explicitly and timed as the startup scenario
+        "WARM_UP": "0"
+    })
+    # app.py keeps its Chroma directory at ./chroma_db
+    os.chdir(workdir)
+
+
+def preload(name: str, engine, corpus: SyntheticCorpus, size: int) -> Optional[Dict]:
+    """Bulk-ingest the first size corpus documents unless the collection already has them"""
+    if size <= 0 or engine.count() >= size:
+        return None
+    counts = {}
+    start = time.perf_counter()
+    for result in engine.add_documents(corpus.items(0, size)):
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    seconds = time.perf_counter() - start
+    report = {
+        "docs": size,
+        "seconds": round(seconds, 3),
+        "docs_per_sec": round(size / seconds, 2) if seconds else 0.0,
+        "statuses": counts,
+        "peak_rss_mb": peak_rss_mb()
+    }
+    print(f"{name:18s} {size:6d} docs  {report['docs_per_sec']:9.2f} docs/s  {counts}")
+    return report
+
+
+class Benchmark:
+    """Runs the selected scenarios against app.py and api.py in one scratch directory"""
+
+    def __init__(self, args, corpus: SyntheticCorpus, fake_arxiv: FakeArxivServer):
+        self.args = args
+        self.corpus = corpus
+        self.fake_arxiv = fake_arxiv
+        self.results = {}
+        self._app = None
+        self._api = None
+        # Documents past the preloaded corpus, handed out to add scenarios
+        self._next_document = args.corpus
+
+    def fresh_documents(self, count: int) -> List[int]:
+        numbers = list(range(self._next_document, self._next_document + count))
+        self._next_document += count
+        return numbers
+
+    def stored_documents(self, count: int, seed: int) -> List[int]:
+        rng = random.Random(self.args.seed * 31 + seed)
+        return [rng.randrange(max(1, self.args.corpus)) for _ in range(count)]
+
+    def app(self):
+        if self._app is None:
+            start = time.perf_counter()
+            import app
+            imported = time.perf_counter() - start
+            app.model.encode(["warm up"])
+            app.demo_engine.count()
+            app.api_engine.count()
+            self.results["startup_app"] = {
+                "import_sec": round(imported, 3),
+                "ready_sec": round(time.perf_counter() - start, 3),
+                "peak_rss_mb": peak_rss_mb()
+            }
+            report = preload("preload_demo", app.demo_engine, self.corpus, self.args.corpus)
+            if report:
+                self.results["preload_demo"] = report
+            self._app = app
+        return self._app
+
+    def api(self):
+        if self._api is None:
+            start = time.perf_counter()
+            import api
+            imported = time.perf_counter() - start
+            api.engine.model.encode(["warm up"])
+            api.engine.count()
+            self.results["startup_api"] = {
+                "import_sec": round(imported, 3),
+                "ready_sec": round(time.perf_counter() - start, 3),
+                "peak_rss_mb": peak_rss_mb()
+            }
+            report = preload("preload_api", api.engine, self.corpus, self.args.corpus)
+            if report:
+                self.results["preload_api"] = report
+            self._api = api
+        return self._api
+
+    def run(self, scenarios: List[str]) -> Dict:
+        for scenario in scenarios:
+            getattr(self, f"bench_{scenario}")()
+        return self.results
+
+    def bench_add(self):
+        app = self.app()
+
+        def add(n):
+            message, _ = app.add_document(self.corpus.document(n), json.dumps(self.corpus.metadata(n)))
+            return message.startswith("✅")
+
+        self.results["add"] = measure("add", add, self.fresh_documents(self.args.ops), self.args.concurrency)
+
+    def bench_add_pdf(self):
+        app = self.app()
+        folder = os.path.join(self.args.workdir, "pdfs")
+        os.makedirs(folder, exist_ok=True)
+        uploads = []
+        for n in self.fresh_documents(self.args.pdfs):
+            path = os.path.join(folder, f"bench_{n}.pdf")
+            with open(path, "wb") as f:
+                f.write(make_pdf(self.corpus.document(n, self.args.pdf_words)))
+            # Gradio passes uploads as objects with the temp file's path in .name
+            uploads.append(SimpleNamespace(name=path))
+
+        def add_pdf(upload):
+            message, _ = app.add_pdf_document(upload, "")
+            return message.startswith("✅")
+
+        self.results["add_pdf"] = measure("add_pdf", add_pdf, uploads, self.args.concurrency)
+
+    def bench_search(self):
+        app = self.app()
+        from lexical_index import SEARCH_MODES
+
+        for offset, mode in enumerate(SEARCH_MODES):
+            queries = [self.corpus.query(n, seed=offset) for n in self.stored_documents(self.args.ops, offset)]
+
+            def search(query, mode=mode):
+                return app.search_similar(query, self.args.n_results, mode).startswith("🔍")
+
+            self.results[f"search_{mode}"] = measure(f"search_{mode}", search, queries, self.args.concurrency)
+
+    def bench_compare(self):
+        app = self.app()
+        numbers = self.stored_documents(self.args.ops, 100)
+        # Alternate near copies and unrelated pairs
+        pairs = [
+            (self.corpus.document(n), self.corpus.perturbed(n) if i % 2 == 0 else self.corpus.document(n + 1))
+            for i, n in enumerate(numbers)
+        ]
+
+        def compare(pair):
+            return app.compare_two_documents(*pair).startswith("## Document Comparison")
+
+        self.results["compare"] = measure("compare", compare, pairs, self.args.concurrency)
+
+    def bench_fetch_arxiv(self):
+        app = self.app()
+        for n in range(self.args.arxiv_queries):
+            topic = self.corpus.topics[n % len(self.corpus.topics)]
+            app.add_arxiv_query(" ".join(topic[:3]), f"benchmark topic {n}")
+
+        stored_before = app.api_engine.count()
+        requests_before = self.fake_arxiv.requests
+
+        def fetch(_):
+            return "Summary" in app.fetch_arxiv_papers(self.args.arxiv_papers)
+
+        report = measure("fetch_arxiv", fetch, list(range(self.args.arxiv_rounds)))
+        papers = app.api_engine.count() - stored_before
+        report.update({
+            "papers": papers,
+            "papers_per_sec": round(papers / report["seconds"], 2) if report["seconds"] else 0.0,
+            "http_requests": self.fake_arxiv.requests - requests_before
+        })
+        print(f"{'':18s} {papers} papers, {report['papers_per_sec']:.2f} papers/s, {report['http_requests']} requests")
+        self.results["fetch_arxiv"] = report
+
+    def bench_flask(self):
+        api = self.api()
+        client = api.app.test_client()
+        headers = {"X-API-Key": BENCH_API_KEY}
+
+        def post(route, body):
+            return client.post(route, json=body, headers=headers).status_code < 400
+
+        adds = [{"content": self.corpus.document(n), "metadata": self.corpus.metadata(n)}
+                for n in self.fresh_documents(self.args.ops)]
+        self.results["flask_add"] = measure(
+            "flask_add", lambda body: post("/add", body), adds, self.args.concurrency
+        )
+
+        searches = [{"query": self.corpus.query(n, seed=200), "n_results": self.args.n_results}
+                    for n in self.stored_documents(self.args.ops, 200)]
+        self.results["flask_search"] = measure(
+            "flask_search", lambda body: post("/search", body), searches, self.args.concurrency
+        )
+
+        compares = [{"doc1": self.corpus.document(n), "doc2": self.corpus.perturbed(n, seed=300)}
+                    for n in self.stored_documents(self.args.ops, 300)]
+        self.results["flask_compare"] = measure(
+            "flask_compare", lambda body: post("/compare", body), compares, self.args.concurrency
+        )
+
+        total = max(1, api.engine.count())
+        rng = random.Random(self.args.seed * 31 + 400)
+        pages = [rng.randrange(total) for _ in range(self.args.ops)]
+        self.results["flask_documents"] = measure(
+            "flask_documents",
+            lambda offset: client.get(
+                f"/documents?limit=50&offset={offset}&preview_length=200", headers=headers
+            ).status_code < 400,
+            pages, self.args.concurrency
+        )
+
+
+def compare_to_baseline(results: Dict, baseline: Dict, fail_over: Optional[float] = None) -> List[str]:
+    """Print throughput and p95 changes against a baseline run; returns the regressions past fail_over percent"""
+    regressions = []
+    print(f"\n{'scenario':18s} {'ops/s':>22s} {'p95 ms':>24s}")
+    for name, report in results.items():
+        before = baseline.get(name)
+        if not before or "ops_per_sec" not in report or "ops_per_sec" not in before:
+            continue
+        throughput = (report["ops_per_sec"] / before["ops_per_sec"] - 1) * 100 if before["ops_per_sec"] else 0.0
+        latency = (report["p95_ms"] / before["p95_ms"] - 1) * 100 if before["p95_ms"] else 0.0
+        print(
+            f"{name:18s} {before['ops_per_sec']:9.2f} -> {report['ops_per_sec']:9.2f} "
+            f"({throughput:+6.1f}%)  {before['p95_ms']:9.2f} -> {report['p95_ms']:9.2f} ({latency:+6.1f}%)"
+        )
+        if fail_over is not None and (throughput < -fail_over or latency > fail_over):
+            regressions.append(name)
+    return regressions
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, timeout=5
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingest, search and compare end to end on a synthetic corpus")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--corpus", type=int, default=1000, help="Documents preloaded before timing (1000 to 1000000)")
+    parser.add_argument("--doc-words", type=int, default=200, help="Mean words per synthetic document")
+    parser.add_argument("--ops", type=int, default=200, help="Operations per scenario")
+    parser.add_argument("--concurrency", type=int, default=1, help="Threads issuing operations")
+    parser.add_argument("--n-results", type=int, default=5)
+    parser.add_argument("--pdfs", type=int, default=20, help="PDFs uploaded by add_pdf")
+    parser.add_argument("--pdf-words", type=int, default=3000, help="Words per generated PDF")
+    parser.add_argument("--arxiv-queries", type=int, default=2, help="arXiv queries registered for fetch_arxiv")
+    parser.add_argument("--arxiv-rounds", type=int, default=3, help="fetch_arxiv_papers runs")
+    parser.add_argument("--arxiv-papers", type=int, default=3, help="Papers per query per run")
+    parser.add_argument("--arxiv-rate", type=float, default=1000.0,
+                        help="ARXIV_RATE_PER_SEC for the local server (arXiv itself asks for at most 1 request every 3 s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="Keep collections here and reuse them between runs (default: a temp dir)")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--baseline", help="Earlier --json output to compare against")
+    parser.add_argument("--fail-over", type=float, default=None,
+                        help="With --baseline, exit 1 if ops/s drops or p95 rises by more than this percent")
+    parser.add_argument("--write-corpus", help="Write the --corpus documents as NDJSON to this file and exit")
+    args = parser.parse_args()
+
+    corpus = SyntheticCorpus(doc_words=args.doc_words, seed=args.seed)
+    if args.write_corpus:
+        with open(args.write_corpus, "w") as f:
+            for item in corpus.items(0, args.corpus):
+                f.write(json.dumps(item) + "\n")
+        print(f"Wrote {args.corpus} documents to {args.write_corpus}")
+        return
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    # The working directory changes below
+    args.json = args.json and os.path.abspath(args.json)
+    keep = args.workdir is not None
+    args.workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="writeguard_bench_"))
+    os.makedirs(args.workdir, exist_ok=True)
+    # Papers come from their own corpus so they never collide with preloaded documents
+    fake_arxiv = FakeArxivServer(SyntheticCorpus(doc_words=args.doc_words, seed=args.seed + 1),
+                                 pdf_words=args.pdf_words).start()
+    configure_environment(args.workdir, fake_arxiv.api_url, args.arxiv_rate)
+
+    print(f"{args.corpus} preloaded documents, {args.ops} ops per scenario, concurrency {args.concurrency}, "
+          f"workdir {args.workdir}")
+    try:
+        results = Benchmark(args, corpus, fake_arxiv).run(args.scenarios)
+    finally:
+        fake_arxiv.stop()
+        if not keep:
+            shutil.rmtree(args.workdir, ignore_errors=True)
+
+    if args.json:
+        options = {key: value for key, value in vars(args).items()
+                   if key not in ("json", "baseline", "fail_over", "write_corpus")}
+        with open(args.json, "w") as f:
+            json.dump({
+                "meta": {
+                    "timestamp": datetime.now().isoformat(),
+                    "commit": _git_commit(),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "cpus": os.cpu_count(),
+                    "settings": {key: os.environ.get(key, "") for key in
+                                 ("ENCODER_BACKEND", "PDF_BACKEND", "SEARCH_MODE", "NEAR_DUP_ACTION")},
+                    "options": options
+                },
+                "results": results
+            }, f, indent=2)
+
+    if baseline is not None:
+        regressions = compare_to_baseline(results, baseline, args.fail_over)
+        if regressions:
+            print(f"Regressed past {args.fail_over}%: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
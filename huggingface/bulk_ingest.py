@@ -0,0 +1,156 @@
+"""
+Bulk document ingestion.
+
+Items arrive as a JSON array or as newline-delimited JSON (one
+{"content": ..., "metadata": {...}} object per line) and are processed in
+groups: one collection.get per group to find documents that already exist,
+one encode call and one collection.add call for the group's new texts.
+Results are yielded per item as each group finishes so HTTP handlers can
+stream them back while the rest of the body is still being read.
+"""
+
+import json
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from near_duplicates import near_duplicate_metadata
+
+INGEST_BATCH_SIZE = 256
+
+
+def parse_ndjson(lines: Iterable) -> Iterator:
+    """Yield one object per non-blank line; undecodable lines yield a ValueError"""
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="replace")
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            yield ValueError(f"Invalid JSON: {e}")
+
+
+def parse_documents_payload(payload: str) -> Iterator:
+    """Accept either a JSON array of documents or NDJSON text"""
+    payload = payload.strip()
+    if payload.startswith("["):
+        return iter(json.loads(payload))
+    return parse_ndjson(payload.splitlines())
+
+
+def _batched(items: Iterable, size: int) -> Iterator[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ingest_documents(collection, encoder, items: Iterable, generate_id: Callable[[str], str],
+                     base_metadata: Optional[Dict] = None,
+                     batch_size: int = INGEST_BATCH_SIZE, index=None, lexical=None,
+                     near_duplicates=None, near_dup_action: str = "link") -> Iterator[Dict]:
+    """Add documents in batches, yielding a result dict per input item.
+
+    status is one of "added", "exists" (already stored), "duplicate"
+    (repeated earlier in the same request), "near_duplicate" (skipped as a
+    near-duplicate of near_duplicate_of) or "error". Added documents are
+    also recorded in index (a MetadataIndex) and lexical (a BM25Index) when
+    given.
+
+    With near_duplicates (a NearDuplicateIndex), each new document is checked
+    against stored documents and earlier items of the request before it is
+    encoded; near_dup_action "skip" drops matches and "link" stores them with
+    near_duplicate_of metadata.
+    """
+    seen = set()
+
+    for batch in _batched(enumerate(items), batch_size):
+        results = {}
+        pending = []
+
+        for position, item in batch:
+            if isinstance(item, Exception):
+                results[position] = {"index": position, "status": "error", "error": str(item)}
+                continue
+            content = item.get("content") if isinstance(item, dict) else None
+            if not isinstance(content, str) or not content.strip():
+                results[position] = {"index": position, "status": "error", "error": "Content is required"}
+                continue
+            item_metadata = item.get("metadata")
+            if item_metadata is not None and not isinstance(item_metadata, dict):
+                results[position] = {"index": position, "status": "error", "error": "Metadata must be an object"}
+                continue
+
+            doc_id = generate_id(content)
+            if doc_id in seen:
+                results[position] = {"index": position, "id": doc_id, "status": "duplicate"}
+                continue
+            seen.add(doc_id)
+
+            metadata = dict(base_metadata or {})
+            metadata.update(item_metadata or {})
+            pending.append((position, doc_id, content, metadata))
+
+        if pending:
+            existing = set(collection.get(ids=[doc_id for _, doc_id, _, _ in pending], include=[])['ids'])
+            new_docs = []
+            for position, doc_id, content, metadata in pending:
+                if doc_id in existing:
+                    results[position] = {"index": position, "id": doc_id, "status": "exists"}
+                    continue
+                if near_duplicates is not None:
+                    signature = near_duplicates.signature(content)
+                    match = near_duplicates.find_duplicate(signature)
+                    if match is not None and near_dup_action == "skip":
+                        results[position] = {
+                            "index": position, "id": doc_id, "status": "near_duplicate",
+                            "near_duplicate_of": match[0], "jaccard": match[1]
+                        }
+                        continue
+                    if match is not None:
+                        metadata = {**metadata, **near_duplicate_metadata(match)}
+                    # Registered now so later items in the request match it too
+                    near_duplicates.add(doc_id, signature)
+                new_docs.append((position, doc_id, content, metadata))
+
+            if new_docs:
+                try:
+                    # A group is at most batch_size documents, well under Chroma's add limit
+                    embeddings = encoder.encode([content for _, _, content, _ in new_docs]).tolist()
+                    collection.add(
+                        embeddings=embeddings,
+                        documents=[content for _, _, content, _ in new_docs],
+                        # Chroma rejects empty metadata dicts
+                        metadatas=[metadata or None for _, _, _, metadata in new_docs],
+                        ids=[doc_id for _, doc_id, _, _ in new_docs]
+                    )
+                    if index is not None:
+                        index.add_many(
+                            [doc_id for _, doc_id, _, _ in new_docs],
+                            [metadata for _, _, _, metadata in new_docs]
+                        )
+                    if lexical is not None:
+                        lexical.add_many(
+                            [doc_id for _, doc_id, _, _ in new_docs],
+                            [[content] for _, _, content, _ in new_docs]
+                        )
+                    for position, doc_id, _, metadata in new_docs:
+                        results[position] = {"index": position, "id": doc_id, "status": "added"}
+                        if "near_duplicate_of" in metadata:
+                            results[position]["near_duplicate_of"] = metadata["near_duplicate_of"]
+                except Exception as e:
+                    failed = [
+                        (position, doc_id) for position, doc_id, _, _ in new_docs if position not in results
+                    ]
+                    if near_duplicates is not None:
+                        near_duplicates.remove([doc_id for _, doc_id in failed])
+                    for position, doc_id in failed:
+                        results[position] = {"index": position, "id": doc_id, "status": "error", "error": str(e)}
+
+        for position, _ in batch:
+            yield results[position]
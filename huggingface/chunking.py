@@ -0,0 +1,277 @@
+"""
+Token-aware chunking for long documents.
+
+all-MiniLM-L6-v2 truncates its input after 256 word pieces, so a whole paper
+passed to a single encode call is represented by its first page only. Long
+documents are split into overlapping token windows, every window is embedded,
+and the chunk vectors are stored in a companion "<collection>_chunks"
+collection with a `parent_id` pointing back at the full document. Searches
+query the chunks and fold the hits back into documents.
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from hnsw_tuning import collection_metadata
+
+# Leave headroom for [CLS]/[SEP] under the model's 256 token limit
+CHUNK_TOKENS = 200
+CHUNK_OVERLAP = 40
+ENCODE_BATCH_SIZE = 32
+
+# How many chunk hits to pull per requested document
+CHUNK_OVERSAMPLE = 4
+
+_WORD_RE = re.compile(r"\S+")
+
+
+def _token_spans(text: str, tokenizer=None) -> List[Tuple[int, int]]:
+    """Return (start, end) character offsets for each token in text"""
+    if tokenizer is not None:
+        try:
+            encoded = tokenizer(
+                text,
+                add_special_tokens=False,
+                return_offsets_mapping=True,
+                verbose=False
+            )
+            return [tuple(span) for span in encoded["offset_mapping"]]
+        except Exception:
+            # Slow tokenizers don't support offsets; fall back to words
+            pass
+    return [match.span() for match in _WORD_RE.finditer(text)]
+
+
+def chunk_text(text: str, tokenizer=None, max_tokens: int = CHUNK_TOKENS,
+               overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """Split text into overlapping windows of at most max_tokens tokens"""
+    if overlap >= max_tokens:
+        raise ValueError("overlap must be smaller than max_tokens")
+
+    spans = _token_spans(text, tokenizer)
+    if not spans:
+        return []
+    if len(spans) <= max_tokens:
+        return [text.strip()]
+
+    chunks = []
+    stride = max_tokens - overlap
+    for start in range(0, len(spans), stride):
+        window = spans[start:start + max_tokens]
+        chunks.append(text[window[0][0]:window[-1][1]].strip())
+        if start + max_tokens >= len(spans):
+            break
+    return [chunk for chunk in chunks if chunk]
+
+
+def get_chunk_collection(client, collection):
+    """Get or create the chunk collection that belongs to collection"""
+    name = f"{collection.name}_chunks"
+    return client.get_or_create_collection(name=name, metadata=collection_metadata(name))
+
+
+def chunk_id(parent_id: str, index: int) -> str:
+    return f"{parent_id}:{index:05d}"
+
+
+def _mean_pool(chunk_embeddings: np.ndarray) -> np.ndarray:
+    """Re-normalised mean of a document's chunk vectors"""
+    doc_embedding = chunk_embeddings.mean(axis=0)
+    norm = np.linalg.norm(doc_embedding)
+    if norm > 0:
+        doc_embedding = doc_embedding / norm
+    return doc_embedding
+
+
+def embed_document(model, text: str) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """Chunk and embed text in batches.
+
+    Returns (chunks, chunk_embeddings, document_embedding). The document
+    embedding is the re-normalised mean of the chunk vectors so the
+    document-level record covers the whole text, not just the first window.
+    """
+    chunks = chunk_text(text, getattr(model, "tokenizer", None))
+    if not chunks:
+        raise ValueError("Document has no text to embed")
+
+    chunk_embeddings = np.asarray(model.encode(
+        chunks,
+        batch_size=ENCODE_BATCH_SIZE,
+        normalize_embeddings=True
+    ), dtype=np.float32)
+    return chunks, chunk_embeddings, _mean_pool(chunk_embeddings)
+
+
+def embed_documents(model, texts: List[str]) -> np.ndarray:
+    """Document embeddings of several texts as embed_document computes them, with one encode call for all chunks"""
+    tokenizer = getattr(model, "tokenizer", None)
+    chunked = [chunk_text(text, tokenizer) for text in texts]
+    if not all(chunked):
+        raise ValueError("Document has no text to embed")
+
+    chunk_embeddings = np.asarray(model.encode(
+        [chunk for chunks in chunked for chunk in chunks],
+        batch_size=ENCODE_BATCH_SIZE,
+        normalize_embeddings=True
+    ), dtype=np.float32)
+    doc_embeddings = []
+    start = 0
+    for chunks in chunked:
+        doc_embeddings.append(_mean_pool(chunk_embeddings[start:start + len(chunks)]))
+        start += len(chunks)
+    return np.vstack(doc_embeddings)
+
+
+def add_chunked_document(collection, chunk_collection, model, doc_id: str,
+                         text: str, metadata: Dict) -> List[str]:
+    """Store text as one document record plus one record per chunk.
+
+    Returns the chunk texts written.
+    """
+    chunks, chunk_embeddings, doc_embedding = embed_document(model, text)
+
+    metadata = dict(metadata)
+    metadata["chunk_count"] = len(chunks)
+
+    collection.add(
+        embeddings=[doc_embedding.tolist()],
+        documents=[text],
+        metadatas=[metadata],
+        ids=[doc_id]
+    )
+
+    # Every scalar field is carried over, so any where clause a search
+    # applies to documents filters their chunks the same way
+    carried = {
+        key: value for key, value in metadata.items()
+        if isinstance(value, (str, int, float, bool)) and key not in ("parent_id", "chunk_index")
+    }
+    chunk_metadatas = [{**carried, "parent_id": doc_id, "chunk_index": i} for i in range(len(chunks))]
+
+    chunk_collection.add(
+        embeddings=chunk_embeddings.tolist(),
+        documents=chunks,
+        metadatas=chunk_metadatas,
+        ids=[chunk_id(doc_id, i) for i in range(len(chunks))]
+    )
+    return chunks
+
+
+def delete_chunks(chunk_collection, doc_ids: List[str]):
+    """Remove all chunks belonging to the given parent documents"""
+    if doc_ids:
+        chunk_collection.delete(where={"parent_id": {"$in": list(doc_ids)}})
+
+
+def aggregate_chunk_hits(ids: List[str], distances: List[float], metadatas: List[Dict],
+                         mode: str = "max", top_k: int = 3) -> List[Tuple[str, float]]:
+    """Fold chunk-level hits into (parent_id, similarity) pairs, best first.
+
+    mode="max" scores a document by its single best chunk; mode="mean" uses
+    the mean of its top_k chunk similarities, which rewards documents that
+    match in several places.
+    """
+    per_parent: Dict[str, List[float]] = {}
+    for chunk_id_, distance, metadata in zip(ids, distances, metadatas):
+        parent_id = (metadata or {}).get("parent_id") or chunk_id_.split(":")[0]
+        per_parent.setdefault(parent_id, []).append(1 - distance)
+
+    scored = []
+    for parent_id, sims in per_parent.items():
+        sims.sort(reverse=True)
+        if mode == "max":
+            score = sims[0]
+        elif mode == "mean":
+            score = sum(sims[:top_k]) / len(sims[:top_k])
+        else:
+            raise ValueError(f"Unknown aggregation mode: {mode}")
+        scored.append((parent_id, score))
+
+    scored.sort(key=lambda item: item[1], reverse=True)
+    return scored
+
+
+def search_with_chunks(collection, chunk_collection, query_embedding: List[float],
+                       n_results: int, mode: str = "max", top_k: int = 3,
+                       where: Optional[Dict] = None, where_document: Optional[Dict] = None) -> Dict:
+    """Query documents and their chunks, returning Chroma query-shaped results.
+
+    Document-level records are searched as well so documents stored before
+    chunking existed (which have no chunks) still rank. Each document keeps the
+    better of its document-level and aggregated chunk similarity.
+    """
+    return search_many_with_chunks(
+        collection, chunk_collection, [query_embedding], n_results, mode, top_k, where, where_document
+    )
+
+
+def search_many_with_chunks(collection, chunk_collection, query_embeddings: List[List[float]],
+                            n_results, mode: str = "max", top_k: int = 3,
+                            where: Optional[Dict] = None, where_document: Optional[Dict] = None) -> Dict:
+    """search_with_chunks for several queries at once, one Chroma call per collection.
+
+    n_results is an int or one count per query; Chroma takes a single count
+    per call, so the largest is requested and each query's hits are trimmed.
+    chunk_collection may be None to search documents only. where_document
+    applies to each chunk's own text on the chunk side.
+    """
+    if isinstance(n_results, int):
+        n_results = [n_results] * len(query_embeddings)
+    largest = max(n_results)
+    scores: List[Dict[str, float]] = [{} for _ in query_embeddings]
+    found = {}
+
+    doc_results = collection.query(
+        query_embeddings=query_embeddings,
+        n_results=largest,
+        where=where,
+        where_document=where_document
+    )
+    for q, ids in enumerate(doc_results['ids']):
+        for i, doc_id in enumerate(ids[:n_results[q]]):
+            scores[q][doc_id] = 1 - doc_results['distances'][q][i]
+            found[doc_id] = (doc_results['documents'][q][i], doc_results['metadatas'][q][i])
+
+    chunk_count = chunk_collection.count() if chunk_collection is not None else 0
+    if chunk_count:
+        chunk_results = chunk_collection.query(
+            query_embeddings=query_embeddings,
+            n_results=min(chunk_count, largest * CHUNK_OVERSAMPLE),
+            where=where,
+            where_document=where_document,
+            include=["metadatas", "distances"]
+        )
+        for q in range(len(query_embeddings)):
+            limit = n_results[q] * CHUNK_OVERSAMPLE
+            for parent_id, score in aggregate_chunk_hits(
+                chunk_results['ids'][q][:limit],
+                chunk_results['distances'][q][:limit],
+                chunk_results['metadatas'][q][:limit],
+                mode=mode,
+                top_k=top_k
+            ):
+                if score > scores[q].get(parent_id, -1.0):
+                    scores[q][parent_id] = score
+
+    rankings = [
+        sorted(query_scores.items(), key=lambda item: item[1], reverse=True)[:n_results[q]]
+        for q, query_scores in enumerate(scores)
+    ]
+
+    missing = sorted({doc_id for ranked in rankings for doc_id, _ in ranked if doc_id not in found})
+    if missing:
+        fetched = collection.get(ids=missing)
+        for i, doc_id in enumerate(fetched['ids']):
+            found[doc_id] = (fetched['documents'][i], fetched['metadatas'][i])
+
+    # Chunks can outlive a deleted parent; drop those hits
+    rankings = [[(doc_id, score) for doc_id, score in ranked if doc_id in found] for ranked in rankings]
+
+    return {
+        "ids": [[doc_id for doc_id, _ in ranked] for ranked in rankings],
+        "distances": [[1 - score for _, score in ranked] for ranked in rankings],
+        "documents": [[found[doc_id][0] for doc_id, _ in ranked] for ranked in rankings],
+        "metadatas": [[found[doc_id][1] for doc_id, _ in ranked] for ranked in rankings]
+    }
@@ -0,0 +1,432 @@
+"""
+Compact storage for document bodies and vectors outside Chroma.
+
+By default every collection.add puts the whole extracted paper into
+chroma.sqlite3 uncompressed, and every collection.get that asks for documents
+reads it back. Two side stores in one sqlite file (COMPACT_STORE_PATH) take
+over the bulk:
+
+TEXT_STORE=blob
+    Bodies are compressed (zstd when the zstandard package is installed,
+    zlib otherwise) into a blob table keyed by collection and document id.
+    Ids are content hashes, so the store is content-addressed. Chroma keeps
+    the first TEXT_PREVIEW_CHARS characters. Reads are hydrated with the
+    full text again, so callers see no difference. The one exception is
+    where_document: Chroma would evaluate it on the preview and silently
+    miss matches further in, so it is rejected with a ValueError instead.
+
+VECTOR_STORE=float16 | int8
+    A copy of every document and chunk vector at 2 or 1 bytes per dimension
+    (int8 with one scale per vector). Filtered exact search (filtered_search)
+    scores candidates against this copy instead of pulling fp32 vectors and
+    full bodies out of Chroma. It then fetches and rescores only the best
+    RESCORE_OVERSAMPLE x n_results with Chroma's exact vectors. Chroma keeps
+    its own fp32 vectors, since HNSW needs them, so this store does not
+    shrink vectors on disk; it adds to them. With 384-dim vectors the
+    sqlite file grows by about 1.1 KB (float16) or 0.6 KB (int8) per
+    vector, on top of Chroma's 1.5 KB of fp32. What it saves is the bytes
+    an exact scan has to read.
+
+CompactCollection wraps a Chroma collection and does both on add, upsert,
+update, get, query and delete, so bulk ingest, chunking, listing and search
+all go through it unchanged. Documents stored before it was enabled keep
+their full text in Chroma and are served as they are. VectorSideStore.sync
+back-fills their vectors.
+"""
+
+import os
+import sqlite3
+import threading
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+TEXT_STORE = os.environ.get('TEXT_STORE', 'chroma')
+TEXT_STORES = ("chroma", "blob")
+VECTOR_STORE = os.environ.get('VECTOR_STORE', 'off')
+VECTOR_STORES = ("off", "float16", "int8")
+COMPACT_STORE_PATH = os.environ.get('COMPACT_STORE_PATH', './compact_store.db')
+TEXT_PREVIEW_CHARS = int(os.environ.get('TEXT_PREVIEW_CHARS', '1000'))
+RESCORE_OVERSAMPLE = int(os.environ.get('RESCORE_OVERSAMPLE', '4'))
+ZSTD_LEVEL = 9
+SYNC_PAGE_SIZE = 1000
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    db = sqlite3.connect(path, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    return db
+
+
+def compress(text: str) -> Tuple[str, bytes]:
+    """(codec, payload); zstd if available, else zlib"""
+    raw = text.encode()
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    return "zlib", zlib.compress(raw, 9)
+
+
+def decompress(codec: str, payload: bytes) -> str:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Text was stored with zstd; install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress(payload).decode()
+    return zlib.decompress(payload).decode()
+
+
+class TextBlobStore:
+    """Compressed document bodies keyed by (namespace, doc_id)"""
+
+    def __init__(self, path: str, namespace: str):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._db = _connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS text_blobs ("
+            " namespace TEXT NOT NULL,"
+            " doc_id TEXT NOT NULL,"
+            " codec TEXT NOT NULL,"
+            " length INTEGER NOT NULL,"
+            " body BLOB NOT NULL,"
+            " PRIMARY KEY (namespace, doc_id))"
+        )
+        self._db.commit()
+
+    def put_many(self, doc_ids: List[str], texts: List[str]):
+        rows = []
+        for doc_id, text in zip(doc_ids, texts):
+            codec, body = compress(text)
+            rows.append((self.namespace, doc_id, codec, len(text), body))
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO text_blobs (namespace, doc_id, codec, length, body) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self._db.commit()
+
+    def lengths(self, doc_ids: List[str]) -> Dict[str, int]:
+        """Full text lengths of the ids that have a blob, without decompressing them"""
+        found = {}
+        unique = list(dict.fromkeys(doc_ids))
+        with self._lock:
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                found.update(self._db.execute(
+                    f"SELECT doc_id, length FROM text_blobs WHERE namespace = ? AND doc_id IN ({placeholders})",
+                    [self.namespace] + batch
+                ).fetchall())
+        return found
+
+    def get_many(self, doc_ids: List[str]) -> Dict[str, str]:
+        """Full texts of the ids that have one; documents stored in Chroma are absent"""
+        found = {}
+        unique = list(dict.fromkeys(doc_ids))
+        with self._lock:
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._db.execute(
+                    f"SELECT doc_id, codec, body FROM text_blobs WHERE namespace = ? AND doc_id IN ({placeholders})",
+                    [self.namespace] + batch
+                ).fetchall()
+                for doc_id, codec, body in rows:
+                    found[doc_id] = (codec, body)
+        return {doc_id: decompress(codec, body) for doc_id, (codec, body) in found.items()}
+
+    def remove(self, doc_ids: List[str]):
+        with self._lock:
+            for start in range(0, len(doc_ids), 500):
+                batch = list(doc_ids[start:start + 500])
+                placeholders = ",".join("?" * len(batch))
+                self._db.execute(
+                    f"DELETE FROM text_blobs WHERE namespace = ? AND doc_id IN ({placeholders})",
+                    [self.namespace] + batch
+                )
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM text_blobs WHERE namespace = ?", (self.namespace,))
+            self._db.commit()
+
+
+def quantize(vectors: np.ndarray, dtype: str) -> Tuple[np.ndarray, np.ndarray]:
+    """(codes, scales): float16 codes with unit scales, or int8 codes with one scale per row"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype == "float16":
+        return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def dequantize(codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    return codes.astype(np.float32) * scales[:, None]
+
+
+class VectorSideStore:
+    """float16 or int8 copies of a collection's vectors, keyed by (namespace, id)"""
+
+    def __init__(self, path: str, namespace: str, dtype: str = "int8"):
+        if dtype not in ("float16", "int8"):
+            raise ValueError("dtype must be float16 or int8")
+        self.namespace = namespace
+        self.dtype = dtype
+        self._lock = threading.Lock()
+        self._db = _connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS compact_vectors ("
+            " namespace TEXT NOT NULL,"
+            " id TEXT NOT NULL,"
+            " dtype TEXT NOT NULL,"
+            " scale REAL NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " PRIMARY KEY (namespace, id))"
+        )
+        self._db.commit()
+
+    def put_many(self, ids: List[str], vectors):
+        if not len(ids):
+            return
+        codes, scales = quantize(vectors, self.dtype)
+        rows = [(self.namespace, id_, self.dtype, float(scale), code.tobytes())
+                for id_, code, scale in zip(ids, codes, scales)]
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO compact_vectors (namespace, id, dtype, scale, vector) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self._db.commit()
+
+    def get_many(self, ids: List[str]) -> Tuple[List[str], np.ndarray]:
+        """(ids found, float32 matrix) in the order of ids; ids without a vector are left out"""
+        rows = {}
+        unique = list(dict.fromkeys(ids))
+        with self._lock:
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                for id_, dtype, scale, blob in self._db.execute(
+                    f"SELECT id, dtype, scale, vector FROM compact_vectors WHERE namespace = ? AND id IN ({placeholders})",
+                    [self.namespace] + batch
+                ):
+                    rows[id_] = (dtype, scale, blob)
+        found = [id_ for id_ in unique if id_ in rows]
+        if not found:
+            return [], np.zeros((0, 0), dtype=np.float32)
+        matrix = np.stack([
+            np.frombuffer(rows[id_][2], dtype=np.float16 if rows[id_][0] == "float16" else np.int8)
+            for id_ in found
+        ])
+        scales = np.asarray([rows[id_][1] for id_ in found], dtype=np.float32)
+        return found, dequantize(matrix, scales)
+
+    def remove(self, ids: List[str]):
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                batch = list(ids[start:start + 500])
+                placeholders = ",".join("?" * len(batch))
+                self._db.execute(
+                    f"DELETE FROM compact_vectors WHERE namespace = ? AND id IN ({placeholders})",
+                    [self.namespace] + batch
+                )
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM compact_vectors WHERE namespace = ?", (self.namespace,))
+            self._db.commit()
+
+    def sync(self, collection, page_size: int = SYNC_PAGE_SIZE) -> "VectorSideStore":
+        """Copy vectors of records stored before the side store existed, a page at a time"""
+        with self._lock:
+            known = {row[0] for row in self._db.execute(
+                "SELECT id FROM compact_vectors WHERE namespace = ?", (self.namespace,)
+            )}
+        offset = 0
+        while True:
+            page = collection.get(include=[], limit=page_size, offset=offset)
+            missing = [id_ for id_ in page['ids'] if id_ not in known]
+            if missing:
+                stored = collection.get(ids=missing, include=["embeddings"])
+                self.put_many(stored['ids'], np.asarray(stored['embeddings'], dtype=np.float32))
+            if len(page['ids']) < page_size:
+                break
+            offset += page_size
+        return self
+
+
+def _wants_documents(include: Optional[List[str]]) -> bool:
+    # Chroma includes documents by default when include isn't given
+    return include is None or "documents" in include
+
+
+class CompactCollection:
+    """Chroma collection proxy moving bodies to a TextBlobStore and copying vectors to a VectorSideStore"""
+
+    def __init__(self, collection, texts: Optional[TextBlobStore] = None,
+                 vectors: Optional[VectorSideStore] = None, preview_chars: int = TEXT_PREVIEW_CHARS):
+        self._collection = collection
+        self.text_store = texts
+        self.vector_store = vectors
+        self.preview_chars = preview_chars
+
+    def __getattr__(self, attr):
+        return getattr(self._collection, attr)
+
+    def _store(self, ids, embeddings, documents):
+        """Write side stores; returns the documents to hand to Chroma"""
+        if self.vector_store is not None and embeddings is not None:
+            self.vector_store.put_many(list(ids), np.asarray(embeddings, dtype=np.float32))
+        if self.text_store is None or documents is None:
+            return documents
+        long_ids = [id_ for id_, text in zip(ids, documents) if text and len(text) > self.preview_chars]
+        if long_ids:
+            by_id = dict(zip(ids, documents))
+            self.text_store.put_many(long_ids, [by_id[id_] for id_ in long_ids])
+        return [text[:self.preview_chars] if text else text for text in documents]
+
+    def add(self, ids, embeddings=None, metadatas=None, documents=None, **kwargs):
+        documents = self._store(ids, embeddings, documents)
+        return self._collection.add(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents, **kwargs)
+
+    def upsert(self, ids, embeddings=None, metadatas=None, documents=None, **kwargs):
+        if documents is not None and self.text_store is not None:
+            # As in update: a body that now fits in the preview must not be shadowed by its old blob
+            self.text_store.remove(list(ids))
+        documents = self._store(ids, embeddings, documents)
+        return self._collection.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents, **kwargs)
+
+    def update(self, ids, embeddings=None, metadatas=None, documents=None, **kwargs):
+        if documents is not None and self.text_store is not None:
+            # A body that now fits in the preview must not be shadowed by its old blob
+            self.text_store.remove(list(ids))
+        documents = self._store(ids, embeddings, documents)
+        return self._collection.update(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents, **kwargs)
+
+    def _check_where_document(self, where_document):
+        if where_document and self.text_store is not None:
+            # Chroma only holds the preview, so the filter would miss text past it
+            raise ValueError("where_document is not supported with TEXT_STORE=blob")
+
+    def _hydrate(self, ids: List[str], documents: List[Optional[str]]) -> List[Optional[str]]:
+        if self.text_store is None or not ids:
+            return documents
+        full = self.text_store.get_many(ids)
+        return [full.get(id_, text) for id_, text in zip(ids, documents)]
+
+    def get(self, ids=None, where=None, limit=None, offset=None, where_document=None, include=None, **kwargs):
+        self._check_where_document(where_document)
+        arguments = dict(ids=ids, where=where, limit=limit, offset=offset, where_document=where_document, **kwargs)
+        if include is not None:
+            arguments["include"] = include
+        result = self._collection.get(**arguments)
+        if _wants_documents(include) and result.get('documents') is not None:
+            result['documents'] = self._hydrate(result['ids'], result['documents'])
+        return result
+
+    def get_previews(self, include=None, **kwargs):
+        """get() with the previews Chroma holds instead of full bodies, plus each body's full length in 'lengths'
+
+        Listing asks for this when it only shows the first TEXT_PREVIEW_CHARS
+        characters or fewer, so no blob is read or decompressed.
+        """
+        self._check_where_document(kwargs.get("where_document"))
+        if include is not None:
+            kwargs["include"] = include
+        result = self._collection.get(**kwargs)
+        if _wants_documents(include) and result.get('documents') is not None:
+            full = self.text_store.lengths(result['ids']) if self.text_store is not None else {}
+            result['lengths'] = [
+                full.get(id_, len(text or "")) for id_, text in zip(result['ids'], result['documents'])
+            ]
+        return result
+
+    def query(self, *args, include=None, **kwargs):
+        self._check_where_document(kwargs.get("where_document"))
+        if include is not None:
+            kwargs["include"] = include
+        result = self._collection.query(*args, **kwargs)
+        if _wants_documents(include) and result.get('documents') is not None:
+            result['documents'] = [
+                self._hydrate(ids, documents) for ids, documents in zip(result['ids'], result['documents'])
+            ]
+        return result
+
+    def delete(self, ids=None, where=None, where_document=None, **kwargs):
+        self._check_where_document(where_document)
+        if self.text_store is not None or self.vector_store is not None:
+            if ids is None:
+                # Resolve the filter first; the side stores are keyed by id
+                ids = self._collection.get(where=where, where_document=where_document, include=[])['ids']
+                where = where_document = None
+            if self.text_store is not None:
+                self.text_store.remove(list(ids))
+            if self.vector_store is not None:
+                self.vector_store.remove(list(ids))
+            if not ids:
+                return None
+        return self._collection.delete(ids=ids, where=where, where_document=where_document, **kwargs)
+
+
+def vector_store_of(collection) -> Optional[VectorSideStore]:
+    """The side store behind a (possibly wrapped) collection, if it has one"""
+    return getattr(collection, "vector_store", None) if collection is not None else None
+
+
+class CompactStores:
+    """One collection's side stores, built from TEXT_STORE / VECTOR_STORE; wrap() applies them"""
+
+    def __init__(self, path: str = COMPACT_STORE_PATH, namespace: str = "documents",
+                 text_store: str = TEXT_STORE, vector_store: str = VECTOR_STORE):
+        if text_store not in TEXT_STORES:
+            raise ValueError(f"text_store must be one of {', '.join(TEXT_STORES)}")
+        if vector_store not in VECTOR_STORES:
+            raise ValueError(f"vector_store must be one of {', '.join(VECTOR_STORES)}")
+        self.path = path
+        self.namespace = namespace
+        self.text_store = text_store
+        self.vector_store = vector_store
+        self._stores = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.text_store != "chroma" or self.vector_store != "off"
+
+    def _side_stores(self, name: str, bodies: bool):
+        with self._lock:
+            if name not in self._stores:
+                texts = TextBlobStore(self.path, name) if bodies and self.text_store == "blob" else None
+                vectors = VectorSideStore(self.path, name, self.vector_store) if self.vector_store != "off" else None
+                self._stores[name] = (texts, vectors)
+            return self._stores[name]
+
+    def wrap(self, collection, bodies: bool = True, sync: bool = True):
+        """collection behind a CompactCollection; bodies=False keeps text in Chroma (chunk windows)"""
+        if not self.enabled:
+            return collection
+        texts, vectors = self._side_stores(collection.name, bodies)
+        if texts is None and vectors is None:
+            return collection
+        if sync and vectors is not None:
+            vectors.sync(collection)
+        return CompactCollection(collection, texts, vectors)
+
+    def clear(self, collection_name: str):
+        """Drop everything stored for a collection and its chunks, whatever the current settings"""
+        if not self.enabled and not os.path.exists(self.path):
+            return
+        for name in (collection_name, f"{collection_name}_chunks"):
+            TextBlobStore(self.path, name).clear()
+            VectorSideStore(self.path, name).clear()
@@ -1,55 +1,37 @@
 #!/usr/bin/env python3
 
-import os
-import hashlib
-from typing import List, Dict, Tuple
-from sentence_transformers import SentenceTransformer
-import chromadb
-from chromadb.config import Settings
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
 from rich.console import Console
 from rich.table import Table
 from rich.progress import track
+from document_engine import DocumentEngine, generate_doc_id
 
 console = Console()
 
-class DocumentVectorizer:
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2", persist_dir: str = "./chroma_db"):
-        console.print(f"[cyan]Initializing with model: {model_name}[/cyan]")
-        self.model = SentenceTransformer(model_name)
-        
-        self.chroma_client = chromadb.PersistentClient(
-            path=persist_dir,
-            settings=Settings(anonymized_telemetry=False)
-        )
-        
-        self.collection = self.chroma_client.get_or_create_collection(
-            name="documents",
-            metadata={"hnsw:space": "cosine"}
-        )
-        console.print(f"[green]✓ Vector database ready at {persist_dir}[/green]")
+# The "list documents" menu option shows documents a page at a time
+CLI_PAGE_SIZE = 20
+PREVIEW_LENGTH = 80
+
+class DocumentVectorizer(DocumentEngine):
+    """DocumentEngine with console output and the CLI's return shapes"""
+    
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", persist_dir: str = "./chroma_db",
+                 cache_path: str = "./embedding_cache.db"):
+        # The model and database are opened on first use
+        super().__init__(model_name, persist_dir, cache_path, collection_name="documents")
     
     def _generate_doc_id(self, content: str) -> str:
-        return hashlib.md5(content.encode()).hexdigest()[:16]
+        return generate_doc_id(content)
     
-    def add_document(self, content: str, metadata: Dict = None) -> str:
-        doc_id = self._generate_doc_id(content)
-        
-        existing = self.collection.get(ids=[doc_id])
-        if existing['ids']:
-            console.print(f"[yellow]Document already exists with ID: {doc_id}[/yellow]")
-            return doc_id
+    def add_document(self, content: str, metadata: Dict = None, chunk: bool = False) -> str:
+        result = super().add_document(content, metadata, chunk)
         
-        embedding = self.model.encode(content).tolist()
-        
-        self.collection.add(
-            embeddings=[embedding],
-            documents=[content],
-            metadatas=[metadata or {}],
-            ids=[doc_id]
-        )
-        
-        console.print(f"[green]✓ Added document with ID: {doc_id}[/green]")
-        return doc_id
+        if not result["added"]:
+            console.print(f"[yellow]Document already exists with ID: {result['id']}[/yellow]")
+        else:
+            console.print(f"[green]✓ Added document with ID: {result['id']}[/green]")
+        return result["id"]
     
     def add_documents_batch(self, documents: List[str], metadatas: List[Dict] = None) -> List[str]:
         if not documents:
@@ -58,73 +40,38 @@ class DocumentVectorizer:
         if metadatas and len(metadatas) != len(documents):
             raise ValueError("Documents and metadatas must have the same length")
         
-        doc_ids = [self._generate_doc_id(doc) for doc in documents]
+        items = [
+            {"content": doc, "metadata": metadatas[i] if metadatas else None}
+            for i, doc in enumerate(documents)
+        ]
+        results = list(self.add_documents(items))
         
-        existing = self.collection.get(ids=doc_ids)
-        new_indices = [i for i, doc_id in enumerate(doc_ids) if doc_id not in existing['ids']]
-        
-        if not new_indices:
+        added = sum(1 for result in results if result["status"] == "added")
+        if not added:
             console.print("[yellow]All documents already exist in database[/yellow]")
-            return doc_ids
-        
-        new_docs = [documents[i] for i in new_indices]
-        new_ids = [doc_ids[i] for i in new_indices]
-        new_metas = [metadatas[i] if metadatas else {} for i in new_indices]
-        
-        console.print(f"[cyan]Encoding {len(new_docs)} new documents...[/cyan]")
-        embeddings = self.model.encode(new_docs, show_progress_bar=True).tolist()
-        
-        self.collection.add(
-            embeddings=embeddings,
-            documents=new_docs,
-            metadatas=new_metas,
-            ids=new_ids
-        )
-        
-        console.print(f"[green]✓ Added {len(new_docs)} documents[/green]")
-        return doc_ids
+        else:
+            console.print(f"[green]✓ Added {added} documents[/green]")
+        return [result.get("id") for result in results]
     
     def find_similar(self, query: str, n_results: int = 5) -> List[Tuple[str, float, str, Dict]]:
-        query_embedding = self.model.encode(query).tolist()
-        
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=n_results
-        )
-        
-        if not results['ids'][0]:
-            return []
-        
-        similar_docs = []
-        for i in range(len(results['ids'][0])):
-            similar_docs.append((
-                results['ids'][0][i],
-                results['distances'][0][i],
-                results['documents'][0][i],
-                results['metadatas'][0][i]
-            ))
-        
-        return similar_docs
+        # Always vector ranking, whatever SEARCH_MODE says, so the distances
+        # below mean what they always have
+        results = self.search(query, n_results, mode="vector")["results"]
+        
+        return [
+            (result["id"], 1 - result["similarity"], result["content"], result["metadata"])
+            for result in results
+        ]
     
     def compare_documents(self, doc1: str, doc2: str) -> float:
-        embedding1 = self.model.encode(doc1)
-        embedding2 = self.model.encode(doc2)
-        
-        from numpy import dot
-        from numpy.linalg import norm
-        
-        similarity = dot(embedding1, embedding2) / (norm(embedding1) * norm(embedding2))
-        return float(similarity)
+        return self.compare(doc1, doc2)["similarity"]
     
-    def get_all_documents(self) -> Dict:
-        return self.collection.get()
+    def get_all_documents(self, preview_length: Optional[int] = None) -> Iterator[Dict]:
+        """Every document as {"id", "content", "metadata"}, read from Chroma a page at a time"""
+        return self.iter_documents(preview_length=preview_length)
     
     def clear_database(self):
-        self.chroma_client.delete_collection("documents")
-        self.collection = self.chroma_client.create_collection(
-            name="documents",
-            metadata={"hnsw:space": "cosine"}
-        )
+        self.clear()
         console.print("[red]✓ Database cleared[/red]")
 
 
@@ -227,30 +174,32 @@ def main():
             if topic:
                 metadata["topic"] = topic
             
-            doc_id = vectorizer.add_document(content, metadata)
+            vectorizer.add_document(content, metadata)
             
         elif choice == "4":
-            all_docs = vectorizer.get_all_documents()
+            documents = vectorizer.get_all_documents(preview_length=PREVIEW_LENGTH)
+            page = list(islice(documents, CLI_PAGE_SIZE))
             
-            if not all_docs['ids']:
+            if not page:
                 console.print("[yellow]No documents in database[/yellow]")
-            else:
+            shown = 0
+            while page:
                 table = Table(title="All Documents", show_header=True)
                 table.add_column("ID", style="yellow")
                 table.add_column("Content Preview", style="white")
                 table.add_column("Metadata", style="blue")
                 
-                for i in range(len(all_docs['ids'])):
-                    content = all_docs['documents'][i]
-                    preview = content[:80] + "..." if len(content) > 80 else content
-                    table.add_row(
-                        all_docs['ids'][i],
-                        preview,
-                        str(all_docs['metadatas'][i])
-                    )
+                for document in page:
+                    preview = document['content'] + ("..." if document['truncated'] else "")
+                    table.add_row(document['id'], preview, str(document['metadata']))
                 
                 console.print(table)
-                console.print(f"\n[cyan]Total documents: {len(all_docs['ids'])}[/cyan]")
+                shown += len(page)
+                page = list(islice(documents, CLI_PAGE_SIZE))
+                if page and console.input("[cyan]Show more? (y/n): [/cyan]").lower() != 'y':
+                    break
+            if shown:
+                console.print(f"\n[cyan]Total documents: {vectorizer.count()}[/cyan]")
             
         elif choice == "5":
             confirm = console.input("\n[red]Are you sure? This will delete all documents (y/n): [/red]")
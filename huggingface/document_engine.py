@@ -0,0 +1,539 @@
+"""
+Core document engine shared by every front end.
+
+The Gradio app (two copies of each handler), the Flask API, the ASGI API and
+the CLI each carried their own add/search/compare/list/delete logic, so every
+change to encoding, chunking or indexing had to be made in five places.
+DocumentEngine owns the model, encoder (batching + cache), Chroma client,
+collection, chunk collection and optional metadata index, and implements
+each operation once. Front ends only parse input and format output.
+
+Methods return plain dicts shaped like the API responses. Bad input raises
+ValueError and a missing document raises KeyError, which adapters turn into
+their own error format.
+"""
+
+import hashlib
+import os
+from typing import Dict, Iterator, List, Optional
+
+import chromadb
+import numpy as np
+from chromadb.config import Settings
+
+from batch_search import search_batch
+from bulk_ingest import ingest_documents
+from chunking import add_chunked_document, delete_chunks, get_chunk_collection
+from compact_store import COMPACT_STORE_PATH, CompactStores
+from embedding_cache import CachedEncoder, EmbeddingCache
+from embedding_engine import BatchingEncoder, normalize_rows
+from encoder_backends import cache_model_name, load_model
+from exact_index import EXACT_SEARCH_MAX_VECTORS, ExactIndex, exact_collection
+from filtered_search import filtered_search_many, plan_search
+from hnsw_tuning import collection_metadata
+from lazy import Lazy
+from lexical_index import (
+    HYBRID_LEXICAL_WEIGHT, HYBRID_OVERSAMPLE, LEXICAL_PATH, SEARCH_MODE, SEARCH_MODES, BM25Index, reciprocal_rank_fusion
+)
+from listing import DEFAULT_PAGE_SIZE, iter_documents, page_documents, parse_fields
+from metadata_index import INDEXED_FIELDS, MetadataIndex
+from metrics import instrument_collection, instrument_encoder
+from near_duplicates import NEAR_DUP_ACTION, NEAR_DUP_ACTIONS, NEAR_DUP_PATH, NearDuplicateIndex, near_duplicate_metadata
+from passages import PASSAGE_THRESHOLD, ChunkVectorCache, locate_passages
+from pdf_extract import get_extractor
+from result_cache import SEARCH_CACHE_SIZE, SearchResultCache
+from similarity import compare_matrix
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+
+
+def generate_doc_id(content: str) -> str:
+    return hashlib.md5(content.encode()).hexdigest()[:16]
+
+
+def _connect(persist_dir: str, allow_reset: bool, chroma_host: str, chroma_port: int):
+    # A local directory must only be opened by one process; several workers
+    # share a Chroma server instead
+    if chroma_host:
+        return chromadb.HttpClient(host=chroma_host, port=chroma_port)
+    return chromadb.PersistentClient(
+        path=persist_dir,
+        settings=Settings(anonymized_telemetry=False, allow_reset=allow_reset, is_persistent=True)
+    )
+
+
+def _single_process(chroma_host: str) -> bool:
+    """Whether this process is the collections' only writer.
+
+    Not when they live on a Chroma server, or when several gunicorn/uvicorn
+    workers (WEB_CONCURRENCY) serve the app.
+    """
+    return not chroma_host and int(os.environ.get('WEB_CONCURRENCY', '1')) <= 1
+
+
+class DocumentEngine:
+    """Encoder plus one Chroma collection; everything is built on first use"""
+
+    def __init__(self, model_name: str = MODEL_NAME, persist_dir: str = "./chroma_db",
+                 cache_path: str = "./embedding_cache.db", collection_name: str = "documents",
+                 indexed: bool = False, allow_reset: bool = False, chroma_host: str = "",
+                 chroma_port: int = 8000, near_dup_path: str = NEAR_DUP_PATH,
+                 near_dup_action: str = NEAR_DUP_ACTION, lexical_path: str = LEXICAL_PATH,
+                 search_mode: str = SEARCH_MODE, compact_path: str = COMPACT_STORE_PATH,
+                 _shared: Optional[Dict] = None):
+        if near_dup_action not in NEAR_DUP_ACTIONS:
+            raise ValueError(f"near_dup_action must be one of {', '.join(NEAR_DUP_ACTIONS)}")
+        if search_mode not in SEARCH_MODES:
+            raise ValueError(f"search_mode must be one of {', '.join(SEARCH_MODES)}")
+        self.model_name = model_name
+        self.persist_dir = persist_dir
+        self.collection_name = collection_name
+        self.near_dup_path = near_dup_path
+        self.near_dup_action = near_dup_action
+        self.lexical_path = lexical_path
+        self.search_mode = search_mode
+
+        if _shared is None:
+            model = Lazy(lambda: load_model(model_name), "model")
+            _shared = {
+                "model": model,
+                # encode and Chroma calls are timed as metrics stages
+                "encoder": Lazy(lambda: instrument_encoder(CachedEncoder(
+                    BatchingEncoder(model.resolve()),
+                    EmbeddingCache(cache_path, cache_model_name(model_name, model.resolve()))
+                )), "encoder"),
+                "chroma_client": Lazy(
+                    lambda: _connect(persist_dir, allow_reset, chroma_host, chroma_port), "chroma_client"
+                ),
+                # Bodies and compact vectors kept outside Chroma (TEXT_STORE / VECTOR_STORE)
+                "compact_stores": CompactStores(compact_path),
+                "single_process": _single_process(chroma_host)
+            }
+        self._shared = _shared
+        self.model = _shared["model"]
+        self.encoder = _shared["encoder"]
+        self.chroma_client = _shared["chroma_client"]
+        self.compact_stores = _shared["compact_stores"]
+
+        # HNSW parameters come from HNSW_* / HNSW_PARAMS (see hnsw_tuning)
+        # Small collections are searched in process over an exact matrix
+        # (exact_index), unless other processes write to them too
+        exact_max = EXACT_SEARCH_MAX_VECTORS if _shared["single_process"] else 0
+        self.exact_index = ExactIndex(collection_name, exact_max)
+        self.exact_chunk_index = ExactIndex(f"{collection_name}_chunks", exact_max, parent_key="parent_id")
+        self.collection = Lazy(lambda: self._wrap(self.chroma_client.get_or_create_collection(
+            name=collection_name,
+            metadata=collection_metadata(collection_name)
+        )), collection_name)
+        self.chunk_collection = Lazy(
+            lambda: self._wrap(get_chunk_collection(self.chroma_client, self.collection), chunks=True),
+            f"{collection_name}_chunks"
+        )
+        # arxiv_id / source / subject_matter -> ids, so dedup checks and
+        # filtered listings don't scan Chroma's metadata table. It is loaded
+        # once and kept current by this process's writes only, so with other
+        # writers there is none and filters go to Chroma's where
+        self.indexed = indexed
+        self.index = Lazy(
+            lambda: MetadataIndex().load(self.collection), f"{collection_name}_index"
+        ) if indexed and _shared["single_process"] else None
+        # MinHash signatures, so an edited resubmission is caught before it
+        # is encoded; sync() back-fills documents stored before the index
+        self.near_duplicates = Lazy(
+            lambda: NearDuplicateIndex(near_dup_path, collection_name).sync(self.collection),
+            f"{collection_name}_near_duplicates"
+        ) if near_dup_action != "off" else None
+        # BM25 over the same units the vectors cover, for hybrid search
+        self.lexical = Lazy(
+            lambda: BM25Index(lexical_path, collection_name).sync(self.collection, self.chunk_collection),
+            f"{collection_name}_lexical"
+        )
+        # Stored documents' chunk vectors for passage localization
+        self.chunk_vectors = ChunkVectorCache()
+        # Recent search responses; every write below bumps its version. The
+        # version lives in this process, so with other writers the cache is off
+        self.search_cache = SearchResultCache(
+            collection_name, SEARCH_CACHE_SIZE if _shared["single_process"] else 0
+        )
+
+    def _wrap(self, collection, chunks: bool = False, sync: bool = True):
+        """A Chroma collection behind the side stores, the exact index and metrics timing"""
+        # Chunk windows are short and keep their text in Chroma
+        collection = self.compact_stores.wrap(collection, bodies=not chunks, sync=sync)
+        index = self.exact_chunk_index if chunks else self.exact_index
+        if sync:
+            index.sync(collection)
+        return instrument_collection(exact_collection(collection, index))
+
+    def sibling(self, collection_name: str, indexed: bool = False,
+                near_dup_action: Optional[str] = None) -> "DocumentEngine":
+        """An engine for another collection sharing this one's model, encoder and client"""
+        return DocumentEngine(
+            self.model_name,
+            self.persist_dir,
+            collection_name=collection_name,
+            indexed=indexed,
+            near_dup_path=self.near_dup_path,
+            near_dup_action=near_dup_action or self.near_dup_action,
+            lexical_path=self.lexical_path,
+            search_mode=self.search_mode,
+            _shared=self._shared
+        )
+
+    def resources(self) -> Dict[str, Lazy]:
+        """The lazily built pieces, for warm-up and readiness reporting"""
+        resources = {
+            "model": self.model,
+            "encoder": self.encoder,
+            "chroma": self.chroma_client,
+            self.collection_name: self.collection
+        }
+        if self.index is not None:
+            resources[f"{self.collection_name}_index"] = self.index
+        if self.near_duplicates is not None:
+            resources[f"{self.collection_name}_near_duplicates"] = self.near_duplicates
+        resources[f"{self.collection_name}_lexical"] = self.lexical
+        return resources
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def exists(self, doc_id: str) -> bool:
+        return bool(self.collection.get(ids=[doc_id], include=[])['ids'])
+
+    def _record(self, doc_ids: List[str], metadatas: List[Optional[Dict]]):
+        if self.index is not None:
+            self.index.add_many(doc_ids, metadatas)
+
+    def add_document(self, content: str, metadata: Optional[Dict] = None, chunk: bool = False) -> Dict:
+        """Store a document unless it exists; chunk=True also stores per-chunk vectors.
+
+        Returns {"id", "added"}. A near-duplicate of a stored document is
+        skipped (near_dup_action="skip", "id" is the stored document's) or
+        stored with near_duplicate_of metadata ("link"); either way the result
+        carries "near_duplicate_of" and "jaccard".
+        """
+        if not content or not content.strip():
+            raise ValueError("Content is required")
+
+        doc_id = generate_doc_id(content)
+        if self.exists(doc_id):
+            return {"id": doc_id, "added": False}
+
+        near_duplicate = None
+        if self.near_duplicates is not None:
+            signature = self.near_duplicates.signature(content)
+            match = self.near_duplicates.find_duplicate(signature)
+            if match is not None:
+                near_duplicate = {"near_duplicate_of": match[0], "jaccard": match[1]}
+                if self.near_dup_action == "skip":
+                    return {"id": match[0], "added": False, **near_duplicate}
+                metadata = {**(metadata or {}), **near_duplicate_metadata(match)}
+
+        if chunk:
+            units = add_chunked_document(
+                self.collection, self.chunk_collection, self.encoder, doc_id, content, metadata or {}
+            )
+            # Recorded so filtered searches can size an exact scan
+            metadata = {**(metadata or {}), "chunk_count": len(units)}
+        else:
+            units = [content]
+            self.collection.add(
+                embeddings=[self.encoder.encode(content).tolist()],
+                documents=[content],
+                # Chroma rejects empty metadata dicts
+                metadatas=[metadata or None],
+                ids=[doc_id]
+            )
+        self._record([doc_id], [metadata])
+        self.lexical.add(doc_id, units)
+        if self.near_duplicates is not None:
+            self.near_duplicates.add(doc_id, signature)
+        self.search_cache.bump()
+        return {"id": doc_id, "added": True, **(near_duplicate or {})}
+
+    def add_documents(self, items, base_metadata: Optional[Dict] = None, **kwargs) -> Iterator[Dict]:
+        """Bulk add; yields one result per item (see bulk_ingest.ingest_documents)"""
+        results = ingest_documents(
+            self.collection, self.encoder, items, generate_doc_id, base_metadata,
+            index=self.index, lexical=self.lexical, near_duplicates=self.near_duplicates,
+            near_dup_action=self.near_dup_action, **kwargs
+        )
+        for result in results:
+            # Items are yielded once their group is stored
+            if result["status"] == "added":
+                self.search_cache.bump()
+            yield result
+
+    def add_pdf(self, pdf_bytes: bytes, filename: str, metadata: Optional[Dict] = None,
+                source: str = "pdf_upload") -> Dict:
+        """Extract a PDF's text and store it chunked. Returns {"id", "added", "text_length", "pages"}"""
+        try:
+            # Runs in the extraction process pool so the request thread
+            # doesn't hold the GIL for the whole parse
+            text = get_extractor().extract_text(pdf_bytes)
+        except Exception as e:
+            raise ValueError(f"Failed to extract text from PDF: {str(e)}")
+        if not text.strip():
+            raise ValueError("No text found in PDF")
+
+        meta_dict = {"source": source, "filename": filename}
+        meta_dict.update(metadata or {})
+        meta_dict["text_length"] = len(text)
+        meta_dict["pages"] = len(text.split('\n\n'))
+
+        # Not self.add_document: subclasses (the CLI) return just the id
+        result = DocumentEngine.add_document(self, text, meta_dict, chunk=True)
+        result.update({"filename": filename, "text_length": meta_dict["text_length"], "pages": meta_dict["pages"]})
+        return result
+
+    def search(self, query: str, n_results: int = 5, where: Optional[Dict] = None,
+               mode: Optional[str] = None, where_document: Optional[Dict] = None,
+               query_embedding=None) -> Dict:
+        """Search by vector, BM25 ("lexical") or both fused with RRF ("hybrid").
+
+        similarity is always the cosine similarity to the query; in lexical
+        and hybrid modes each result also has its fused "score" and, if it
+        matched lexically, its "bm25" score. With where or where_document
+        the response's "filter" reports the strategy filtered_search chose.
+        Responses are cached until the collection's next write (result_cache).
+        query_embedding skips the encode, for callers that already awaited it.
+        """
+        if not query or not query.strip():
+            raise ValueError("Query is required")
+        mode = (mode or self.search_mode).lower()
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"mode must be one of {', '.join(SEARCH_MODES)}")
+
+        # Read before anything else so a write during the search can't be
+        # cached under the version that follows it
+        version = self.search_cache.version
+        doc_count = self.count()
+        if doc_count == 0:
+            return {"results": [], "query": query, "mode": mode, "message": "No documents in database"}
+
+        n_results = max(1, min(int(n_results), doc_count))
+        if query_embedding is None:
+            query_embedding = self.encoder.encode(query)
+        cache_key = self.search_cache.key(version, query_embedding, n_results, mode, where, where_document, query)
+        cached = self.search_cache.get(cache_key)
+        if cached is not None:
+            return {**cached, "query": query}
+
+        response = self._search(query, query_embedding, n_results, mode, where, where_document, doc_count)
+        self.search_cache.put(cache_key, response)
+        return response
+
+    def _search(self, query: str, query_embedding, n_results: int, mode: str, where: Optional[Dict],
+                where_document: Optional[Dict], doc_count: int) -> Dict:
+        plan = plan_search(where, where_document, self.index)
+        response = {"query": query, "mode": mode}
+        if where or where_document:
+            response["filter"] = plan.describe()
+
+        if mode == "vector":
+            return {"results": self._vector_hits(query_embedding, n_results, plan), **response}
+
+        depth = min(doc_count, max(n_results * HYBRID_OVERSAMPLE, 20))
+        vector_hits = self._vector_hits(query_embedding, depth, plan) if mode == "hybrid" else []
+        found = {hit["id"]: hit for hit in vector_hits}
+
+        # With a filter, rank only the index's candidates and read further down
+        # the ranking until depth hits pass the rest of the filter; the top
+        # depth before filtering could be filtered out entirely
+        filtered = bool(where or where_document)
+        ranking = self.lexical.search(query, None if filtered else depth, plan.candidates)
+        bm25 = {}
+        for start in range(0, len(ranking), depth):
+            page = ranking[start:start + depth]
+            missing = [doc_id for doc_id, _ in page if doc_id not in found]
+            if missing:
+                # Lexical hits the vector side missed: fetch them (applying the
+                # filter) and score them against the query for a comparable similarity
+                fetched = self.collection.get(
+                    ids=missing,
+                    where=plan.chroma_where,
+                    where_document=plan.where_document,
+                    include=["documents", "metadatas", "embeddings"]
+                )
+                if fetched['ids']:
+                    similarities = normalize_rows(np.asarray(fetched['embeddings'], dtype=np.float32)) @ (
+                        normalize_rows(np.asarray([query_embedding], dtype=np.float32))[0]
+                    )
+                    for i, doc_id in enumerate(fetched['ids']):
+                        found[doc_id] = {
+                            "id": doc_id,
+                            "similarity": float(similarities[i]),
+                            "content": fetched['documents'][i],
+                            "metadata": fetched['metadatas'][i]
+                        }
+            for doc_id, score in page:
+                if doc_id in found and len(bm25) < depth:
+                    bm25[doc_id] = score
+            if len(bm25) >= depth:
+                break
+        lexical_ids = list(bm25)
+
+        if mode == "hybrid":
+            ranked = reciprocal_rank_fusion(
+                [[hit["id"] for hit in vector_hits], lexical_ids],
+                [1.0, HYBRID_LEXICAL_WEIGHT]
+            )
+        else:
+            ranked = [(doc_id, bm25[doc_id]) for doc_id in lexical_ids]
+
+        formatted_results = []
+        for doc_id, score in ranked[:n_results]:
+            result = dict(found[doc_id], score=score)
+            if doc_id in bm25:
+                result["bm25"] = bm25[doc_id]
+            formatted_results.append(result)
+
+        return {"results": formatted_results, **response}
+
+    def _vector_hits(self, query_embedding, n_results: int, plan) -> List[Dict]:
+        results = filtered_search_many(
+            self.collection,
+            self.chunk_collection,
+            [query_embedding.tolist()],
+            n_results,
+            plan
+        )
+
+        formatted_results = []
+        for i in range(len(results['ids'][0])):
+            formatted_results.append({
+                "id": results['ids'][0][i],
+                "similarity": 1 - results['distances'][0][i],
+                "content": results['documents'][0][i],
+                "metadata": results['metadatas'][0][i]
+            })
+        return formatted_results
+
+    def search_batch(self, queries: List, n_results: int = 5) -> Dict:
+        return search_batch(self.collection, self.chunk_collection, self.encoder, queries, n_results, self.index)
+
+    def compare(self, doc1: str, doc2: str, embeddings=None) -> Dict:
+        """Cosine similarity of two texts; embeddings skips the encode, for callers that already awaited it"""
+        if not doc1 or not doc2 or not doc1.strip() or not doc2.strip():
+            raise ValueError("Both documents are required")
+
+        embedding1, embedding2 = self.encoder.encode([doc1, doc2]) if embeddings is None else embeddings
+        similarity = float(np.dot(embedding1, embedding2) / (np.linalg.norm(embedding1) * np.linalg.norm(embedding2)))
+
+        return {
+            "similarity": similarity,
+            "percentage": similarity * 100,
+            "doc1_preview": doc1[:100],
+            "doc2_preview": doc2[:100]
+        }
+
+    def compare_matrix(self, queries: List, references: Optional[List] = None,
+                       top_k: Optional[int] = None, threshold: Optional[float] = None) -> Dict:
+        return compare_matrix(self.collection, self.encoder, queries, references, top_k=top_k, threshold=threshold)
+
+    def locate_passages(self, content: str, doc_id: str, threshold: Optional[float] = None) -> Dict:
+        """Aligned passage pairs between content and a stored document (see passages.locate_passages)"""
+        return locate_passages(
+            self.collection, self.chunk_collection, self.encoder, content, doc_id,
+            PASSAGE_THRESHOLD if threshold is None else float(threshold),
+            cache=self.chunk_vectors
+        )
+
+    def list_documents(self, limit: int = DEFAULT_PAGE_SIZE, offset: int = 0,
+                       fields=None, preview_length: Optional[int] = None) -> Dict:
+        include_content, include_metadata = parse_fields(fields)
+        return page_documents(self.collection, limit, offset, include_content, include_metadata, preview_length)
+
+    def iter_documents(self, offset: int = 0, fields=None, preview_length: Optional[int] = None) -> Iterator[Dict]:
+        include_content, include_metadata = parse_fields(fields)
+        return iter_documents(self.collection, include_content, include_metadata, preview_length, offset)
+
+    def get_documents(self, doc_ids: Optional[List[str]] = None, **kwargs) -> Dict:
+        """Raw collection.get, for callers that want Chroma's own shape"""
+        return self.collection.get(ids=doc_ids, **kwargs)
+
+    def delete(self, doc_id: str) -> Dict:
+        if not self.exists(doc_id):
+            raise KeyError("Document not found")
+
+        self.collection.delete(ids=[doc_id])
+        if self.index is not None:
+            self.index.remove([doc_id])
+        if self.near_duplicates is not None:
+            self.near_duplicates.remove([doc_id])
+        self.chunk_vectors.discard([doc_id])
+        self.lexical.remove([doc_id])
+        delete_chunks(self.chunk_collection, [doc_id])
+        self.search_cache.bump()
+        return {"message": "Document deleted", "id": doc_id}
+
+    def lookup(self, filters: Optional[Dict] = None) -> Dict:
+        if not self.indexed:
+            raise ValueError("This collection has no metadata index")
+        filters = filters or {}
+        unsupported = [field for field in filters if field not in INDEXED_FIELDS]
+        if unsupported:
+            raise ValueError(
+                f"Unsupported lookup fields: {', '.join(unsupported)}. Indexed fields: {', '.join(INDEXED_FIELDS)}"
+            )
+        if self.index is not None:
+            doc_ids = sorted(self.index.lookup(**filters))
+        else:
+            # Other processes write too; only Chroma sees all their documents
+            clauses = [{field: value} for field, value in filters.items()]
+            where = (clauses[0] if len(clauses) == 1 else {"$and": clauses}) if clauses else None
+            doc_ids = sorted(self.collection.get(where=where, include=[])['ids'])
+        return {"ids": doc_ids, "count": len(doc_ids), "filters": filters}
+
+    def near_duplicate_candidates(self, content: str, threshold: Optional[float] = None,
+                                  limit: int = 20) -> Dict:
+        """Stored documents lexically close to content, from MinHash buckets only (no encode).
+
+        A cheap first pass for plagiarism checks; threshold defaults to the
+        index's near-duplicate threshold and 0 keeps every bucket hit.
+        """
+        if self.near_duplicates is None:
+            raise ValueError("Near-duplicate detection is disabled (NEAR_DUP_ACTION=off)")
+        if not content or not content.strip():
+            raise ValueError("Content is required")
+        threshold = self.near_duplicates.threshold if threshold is None else float(threshold)
+        if not 0 <= threshold <= 1:
+            raise ValueError("threshold must be between 0 and 1")
+
+        matches = self.near_duplicates.query(
+            self.near_duplicates.signature(content),
+            threshold=threshold,
+            limit=max(1, int(limit)),
+            exclude=generate_doc_id(content)
+        )
+        return {
+            "candidates": [{"id": doc_id, "jaccard": score} for doc_id, score in matches],
+            "count": len(matches),
+            "threshold": threshold
+        }
+
+    def clear(self):
+        """Drop and recreate the collection and its chunks"""
+        for name in (self.collection_name, f"{self.collection_name}_chunks"):
+            try:
+                self.chroma_client.delete_collection(name)
+            except Exception:
+                pass
+        self.compact_stores.clear(self.collection_name)
+        self.exact_index.clear()
+        self.exact_chunk_index.clear()
+        self.collection.swap(self._wrap(self.chroma_client.create_collection(
+            name=self.collection_name,
+            metadata=collection_metadata(self.collection_name)
+        ), sync=False))
+        self.chunk_collection.swap(self._wrap(
+            get_chunk_collection(self.chroma_client, self.collection), chunks=True, sync=False
+        ))
+        if self.index is not None:
+            self.index.clear()
+        if self.near_duplicates is not None:
+            self.near_duplicates.clear()
+        self.chunk_vectors.clear()
+        self.lexical.clear()
+        self.search_cache.bump()
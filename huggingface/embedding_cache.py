@@ -0,0 +1,162 @@
+"""
+Content-addressed embedding cache.
+
+Embeddings are keyed by the same md5 prefix generate_doc_id uses plus the
+model name, so a repeated search query, a re-compared document or a re-uploaded
+PDF costs a hash lookup instead of a forward pass. Recent vectors live in an
+in-memory LRU; everything is written through to a sqlite blob table so the
+cache survives restarts.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Union
+
+import numpy as np
+
+from embedding_engine import normalize_rows
+
+CACHE_MEMORY_ITEMS = int(os.environ.get('EMBEDDING_CACHE_ITEMS', '10000'))
+
+
+def content_key(content: str) -> str:
+    """Same hash as generate_doc_id"""
+    return hashlib.md5(content.encode()).hexdigest()[:16]
+
+
+class EmbeddingCache:
+    def __init__(self, path: str, model_name: str, max_memory_items: int = CACHE_MEMORY_ITEMS):
+        self.model_name = model_name
+        self.max_memory_items = max_memory_items
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT NOT NULL,"
+            " model TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " PRIMARY KEY (key, model))"
+        )
+        self._db.commit()
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        """Look keys up in memory, then on disk; None marks a miss"""
+        with self._lock:
+            found = {}
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+
+            missing = [key for key in set(keys) if key not in found]
+            # Stay well under sqlite's bound-parameter limit
+            for start in range(0, len(missing), 500):
+                batch = missing[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE model = ? AND key IN ({placeholders})",
+                    [self.model_name] + batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    found[key] = vector
+                    self._remember(key, vector)
+
+            results = [found.get(key) for key in keys]
+            hit_count = sum(1 for vector in results if vector is not None)
+            self.hits += hit_count
+            self.misses += len(keys) - hit_count
+            return results
+
+    def put_many(self, keys: List[str], vectors: np.ndarray):
+        with self._lock:
+            rows = []
+            for key, vector in zip(keys, vectors):
+                vector = np.asarray(vector, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((key, self.model_name, vector.tobytes()))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector) VALUES (?, ?, ?)",
+                rows
+            )
+            self._db.commit()
+
+
+class CachedEncoder:
+    """Wraps an encoder (model or BatchingEncoder) so only cache misses are encoded"""
+
+    def __init__(self, encoder, cache: EmbeddingCache):
+        self.encoder = encoder
+        self.cache = cache
+
+    @property
+    def tokenizer(self):
+        return getattr(self.encoder, "tokenizer", None)
+
+    def _lookup(self, texts: List[str]):
+        keys = [content_key(text) for text in texts]
+        cached = self.cache.get_many(keys)
+        # Encode each distinct missing text once
+        misses = list(OrderedDict.fromkeys(
+            text for text, vector in zip(texts, cached) if vector is None
+        ))
+        return keys, cached, misses
+
+    def _assemble(self, texts, keys, cached, misses, encoded) -> np.ndarray:
+        fresh = {}
+        if misses:
+            encoded = np.asarray(encoded, dtype=np.float32)
+            miss_keys = [content_key(text) for text in misses]
+            self.cache.put_many(miss_keys, encoded)
+            fresh = dict(zip(miss_keys, encoded))
+        return np.stack([
+            vector if vector is not None else fresh[key]
+            for key, vector in zip(keys, cached)
+        ])
+
+    def encode(self, texts: Union[str, List[str]], batch_size: Optional[int] = None,
+               show_progress_bar: bool = False, normalize_embeddings: bool = False) -> np.ndarray:
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        if not texts:
+            return self.encoder.encode(texts)
+
+        keys, cached, misses = self._lookup(texts)
+        encoded = self.encoder.encode(misses, show_progress_bar=show_progress_bar) if misses else None
+        embeddings = self._assemble(texts, keys, cached, misses, encoded)
+
+        if normalize_embeddings:
+            embeddings = normalize_rows(embeddings)
+        return embeddings[0] if single else embeddings
+
+    async def aencode(self, texts: Union[str, List[str]], normalize_embeddings: bool = False) -> np.ndarray:
+        """encode for asyncio callers; fully cached texts return without touching the batcher"""
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        if not texts:
+            return self.encoder.encode(texts)
+
+        keys, cached, misses = self._lookup(texts)
+        encoded = await self.encoder.aencode(misses) if misses else None
+        embeddings = self._assemble(texts, keys, cached, misses, encoded)
+
+        if normalize_embeddings:
+            embeddings = normalize_rows(embeddings)
+        return embeddings[0] if single else embeddings
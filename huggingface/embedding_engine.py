@@ -0,0 +1,130 @@
+"""
+Request-coalescing embedding engine.
+
+Request handlers run on many threads (Gradio workers, gunicorn threads) and
+each used to call model.encode on a single string, so concurrent traffic turned
+into many batch-size-1 forward passes. BatchingEncoder queues texts from all
+callers, flushes them through the model together once max_batch_size texts are
+waiting or max_wait_ms has passed, and hands every caller its own slice of the
+result through a future.
+"""
+
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional, Union
+
+import numpy as np
+
+MAX_BATCH_SIZE = int(os.environ.get('EMBED_MAX_BATCH', '64'))
+MAX_WAIT_MS = float(os.environ.get('EMBED_MAX_WAIT_MS', '5'))
+
+_STOP = object()
+
+
+class BatchingEncoder:
+    def __init__(self, model, max_batch_size: int = MAX_BATCH_SIZE, max_wait_ms: float = MAX_WAIT_MS):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    @property
+    def tokenizer(self):
+        return getattr(self.model, "tokenizer", None)
+
+    def submit(self, texts: List[str]) -> Future:
+        """Queue texts for encoding; the future resolves to an (n, dim) array"""
+        future = Future()
+        if not texts:
+            future.set_result(np.zeros((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32))
+            return future
+        self._queue.put((list(texts), future))
+        return future
+
+    def encode(self, texts: Union[str, List[str]], batch_size: Optional[int] = None,
+               show_progress_bar: bool = False, normalize_embeddings: bool = False) -> np.ndarray:
+        """Drop-in for model.encode: a str gives a 1-D vector, a list gives a 2-D array.
+
+        batch_size and show_progress_bar are accepted for compatibility; the
+        engine picks its own batch sizes.
+        """
+        single = isinstance(texts, str)
+        embeddings = self.submit([texts] if single else texts).result()
+        if normalize_embeddings:
+            embeddings = normalize_rows(embeddings)
+        return embeddings[0] if single else embeddings
+
+    async def aencode(self, texts: Union[str, List[str]], normalize_embeddings: bool = False) -> np.ndarray:
+        """asyncio front end to encode; awaits the batch without blocking the loop"""
+        single = isinstance(texts, str)
+        embeddings = await asyncio.wrap_future(self.submit([texts] if single else texts))
+        if normalize_embeddings:
+            embeddings = normalize_rows(embeddings)
+        return embeddings[0] if single else embeddings
+
+    def close(self):
+        self._queue.put(_STOP)
+        self._worker.join()
+
+    def _collect(self, first) -> List:
+        """Gather requests behind first until the batch is full or the wait expires"""
+        pending = [first]
+        size = len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.put(_STOP)
+                break
+            pending.append(item)
+            size += len(item[0])
+        return pending
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            # Futures cancelled while queued are dropped; resolving them would raise
+            pending = [
+                (request_texts, future) for request_texts, future in self._collect(item)
+                if future.set_running_or_notify_cancel()
+            ]
+            if not pending:
+                continue
+
+            texts = [text for request_texts, _ in pending for text in request_texts]
+            try:
+                embeddings = np.asarray(self.model.encode(
+                    texts,
+                    batch_size=self.max_batch_size,
+                    show_progress_bar=False
+                ), dtype=np.float32)
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for request_texts, future in pending:
+                future.set_result(embeddings[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+
+
+def normalize_rows(embeddings: np.ndarray) -> np.ndarray:
+    """Scale each row to unit length, leaving zero rows alone"""
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
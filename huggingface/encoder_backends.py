@@ -0,0 +1,193 @@
+"""
+Selectable inference backends for the sentence embedding model.
+
+ENCODER_BACKEND picks how all-MiniLM-L6-v2 runs:
+
+    torch      fp32 PyTorch (default)
+    onnx       fp32 ONNX Runtime graph
+    onnx-int8  ONNX Runtime with dynamically quantized int8 weights
+
+The ONNX variants go through sentence-transformers' own backend support
+(needs `optimum[onnxruntime]`) and load the graphs the model repo publishes
+under onnx/. The int8 file is matched to the CPU's instruction set unless
+ENCODER_ONNX_FILE names one. Without those packages (or with
+sentence-transformers older than 3.2) an ONNX backend is a setup error and
+loading raises. If the packages are there but the graph can't be loaded, the
+model falls back to torch so the app still starts.
+
+int8 embeddings drift slightly from fp32 ones, so cached embeddings are kept
+per backend, and `python encoder_backends.py onnx-int8` reports cosine drift
+and throughput against the fp32 baseline before switching a deployment.
+"""
+
+import argparse
+import importlib.util
+import os
+import platform
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from embedding_engine import normalize_rows
+
+ENCODER_BACKEND = os.environ.get('ENCODER_BACKEND', 'torch')
+ENCODER_ONNX_FILE = os.environ.get('ENCODER_ONNX_FILE', '')
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+PARITY_CORPUS = [
+    "Machine learning is a subset of artificial intelligence that enables systems to learn from data.",
+    "Deep learning uses neural networks with multiple layers to process complex patterns.",
+    "Natural language processing helps computers understand and generate human language.",
+    "The weather today is sunny with clear skies and mild temperatures.",
+    "Gradient descent is an optimization algorithm used to minimize loss functions in ML models.",
+    "We prove a tight lower bound on the query complexity of approximate nearest neighbour search in high dimensions.",
+    "The court held that copying substantial portions of the original work without attribution constitutes infringement.",
+    "Protein folding prediction has improved dramatically with attention-based architectures trained on sequence databases.",
+    "A recipe for sourdough bread: flour, water, salt and a mature starter, left to ferment overnight.",
+    "Quarterly revenue rose four percent while operating costs fell, driven by lower logistics spending.",
+    "Transformers",
+    "cats",
+    " ".join([
+        "In this paper we study the convergence of stochastic gradient methods for non-convex objectives.",
+        "We show that under a weak smoothness assumption the iterates reach an approximate stationary point",
+        "at a rate matching the best known bounds, and we validate the analysis on image classification",
+        "and language modelling benchmarks where the method is competitive with adaptive optimizers."
+    ] * 4),
+]
+
+
+def _int8_file_for_cpu() -> str:
+    """Pick the quantized graph built for this CPU's instruction set"""
+    machine = platform.machine().lower()
+    if machine in ("arm64", "aarch64"):
+        return "onnx/model_qint8_arm64.onnx"
+    flags = ""
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    flags = line
+                    break
+    except OSError:
+        pass
+    if "avx512_vnni" in flags:
+        return "onnx/model_qint8_avx512_vnni.onnx"
+    if "avx512" in flags:
+        return "onnx/model_qint8_avx512.onnx"
+    return "onnx/model_quint8_avx2.onnx"
+
+
+def _check_onnx_support():
+    """Raise if this install can't run the ONNX backends at all"""
+    import sentence_transformers
+
+    major, minor = (int(part) for part in sentence_transformers.__version__.split(".")[:2])
+    missing = [name for name in ("optimum", "onnxruntime") if importlib.util.find_spec(name) is None]
+    if (major, minor) < (3, 2) or missing:
+        raise RuntimeError(
+            f"ENCODER_BACKEND=onnx needs sentence-transformers>=3.2 and optimum[onnxruntime] "
+            f"(found sentence-transformers {sentence_transformers.__version__}"
+            f"{', missing ' + ', '.join(missing) if missing else ''})"
+        )
+
+
+def load_model(model_name: str, backend: str = ENCODER_BACKEND, fallback: bool = True):
+    """Load model_name on the given backend, falling back to torch if it can't be loaded"""
+    # Imported here so importing this module doesn't pull in torch
+    from sentence_transformers import SentenceTransformer
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown encoder backend: {backend}. Choose from: {', '.join(BACKENDS)}")
+    if backend != "torch":
+        # A missing dependency would otherwise fall back to torch on every start
+        _check_onnx_support()
+
+    try:
+        if backend == "onnx":
+            model = SentenceTransformer(model_name, backend="onnx")
+        elif backend == "onnx-int8":
+            model = SentenceTransformer(
+                model_name,
+                backend="onnx",
+                model_kwargs={"file_name": ENCODER_ONNX_FILE or _int8_file_for_cpu()}
+            )
+        else:
+            model = SentenceTransformer(model_name)
+    except Exception as e:
+        if backend == "torch" or not fallback:
+            raise
+        print(f"⚠️ Could not load {model_name} with the {backend} backend ({e}); using torch")
+        backend = "torch"
+        model = SentenceTransformer(model_name)
+
+    model.encoder_backend = backend
+    return model
+
+
+def cache_model_name(model_name: str, model) -> str:
+    """Embedding cache namespace: quantized vectors must not be served as fp32 ones"""
+    backend = getattr(model, "encoder_backend", "torch")
+    # fp32 ONNX matches torch to within float rounding, so they share entries
+    return model_name if backend in ("torch", "onnx") else f"{model_name}@{backend}"
+
+
+def _throughput(model, texts: List[str], repeats: int) -> float:
+    model.encode(texts[:2])  # warm up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model.encode(texts, batch_size=32)
+    return len(texts) * repeats / (time.perf_counter() - start)
+
+
+def parity_report(model_name: str, backend: str, corpus: Optional[List[str]] = None,
+                  repeats: int = 5, baseline=None) -> Dict:
+    """Compare a backend's embeddings and speed with fp32 torch on a fixed corpus"""
+    corpus = corpus or PARITY_CORPUS
+    baseline = baseline or load_model(model_name, "torch")
+    candidate = load_model(model_name, backend, fallback=False)
+
+    expected = normalize_rows(np.asarray(baseline.encode(corpus), dtype=np.float32))
+    actual = normalize_rows(np.asarray(candidate.encode(corpus), dtype=np.float32))
+    cosines = np.sum(expected * actual, axis=1)
+
+    # Ranking agreement: does each text's nearest neighbour survive?
+    expected_nn = np.argsort(-(expected @ expected.T), axis=1)[:, 1]
+    actual_nn = np.argsort(-(actual @ actual.T), axis=1)[:, 1]
+
+    baseline_rate = _throughput(baseline, corpus, repeats)
+    candidate_rate = _throughput(candidate, corpus, repeats)
+
+    return {
+        "backend": backend,
+        "texts": len(corpus),
+        "mean_cosine": float(cosines.mean()),
+        "min_cosine": float(cosines.min()),
+        "max_drift": float(1 - cosines.min()),
+        "nearest_neighbour_agreement": float(np.mean(expected_nn == actual_nn)),
+        "baseline_texts_per_sec": baseline_rate,
+        "backend_texts_per_sec": candidate_rate,
+        "speedup": candidate_rate / baseline_rate
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check encoder backends against the fp32 torch baseline")
+    parser.add_argument("backends", nargs="*", default=["onnx", "onnx-int8"], choices=BACKENDS)
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    baseline = load_model(args.model, "torch")
+    for backend in args.backends:
+        report = parity_report(args.model, backend, repeats=args.repeats, baseline=baseline)
+        print(
+            f"{backend:10s} mean cos {report['mean_cosine']:.5f}  min cos {report['min_cosine']:.5f}  "
+            f"NN agreement {report['nearest_neighbour_agreement']:.0%}  "
+            f"{report['backend_texts_per_sec']:.0f} texts/s ({report['speedup']:.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""
+In-process exact search for small collections.
+
+demo_documents and arxiv_queries hold a few hundred vectors, yet every
+search walks an HNSW graph and reads Chroma's sqlite. HNSW is approximate,
+and the same query can rank differently after the index is rebuilt. For such
+collections ExactIndex keeps every vector in memory as one contiguous,
+row-normalized float32 matrix. A search is one matrix product, and the same
+vectors always give the same ranking.
+
+ExactCollection wraps a Chroma collection and mirrors its add, upsert,
+update and delete into the index, so every writer in the process keeps it in
+sync (the engine, bulk ingest, chunking, app.py's arXiv queries). The matrix
+belongs to its process and is never written to disk; sync() builds it from
+Chroma on first use. Before serving a search, ensure_current() compares it
+with the collection's count and rebuilds it if they differ. An index is only
+kept while its collection has at most EXACT_SEARCH_MAX_VECTORS vectors. Past
+that it is dropped and searches go back to HNSW until the next clear or
+restart. EXACT_SEARCH_MAX_VECTORS=0 turns it off. The engine also turns it
+off when Chroma is a shared server (CHROMA_HOST), because several workers
+would each hold a copy that misses the others' writes.
+
+Because it is exact, it is also the ground truth for HNSW recall on real
+data:
+
+    python exact_index.py --collection demo_documents --persist-dir ./chroma_db --k 10
+"""
+
+import argparse
+import os
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from chunking import search_many_with_chunks
+from embedding_engine import normalize_rows
+
+EXACT_SEARCH_MAX_VECTORS = int(os.environ.get('EXACT_SEARCH_MAX_VECTORS', '2000'))
+SYNC_PAGE_SIZE = 1000
+
+
+class ExactIndex:
+    """One collection's vectors as a row-normalized matrix held by this process"""
+
+    def __init__(self, name: str, max_vectors: int = EXACT_SEARCH_MAX_VECTORS, parent_key: Optional[str] = None):
+        self.name = name
+        self.max_vectors = max_vectors
+        # Metadata field naming each row's document (chunks); rows are their own documents otherwise
+        self.parent_key = parent_key
+        self.active = max_vectors > 0
+        self._ids: List[str] = []
+        self._parents: List[str] = []
+        self._matrix = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _set(self, ids: List[str], parents: List[str], matrix: Optional[np.ndarray]):
+        # Readers hold on to the old lists and matrix; they are replaced, never mutated
+        self._ids, self._parents = ids, parents
+        self._matrix = np.ascontiguousarray(matrix, dtype=np.float32) if ids else None
+
+    def _deactivate_locked(self):
+        self.active = False
+        self._set([], [], None)
+
+    def deactivate(self):
+        """Stop tracking the collection; searches fall back to Chroma"""
+        with self._lock:
+            self._deactivate_locked()
+
+    def sync(self, collection, page_size: int = SYNC_PAGE_SIZE) -> "ExactIndex":
+        """Rebuild the matrix from collection, or drop it if the collection is too large"""
+        if not self.active:
+            return self
+        with self._lock:
+            if collection.count() > self.max_vectors:
+                self._deactivate_locked()
+                return self
+            ids, parents, vectors = [], [], []
+            offset = 0
+            while True:
+                page = collection.get(include=["embeddings", "metadatas"], limit=page_size, offset=offset)
+                for i, row_id in enumerate(page['ids']):
+                    metadata = page['metadatas'][i] or {}
+                    ids.append(row_id)
+                    parents.append(metadata.get(self.parent_key, row_id) if self.parent_key else row_id)
+                if page['ids']:
+                    vectors.append(np.asarray(page['embeddings'], dtype=np.float32))
+                if len(page['ids']) < page_size:
+                    break
+                offset += page_size
+            self._set(ids, parents, normalize_rows(np.vstack(vectors)) if ids else None)
+        return self
+
+    def ensure_current(self, collection) -> bool:
+        """Rebuild if the collection's count no longer matches; True while the index can serve"""
+        if self.active and collection.count() != len(self._ids):
+            self.sync(collection)
+        return self.active
+
+    def put(self, ids: List[str], vectors, parents: Optional[List[Optional[str]]] = None):
+        """Add or replace rows; a parent of None keeps a replaced row's parent"""
+        if not self.active or not len(ids):
+            return
+        vectors = normalize_rows(np.asarray(vectors, dtype=np.float32))
+        parents = parents or [None] * len(ids)
+        with self._lock:
+            if self._matrix is not None and self._matrix.shape[1] != vectors.shape[1]:
+                raise ValueError(f"Vectors have {vectors.shape[1]} dimensions, the index {self._matrix.shape[1]}")
+            position = {row_id: i for i, row_id in enumerate(self._ids)}
+            row_ids, row_parents = list(self._ids), list(self._parents)
+            matrix = self._matrix.copy() if self._matrix is not None else vectors[:0]
+            new_rows = []
+            for row_id, vector, parent in zip(ids, vectors, parents):
+                if row_id in position:
+                    matrix[position[row_id]] = vector
+                    if parent is not None:
+                        row_parents[position[row_id]] = parent
+                else:
+                    position[row_id] = len(row_ids)
+                    row_ids.append(row_id)
+                    row_parents.append(parent or row_id)
+                    new_rows.append(vector)
+            if len(row_ids) > self.max_vectors:
+                self._deactivate_locked()
+                return
+            if new_rows:
+                matrix = np.vstack([matrix, np.asarray(new_rows)])
+            self._set(row_ids, row_parents, matrix)
+
+    def remove(self, ids: List[str]):
+        if not self.active or not ids:
+            return
+        doomed = set(ids)
+        with self._lock:
+            keep = [i for i, row_id in enumerate(self._ids) if row_id not in doomed]
+            if len(keep) == len(self._ids):
+                return
+            self._set(
+                [self._ids[i] for i in keep],
+                [self._parents[i] for i in keep],
+                self._matrix[keep] if keep else None
+            )
+
+    def clear(self):
+        """Empty the index and track the collection again"""
+        with self._lock:
+            self.active = self.max_vectors > 0
+            self._set([], [], None)
+
+    def snapshot(self) -> Tuple[List[str], List[str], Optional[np.ndarray]]:
+        """(ids, parents, matrix) as of now; later writes replace rather than mutate them"""
+        with self._lock:
+            return self._ids, self._parents, self._matrix
+
+
+def brute_force_many(doc_index: ExactIndex, chunk_index: Optional[ExactIndex], query_embeddings,
+                     n_results: List[int], candidates: Optional[Set[str]] = None) -> List[List[Tuple[str, float]]]:
+    """Exact (doc_id, similarity) rankings, a document scoring the better of its vector and best chunk"""
+    doc_ids, _, doc_matrix = doc_index.snapshot()
+    if doc_matrix is None:
+        return [[] for _ in n_results]
+    queries = normalize_rows(np.asarray(query_embeddings, dtype=np.float32))
+    scores = queries @ doc_matrix.T
+
+    if chunk_index is not None:
+        _, parents, chunk_matrix = chunk_index.snapshot()
+        if chunk_matrix is not None:
+            position = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+            # Chunks can outlive a deleted parent; those rows are skipped
+            rows = [i for i, parent in enumerate(parents) if parent in position]
+            if rows:
+                chunk_scores = queries @ chunk_matrix[rows].T
+                owners = np.array([position[parents[i]] for i in rows])
+                best = np.full_like(scores, -np.inf)
+                for q in range(len(queries)):
+                    np.maximum.at(best[q], owners, chunk_scores[q])
+                scores = np.maximum(scores, best)
+
+    if candidates is not None:
+        excluded = np.array([doc_id not in candidates for doc_id in doc_ids])
+        scores[:, excluded] = -np.inf
+    rankings = []
+    for q, count in enumerate(n_results):
+        top = np.argsort(-scores[q], kind="stable")[:count]
+        rankings.append([(doc_ids[i], float(scores[q, i])) for i in top if np.isfinite(scores[q, i])])
+    return rankings
+
+
+def exact_index_of(collection) -> Optional[ExactIndex]:
+    """The active ExactIndex behind a (possibly wrapped) collection, if it has one"""
+    index = getattr(collection, "exact_index", None) if collection is not None else None
+    return index if index is not None and index.active else None
+
+
+def search_in_process(collection, chunk_collection, query_embeddings, n_results: List[int],
+                      candidates: Optional[Set[str]] = None) -> Optional[Dict]:
+    """Exact search shaped like search_many_with_chunks, or None when a collection isn't indexed"""
+    doc_index = exact_index_of(collection)
+    if doc_index is None or not doc_index.ensure_current(collection):
+        return None
+    chunk_index = None
+    if chunk_collection is not None:
+        chunk_index = exact_index_of(chunk_collection)
+        if chunk_index is None or not chunk_index.ensure_current(chunk_collection):
+            return None
+
+    rankings = brute_force_many(doc_index, chunk_index, query_embeddings, n_results, candidates)
+    wanted = sorted({doc_id for ranked in rankings for doc_id, _ in ranked})
+    found = {}
+    if wanted:
+        fetched = collection.get(ids=wanted, include=["documents", "metadatas"])
+        for i, doc_id in enumerate(fetched['ids']):
+            found[doc_id] = (fetched['documents'][i], fetched['metadatas'][i])
+    rankings = [[(doc_id, score) for doc_id, score in ranked if doc_id in found] for ranked in rankings]
+    return {
+        "ids": [[doc_id for doc_id, _ in ranked] for ranked in rankings],
+        "distances": [[1 - score for _, score in ranked] for ranked in rankings],
+        "documents": [[found[doc_id][0] for doc_id, _ in ranked] for ranked in rankings],
+        "metadatas": [[found[doc_id][1] for doc_id, _ in ranked] for ranked in rankings]
+    }
+
+
+class ExactCollection:
+    """Chroma collection proxy mirroring writes into an ExactIndex"""
+
+    def __init__(self, collection, index: ExactIndex):
+        self._collection = collection
+        self.exact_index = index
+
+    def __getattr__(self, attr):
+        return getattr(self._collection, attr)
+
+    def _mirror(self, ids, embeddings, metadatas):
+        if not self.exact_index.active:
+            return
+        if embeddings is None:
+            # Chroma embeds these itself; the index can't follow
+            self.exact_index.deactivate()
+            return
+        parents = None
+        parent_key = self.exact_index.parent_key
+        if parent_key and metadatas is not None:
+            parents = [(metadata or {}).get(parent_key) for metadata in metadatas]
+        self.exact_index.put(list(ids), embeddings, parents)
+
+    def add(self, ids, embeddings=None, metadatas=None, documents=None, **kwargs):
+        result = self._collection.add(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents, **kwargs)
+        self._mirror(ids, embeddings, metadatas)
+        return result
+
+    def upsert(self, ids, embeddings=None, metadatas=None, documents=None, **kwargs):
+        result = self._collection.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents, **kwargs)
+        self._mirror(ids, embeddings, metadatas)
+        return result
+
+    def update(self, ids, embeddings=None, metadatas=None, documents=None, **kwargs):
+        result = self._collection.update(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents, **kwargs)
+        # Metadata-only updates (arXiv query cursors) leave the vectors alone
+        if embeddings is not None:
+            self._mirror(ids, embeddings, metadatas)
+        return result
+
+    def delete(self, ids=None, where=None, where_document=None, **kwargs):
+        if self.exact_index.active and ids is None:
+            # Resolve the filter first; the index is keyed by id
+            ids = self._collection.get(where=where, where_document=where_document, include=[])['ids']
+            where = where_document = None
+            if not ids:
+                return None
+        result = self._collection.delete(ids=ids, where=where, where_document=where_document, **kwargs)
+        self.exact_index.remove(list(ids or []))
+        return result
+
+
+def exact_collection(collection, index: ExactIndex):
+    """collection behind an ExactCollection, or as it is when exact search is off"""
+    return ExactCollection(collection, index) if index.max_vectors > 0 else collection
+
+
+def recall_at_k(collection, chunk_collection, index: ExactIndex, chunk_index: Optional[ExactIndex],
+                query_embeddings, k: int) -> float:
+    """Share of the exact top-k that Chroma's HNSW search returns"""
+    n_results = [k] * len(query_embeddings)
+    truth = brute_force_many(index, chunk_index, query_embeddings, n_results)
+    approximate = search_many_with_chunks(collection, chunk_collection, query_embeddings, n_results)
+    hits = sum(
+        len({doc_id for doc_id, _ in expected} & set(returned))
+        for expected, returned in zip(truth, approximate['ids'])
+    )
+    return hits / max(1, sum(len(expected) for expected in truth))
+
+
+def main():
+    import chromadb
+    from chromadb.config import Settings
+
+    parser = argparse.ArgumentParser(description="Measure a stored collection's HNSW recall@k against exact search")
+    parser.add_argument("--collection", required=True)
+    parser.add_argument("--persist-dir", default="./chroma_db")
+    parser.add_argument("--queries", type=int, default=200, help="Stored vectors reused as queries")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    client = chromadb.PersistentClient(path=args.persist_dir, settings=Settings(anonymized_telemetry=False))
+    collection = client.get_collection(args.collection)
+    try:
+        chunk_collection = client.get_collection(f"{args.collection}_chunks")
+    except Exception:
+        chunk_collection = None
+
+    # Sized to hold the whole collection whatever the threshold
+    limit = collection.count() + (chunk_collection.count() if chunk_collection is not None else 0)
+    index = ExactIndex(args.collection, max_vectors=max(1, limit)).sync(collection)
+    chunk_index = None
+    if chunk_collection is not None and chunk_collection.count():
+        chunk_index = ExactIndex(chunk_collection.name, max_vectors=max(1, limit), parent_key="parent_id").sync(
+            chunk_collection
+        )
+    else:
+        chunk_collection = None
+
+    _, _, matrix = index.snapshot()
+    if matrix is None:
+        parser.error("Collection is empty")
+    rng = np.random.default_rng(args.seed)
+    rows = rng.choice(len(matrix), size=min(args.queries, len(matrix)), replace=False)
+    queries = matrix[np.sort(rows)].tolist()
+    k = min(args.k, len(matrix))
+    recall = recall_at_k(collection, chunk_collection, index, chunk_index, queries, k)
+    print(f"{args.collection}: {len(matrix)} documents, {len(queries)} queries, HNSW recall@{k} {recall:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""
+Metadata-filtered vector search with index pre-filtering.
+
+Passing a where clause to an HNSW query filters while the graph is walked,
+so a filter matching a few hundred papers out of a million leaves most of the
+requested neighbours unmatched and recall drops. When the filter can be
+answered from the MetadataIndex (equality, $in and ranges on the indexed and
+recorded fields, joined with $and) and the matching documents plus their
+chunks come to at most PREFILTER_MAX_VECTORS vectors, those vectors are
+fetched and scored exactly instead. Broad filters still go to HNSW. Range
+filters on string fields such as added_date and published, which Chroma
+can't evaluate, run against HNSW without them and are applied to an
+over-fetched result.
+
+When the collections keep compact vector copies (VECTOR_STORE, see
+compact_store), the exact strategy scores the candidates against those first
+and fetches full vectors and documents from Chroma only for the best
+RESCORE_OVERSAMPLE x n_results, which are rescored exactly.
+
+Collections small enough for an ExactIndex (see exact_index) skip both when
+Chroma has no filter left to apply, and are scored over the in-process
+matrix.
+
+plan_search picks the strategy; filtered_search_many runs it and returns
+Chroma query-shaped results like search_many_with_chunks.
+"""
+
+import os
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from chunking import search_many_with_chunks
+from compact_store import RESCORE_OVERSAMPLE, vector_store_of
+from embedding_engine import normalize_rows
+from exact_index import search_in_process
+
+PREFILTER_MAX_VECTORS = int(os.environ.get('PREFILTER_MAX_VECTORS', '20000'))
+# Over-fetch factor when a range filter has to be applied after HNSW
+POSTFILTER_OVERSAMPLE = 10
+
+_RANGE_OPERATORS = {"$gt": "gt", "$gte": "gte", "$lt": "lt", "$lte": "lte"}
+
+
+def _clauses(where: Optional[Dict]) -> List[Tuple[str, object]]:
+    """Flatten a where filter into (field, condition) pairs if it is a plain conjunction"""
+    if not where:
+        return []
+    if not isinstance(where, dict):
+        raise ValueError("where must be an object")
+    clauses = []
+    for key, condition in where.items():
+        if key == "$and":
+            if not isinstance(condition, list):
+                raise ValueError("$and takes a list of filters")
+            for part in condition:
+                clauses.extend(_clauses(part))
+        else:
+            # Includes $or, which is passed to Chroma whole
+            clauses.append((key, condition))
+    return clauses
+
+
+def _combine(clauses: List[Tuple[str, object]]) -> Optional[Dict]:
+    parts = [{field: condition} for field, condition in clauses]
+    if not parts:
+        return None
+    return parts[0] if len(parts) == 1 else {"$and": parts}
+
+
+class SearchPlan:
+    """How a filtered search runs: exact over index candidates, HNSW, or HNSW plus a post-filter"""
+
+    def __init__(self, strategy: str, chroma_where: Optional[Dict] = None,
+                 where_document: Optional[Dict] = None, candidates: Optional[Set[str]] = None):
+        self.strategy = strategy
+        self.chroma_where = chroma_where
+        self.where_document = where_document
+        self.candidates = candidates
+
+    def describe(self) -> Dict:
+        description = {"strategy": self.strategy}
+        if self.candidates is not None:
+            description["candidates"] = len(self.candidates)
+        return description
+
+
+def _vector_count(index, candidates: Set[str]) -> int:
+    """Document plus chunk vectors an exact search over candidates would score"""
+    return sum(1 + (index.get(doc_id).get("chunk_count") or 0) for doc_id in candidates)
+
+
+def plan_search(where: Optional[Dict], where_document: Optional[Dict], index=None,
+                max_vectors: int = PREFILTER_MAX_VECTORS) -> SearchPlan:
+    """Split where into what the metadata index answers and what Chroma must, and pick a strategy"""
+    if where_document is not None and not isinstance(where_document, dict):
+        raise ValueError("where_document must be an object")
+    clauses = _clauses(where)
+    if not clauses:
+        return SearchPlan("hnsw", None, where_document)
+
+    recorded = () if index is None else index.fields + index.stored_fields
+    indexed_clauses = []
+    chroma_clauses = []
+    postfilter_only = []
+    for field, condition in clauses:
+        range_bounds = isinstance(condition, dict) and bool(condition) and set(condition) <= set(_RANGE_OPERATORS)
+        if field in recorded and range_bounds:
+            indexed_clauses.append((field, condition))
+            # Chroma compares numbers only; string bounds can't go to HNSW
+            if any(isinstance(value, str) for value in condition.values()):
+                postfilter_only.append((field, condition))
+            else:
+                chroma_clauses.append((field, condition))
+        elif index is not None and field in index.fields and (
+            not isinstance(condition, dict) or set(condition) <= {"$eq", "$in"}
+        ):
+            indexed_clauses.append((field, condition))
+            chroma_clauses.append((field, condition))
+        else:
+            if range_bounds and any(isinstance(value, str) for value in condition.values()):
+                raise ValueError(f"Range filter on {field} needs a number (or an indexed date field)")
+            chroma_clauses.append((field, condition))
+
+    if not indexed_clauses:
+        return SearchPlan("hnsw", _combine(chroma_clauses), where_document)
+
+    candidates = _index_candidates(index, indexed_clauses)
+    # Clauses the index already applied don't need re-checking on the candidate set
+    residual = [clause for clause in chroma_clauses if clause not in indexed_clauses]
+    if len(candidates) <= max_vectors and _vector_count(index, candidates) <= max_vectors:
+        return SearchPlan("exact", _combine(residual), where_document, candidates)
+    if postfilter_only:
+        return SearchPlan("hnsw_postfilter", _combine(chroma_clauses), where_document, candidates)
+    return SearchPlan("hnsw", _combine(chroma_clauses), where_document)
+
+
+def _index_candidates(index, clauses: List[Tuple[str, object]]) -> Set[str]:
+    candidates = None
+    ranges = []
+    for field, condition in clauses:
+        if isinstance(condition, dict) and set(condition) <= set(_RANGE_OPERATORS):
+            ranges.append((field, condition))
+            continue
+        if isinstance(condition, dict) and "$in" in condition:
+            ids = index.lookup_any(field, condition["$in"])
+        else:
+            value = condition["$eq"] if isinstance(condition, dict) else condition
+            ids = index.lookup(**{field: value})
+        candidates = ids if candidates is None else candidates & ids
+    # Ranges scan, so run them over the equality matches when there are any
+    for field, condition in ranges:
+        bounds = {_RANGE_OPERATORS[op]: value for op, value in condition.items()}
+        candidates = index.lookup_range(field, within=candidates, **bounds)
+    return candidates
+
+
+def _best_scores(queries: np.ndarray, doc_vectors: np.ndarray, chunk_vectors: Optional[np.ndarray],
+                 parents: Optional[np.ndarray]) -> np.ndarray:
+    """Each document's score: the better of its own vector and its best chunk"""
+    scores = queries @ normalize_rows(doc_vectors).T
+    if chunk_vectors is not None and len(chunk_vectors):
+        chunk_scores = queries @ normalize_rows(chunk_vectors).T
+        best = np.full_like(scores, -np.inf)
+        for q in range(len(queries)):
+            np.maximum.at(best[q], parents, chunk_scores[q])
+        scores = np.maximum(scores, best)
+    return scores
+
+
+def compact_shortlist(collection, chunk_collection, queries: np.ndarray, n_results: List[int],
+                      candidates: Set[str], where: Optional[Dict] = None,
+                      where_document: Optional[Dict] = None,
+                      oversample: int = RESCORE_OVERSAMPLE) -> Optional[Set[str]]:
+    """Candidates worth rescoring, ranked on the compact vector copies.
+
+    None when there are no copies or some candidate lacks one, in which case
+    every candidate is scored exactly.
+    """
+    vectors = vector_store_of(collection)
+    if vectors is None:
+        return None
+    doc_ids = sorted(candidates)
+    if where or where_document:
+        doc_ids = collection.get(ids=doc_ids, where=where, where_document=where_document, include=[])['ids']
+    found, doc_vectors = vectors.get_many(doc_ids)
+    if len(found) < len(doc_ids):
+        return None
+    if not found:
+        return set()
+
+    chunk_vectors = parents = None
+    if chunk_collection is not None and chunk_collection.count():
+        chunk_store = vector_store_of(chunk_collection)
+        if chunk_store is None:
+            return None
+        chunks = chunk_collection.get(where={"parent_id": {"$in": found}}, include=["metadatas"])
+        chunk_found, chunk_vectors = chunk_store.get_many(chunks['ids'])
+        if len(chunk_found) < len(chunks['ids']):
+            return None
+        if chunk_found:
+            position = {doc_id: i for i, doc_id in enumerate(found)}
+            parent_of = {chunk_id: metadata['parent_id'] for chunk_id, metadata in zip(chunks['ids'], chunks['metadatas'])}
+            parents = np.array([position[parent_of[chunk_id]] for chunk_id in chunk_found])
+        else:
+            chunk_vectors = None
+
+    scores = _best_scores(queries, doc_vectors, chunk_vectors, parents)
+    shortlist = set()
+    for q, count in enumerate(n_results):
+        top = np.argsort(-scores[q], kind="stable")[:count * oversample]
+        shortlist.update(found[i] for i in top)
+    return shortlist
+
+
+def exact_search_many(collection, chunk_collection, query_embeddings, n_results: List[int],
+                      candidates: Set[str], where: Optional[Dict] = None,
+                      where_document: Optional[Dict] = None) -> Dict:
+    """Brute-force cosine search over candidate documents and their chunks.
+
+    Each document scores the better of its own vector and its best chunk,
+    the same rule search_many_with_chunks uses. With compact vector copies
+    only the compact_shortlist is fetched and scored at full precision.
+    """
+    empty = {"ids": [[] for _ in n_results], "distances": [[] for _ in n_results],
+             "documents": [[] for _ in n_results], "metadatas": [[] for _ in n_results]}
+    if not candidates:
+        return empty
+
+    queries = normalize_rows(np.asarray(query_embeddings, dtype=np.float32))
+    shortlist = compact_shortlist(collection, chunk_collection, queries, n_results, candidates, where, where_document)
+    if shortlist is not None:
+        # The shortlist already passed the filters
+        candidates, where, where_document = shortlist, None, None
+        if not candidates:
+            return empty
+
+    fetched = collection.get(
+        ids=sorted(candidates),
+        where=where,
+        where_document=where_document,
+        include=["embeddings", "documents", "metadatas"]
+    )
+    if not fetched['ids']:
+        return empty
+
+    doc_ids = fetched['ids']
+    chunk_vectors = parents = None
+    if chunk_collection is not None and chunk_collection.count():
+        chunks = chunk_collection.get(
+            where={"parent_id": {"$in": doc_ids}},
+            include=["embeddings", "metadatas"]
+        )
+        if chunks['ids']:
+            position = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+            parents = np.array([position[metadata['parent_id']] for metadata in chunks['metadatas']])
+            chunk_vectors = np.asarray(chunks['embeddings'], dtype=np.float32)
+    scores = _best_scores(queries, np.asarray(fetched['embeddings'], dtype=np.float32), chunk_vectors, parents)
+
+    results = {"ids": [], "distances": [], "documents": [], "metadatas": []}
+    for q, count in enumerate(n_results):
+        top = np.argsort(-scores[q], kind="stable")[:count]
+        results["ids"].append([doc_ids[i] for i in top])
+        results["distances"].append([1 - float(scores[q, i]) for i in top])
+        results["documents"].append([fetched['documents'][i] for i in top])
+        results["metadatas"].append([fetched['metadatas'][i] for i in top])
+    return results
+
+
+def filtered_search_many(collection, chunk_collection, query_embeddings, n_results, plan: SearchPlan) -> Dict:
+    """Run a SearchPlan for several queries; results are shaped like search_many_with_chunks"""
+    if isinstance(n_results, int):
+        n_results = [n_results] * len(query_embeddings)
+
+    # Small collections are scored in process whenever Chroma has no filter left to apply
+    if plan.strategy in ("hnsw", "exact") and plan.chroma_where is None and plan.where_document is None:
+        results = search_in_process(collection, chunk_collection, query_embeddings, n_results, plan.candidates)
+        if results is not None:
+            return results
+
+    if plan.strategy == "exact":
+        return exact_search_many(
+            collection, chunk_collection, query_embeddings, n_results,
+            plan.candidates, plan.chroma_where, plan.where_document
+        )
+
+    if plan.strategy == "hnsw_postfilter":
+        total = collection.count()
+        fetched = search_many_with_chunks(
+            collection, chunk_collection, query_embeddings,
+            [min(total, count * POSTFILTER_OVERSAMPLE) for count in n_results],
+            where=plan.chroma_where, where_document=plan.where_document
+        )
+        results = {key: [] for key in fetched}
+        for q, count in enumerate(n_results):
+            keep = [i for i, doc_id in enumerate(fetched['ids'][q]) if doc_id in plan.candidates][:count]
+            for key in fetched:
+                results[key].append([fetched[key][q][i] for i in keep])
+        return results
+
+    return search_many_with_chunks(
+        collection, chunk_collection, query_embeddings, n_results,
+        where=plan.chroma_where, where_document=plan.where_document
+    )
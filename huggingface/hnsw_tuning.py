@@ -0,0 +1,233 @@
+"""
+HNSW index parameters and a recall/latency benchmark for choosing them.
+
+Every collection used to be created with only {"hnsw:space": "cosine"}, so M,
+construction_ef and search_ef were Chroma's defaults (16, 100, 10) whatever
+the collection's size. collection_metadata() builds a collection's metadata
+from HNSW_M, HNSW_CONSTRUCTION_EF, HNSW_SEARCH_EF and HNSW_NUM_THREADS, with
+per-collection overrides in HNSW_PARAMS, a JSON object keyed by collection
+name:
+
+    HNSW_PARAMS='{"api_documents_chunks": {"M": 32, "construction_ef": 200, "search_ef": 128}}'
+
+Chroma fixes M and construction_ef when a collection is created, so new
+values only apply to collections created afterwards (or after a clear).
+
+`python hnsw_tuning.py` builds throwaway collections over a synthetic
+clustered corpus (or vectors sampled from a stored collection) for every
+combination in a parameter grid, and reports recall@k against exact
+brute-force search, build time and p50/p99 query latency:
+
+    python hnsw_tuning.py --size 100000 --M 16 32 --construction-ef 100 200 --search-ef 10 50 100
+    python hnsw_tuning.py --from-collection api_documents_chunks --persist-dir ./chroma_db --json results.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from embedding_engine import normalize_rows
+
+HNSW_KEYS = ("M", "construction_ef", "search_ef", "num_threads")
+
+
+def _env_params() -> Dict[str, int]:
+    params = {}
+    for key in HNSW_KEYS:
+        value = os.environ.get(f"HNSW_{key.upper()}")
+        if value:
+            params[key] = int(value)
+    return params
+
+
+HNSW_DEFAULTS = _env_params()
+HNSW_OVERRIDES = json.loads(os.environ.get('HNSW_PARAMS', '') or '{}')
+
+
+def hnsw_params(collection_name: str, overrides: Optional[Dict] = None) -> Dict[str, int]:
+    """Configured parameters for a collection: env defaults, HNSW_PARAMS, then overrides"""
+    params = dict(HNSW_DEFAULTS)
+    params.update(HNSW_OVERRIDES.get(collection_name, {}))
+    params.update(overrides or {})
+    unknown = set(params) - set(HNSW_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown HNSW parameters: {', '.join(sorted(unknown))}")
+    return {key: int(value) for key, value in params.items()}
+
+
+def collection_metadata(collection_name: str, overrides: Optional[Dict] = None) -> Dict:
+    """Chroma collection metadata with cosine space and the configured HNSW parameters"""
+    metadata = {"hnsw:space": "cosine"}
+    for key, value in hnsw_params(collection_name, overrides).items():
+        metadata[f"hnsw:{key}"] = value
+    return metadata
+
+
+def synthetic_corpus(size: int, dim: int = 384, clusters: int = 100, spread: float = 0.35,
+                     seed: int = 0) -> np.ndarray:
+    """Unit vectors drawn around random centres, closer to real embeddings than uniform noise"""
+    rng = np.random.default_rng(seed)
+    centres = normalize_rows(rng.standard_normal((clusters, dim)).astype(np.float32))
+    assignment = rng.integers(0, clusters, size)
+    noise = rng.standard_normal((size, dim)).astype(np.float32) * (spread / np.sqrt(dim))
+    return normalize_rows(centres[assignment] + noise)
+
+
+def sample_collection(collection, size: int, page_size: int = 5000) -> np.ndarray:
+    """Up to size stored embeddings from a collection"""
+    vectors = []
+    offset = 0
+    while offset < size:
+        page = collection.get(include=["embeddings"], limit=min(page_size, size - offset), offset=offset)
+        if not page['ids']:
+            break
+        vectors.append(np.asarray(page['embeddings'], dtype=np.float32))
+        offset += len(page['ids'])
+    if not vectors:
+        raise ValueError("Collection has no embeddings to sample")
+    return normalize_rows(np.vstack(vectors))
+
+
+def exact_neighbours(corpus: np.ndarray, queries: np.ndarray, k: int, block: int = 1024) -> np.ndarray:
+    """Ground-truth top-k indexes by cosine similarity, in query blocks to bound memory"""
+    neighbours = []
+    for start in range(0, len(queries), block):
+        scores = queries[start:start + block] @ corpus.T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+        neighbours.append(np.take_along_axis(top, order, axis=1))
+    return np.vstack(neighbours)
+
+
+def _percentile_ms(samples: List[float], percentile: float) -> float:
+    return float(np.percentile(samples, percentile) * 1000)
+
+
+def benchmark_params(client, corpus: np.ndarray, queries: np.ndarray, truth: np.ndarray,
+                     k: int, params: Dict[str, int], batch_size: int = 5000) -> Dict:
+    """Build one collection with params, then time single-vector queries and measure recall@k"""
+    name = "hnsw_bench_" + "_".join(f"{key}{value}" for key, value in sorted(params.items()))
+    try:
+        client.delete_collection(name)
+    except Exception:
+        pass
+    collection = client.create_collection(name=name, metadata=collection_metadata(name, params))
+
+    ids = [str(i) for i in range(len(corpus))]
+    start = time.perf_counter()
+    for offset in range(0, len(corpus), batch_size):
+        collection.add(
+            ids=ids[offset:offset + batch_size],
+            embeddings=corpus[offset:offset + batch_size].tolist()
+        )
+    build_sec = time.perf_counter() - start
+
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        result = collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])
+        latencies.append(time.perf_counter() - start)
+        hits += len(set(int(i) for i in result['ids'][0]) & set(expected.tolist()))
+
+    client.delete_collection(name)
+    return {
+        **params,
+        "recall_at_k": hits / (len(queries) * k),
+        "build_sec": round(build_sec, 3),
+        "p50_ms": round(_percentile_ms(latencies, 50), 3),
+        "p99_ms": round(_percentile_ms(latencies, 99), 3),
+        "qps": round(len(latencies) / sum(latencies), 1)
+    }
+
+
+def run_grid(corpus: np.ndarray, queries: np.ndarray, k: int, grid: Dict[str, List[int]],
+             path: Optional[str] = None) -> List[Dict]:
+    """Benchmark every parameter combination in grid on a scratch Chroma directory"""
+    import chromadb
+    from chromadb.config import Settings
+
+    truth = exact_neighbours(corpus, queries, k)
+    scratch = path or tempfile.mkdtemp(prefix="hnsw_bench_")
+    client = chromadb.PersistentClient(
+        path=scratch,
+        settings=Settings(anonymized_telemetry=False, allow_reset=True, is_persistent=True)
+    )
+    results = []
+    try:
+        for m in grid["M"]:
+            for construction_ef in grid["construction_ef"]:
+                for search_ef in grid["search_ef"]:
+                    params = {"M": m, "construction_ef": construction_ef, "search_ef": search_ef}
+                    if grid.get("num_threads"):
+                        params["num_threads"] = grid["num_threads"]
+                    report = benchmark_params(client, corpus, queries, truth, k, params)
+                    print(
+                        f"M={m:<3d} construction_ef={construction_ef:<4d} search_ef={search_ef:<4d} "
+                        f"recall@{k} {report['recall_at_k']:.3f}  p50 {report['p50_ms']:.2f} ms  "
+                        f"p99 {report['p99_ms']:.2f} ms  build {report['build_sec']:.1f} s"
+                    )
+                    results.append(report)
+    finally:
+        if path is None:
+            shutil.rmtree(scratch, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure HNSW recall@k and query latency across a parameter grid")
+    parser.add_argument("--size", type=int, default=50000, help="Corpus vectors (synthetic, or sampled)")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--M", type=int, nargs="+", default=[16, 32])
+    parser.add_argument("--construction-ef", type=int, nargs="+", default=[100, 200])
+    parser.add_argument("--search-ef", type=int, nargs="+", default=[10, 50, 100, 200])
+    parser.add_argument("--num-threads", type=int, default=None)
+    parser.add_argument("--from-collection", help="Sample vectors from this stored collection instead")
+    parser.add_argument("--persist-dir", default="./chroma_db")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    if args.from_collection:
+        import chromadb
+        from chromadb.config import Settings
+
+        client = chromadb.PersistentClient(path=args.persist_dir, settings=Settings(anonymized_telemetry=False))
+        vectors = sample_collection(client.get_collection(args.from_collection), args.size + args.queries)
+        if len(vectors) <= args.queries:
+            parser.error("Collection is too small for the requested number of queries")
+        rng = np.random.default_rng(args.seed)
+        order = rng.permutation(len(vectors))
+        # Held-out stored vectors as queries, like searching with a new paper
+        queries, corpus = vectors[order[:args.queries]], vectors[order[args.queries:]]
+    else:
+        corpus = synthetic_corpus(args.size + args.queries, args.dim, seed=args.seed)
+        queries, corpus = corpus[:args.queries], corpus[args.queries:]
+
+    grid = {"M": args.M, "construction_ef": args.construction_ef, "search_ef": args.search_ef}
+    if args.num_threads:
+        grid["num_threads"] = args.num_threads
+    print(f"{len(corpus)} vectors, {len(queries)} queries, k={args.k}")
+    results = run_grid(corpus, queries, args.k, grid)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "corpus": len(corpus),
+                "queries": len(queries),
+                "k": args.k,
+                "source": args.from_collection or "synthetic",
+                "results": results
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
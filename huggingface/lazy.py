@@ -0,0 +1,154 @@
+"""
+Deferred, thread-safe initialisation of heavy resources.
+
+Loading the embedding model and opening Chroma at import time meant /health
+couldn't answer until both were done, so a restarted container sat unroutable
+for tens of seconds. Each resource is wrapped in a Lazy that builds it on
+first use (once, however many threads ask) and forwards attribute access to
+it, so module code keeps calling encoder.encode(...) or collection.count()
+unchanged. start_warm_up() builds everything in a background thread right
+after startup so the first real request doesn't pay for it, and
+WarmUp.status() reports progress for a readiness probe while liveness stays
+instant.
+"""
+
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+WARM_UP = os.environ.get('WARM_UP', '1').lower() in ('1', 'true', 'yes')
+
+_OWN_ATTRS = frozenset(("_factory", "_name", "_value", "_loaded", "_error", "_lock"))
+
+
+class Lazy:
+    """A value built by factory() on first use; attribute access is forwarded to it"""
+
+    def __init__(self, factory: Callable[[], object], name: str = ""):
+        self._factory = factory
+        self._name = name or getattr(factory, "__name__", "resource")
+        self._value = None
+        self._loaded = False
+        self._error: Optional[Exception] = None
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        """The built value, building it now if needed"""
+        if self._loaded:
+            return self._value
+        with self._lock:
+            if not self._loaded:
+                try:
+                    self._value = self._factory()
+                except Exception as e:
+                    # Not cached, so a later call retries
+                    self._error = e
+                    raise
+                self._error = None
+                self._loaded = True
+        return self._value
+
+    def swap(self, value):
+        """Replace the built value, e.g. after a collection is recreated"""
+        with self._lock:
+            self._value = value
+            self._error = None
+            self._loaded = True
+
+    # Deliberately unusual names: anything defined here shadows the wrapped
+    # object's attribute (a Chroma collection has its own get())
+    @property
+    def is_loaded(self) -> bool:
+        return self._loaded
+
+    @property
+    def load_error(self) -> Optional[Exception]:
+        return self._error
+
+    def __getattr__(self, attr):
+        # Only reached for names not set in __init__; guard our own so a
+        # half-constructed Lazy (e.g. during copy) can't recurse
+        if attr in _OWN_ATTRS:
+            raise AttributeError(attr)
+        return getattr(self.resolve(), attr)
+
+    def __len__(self):
+        return len(self.resolve())
+
+    def __contains__(self, item):
+        return item in self.resolve()
+
+    def __iter__(self):
+        return iter(self.resolve())
+
+    def __repr__(self):
+        state = "loaded" if self._loaded else "not loaded"
+        return f"<Lazy {self._name} ({state})>"
+
+
+class WarmUp:
+    """Builds resources in a background thread and tracks whether they are ready"""
+
+    def __init__(self, resources: Dict[str, Lazy], after: Optional[Callable[[], None]] = None):
+        self.resources = resources
+        self.after = after
+        self.enabled = False
+        self.started = time.time()
+        self.finished: Optional[float] = None
+        self.error: Optional[str] = None
+        self._done = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "WarmUp":
+        self.enabled = True
+        self._thread = threading.Thread(target=self._run, name="warm-up", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            for resource in self.resources.values():
+                resource.resolve()
+            if self.after is not None:
+                self.after()
+        except Exception as e:
+            self.error = str(e)
+            print(f"❌ Warm-up failed: {e}")
+        finally:
+            self.finished = time.time()
+            self._done.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    @property
+    def ready(self) -> bool:
+        # Without a warm-up, resources load on demand and requests are
+        # always routable
+        if not self.enabled:
+            return True
+        return all(resource.is_loaded for resource in self.resources.values())
+
+    def status(self) -> Dict:
+        """Readiness details: which resources are loaded and how long warm-up took"""
+        status = {
+            "ready": self.ready,
+            "loaded": {name: resource.is_loaded for name, resource in self.resources.items()},
+            "uptime_sec": round(time.time() - self.started, 3)
+        }
+        if self.finished is not None:
+            status["warm_up_sec"] = round(self.finished - self.started, 3)
+        errors = {name: str(resource.load_error) for name, resource in self.resources.items() if resource.load_error}
+        if errors:
+            status["errors"] = errors
+        elif self.error:
+            status["errors"] = {"warm_up": self.error}
+        return status
+
+
+def start_warm_up(resources: Dict[str, Lazy], after: Optional[Callable[[], None]] = None,
+                  enabled: bool = WARM_UP) -> WarmUp:
+    """Track readiness of resources, loading them in the background when enabled"""
+    warm_up = WarmUp(resources, after)
+    return warm_up.start() if enabled else warm_up
@@ -0,0 +1,298 @@
+"""
+Persistent BM25 index and reciprocal rank fusion.
+
+Dense search ranks by topic, so a submission that copies a passage with rare
+terms (names, symbols, unusual phrasing) could rank its source below papers
+that are merely on the same subject. This inverted index scores the same
+units the vector side stores (chunks for chunked documents, the whole text
+otherwise) with BM25, and a document scores as its best unit. Hybrid search
+fuses the lexical and dense rankings with reciprocal rank fusion, which needs
+no score calibration between the two.
+
+Postings, document frequencies and collection statistics live in sqlite (one
+namespace per collection) and are updated per add/delete, so startup doesn't
+re-tokenize the corpus.
+"""
+
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+LEXICAL_PATH = os.environ.get('LEXICAL_PATH', './lexical_index.db')
+SEARCH_MODE = os.environ.get('SEARCH_MODE', 'vector').lower()
+SEARCH_MODES = ("vector", "lexical", "hybrid")
+RRF_K = int(os.environ.get('RRF_K', '60'))
+HYBRID_LEXICAL_WEIGHT = float(os.environ.get('HYBRID_LEXICAL_WEIGHT', '1.0'))
+# Candidates pulled from each side per requested result before fusing
+HYBRID_OVERSAMPLE = 4
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Query terms are read rarest first until this many postings are loaded;
+# very common terms carry almost no BM25 weight and dominate the read cost
+MAX_POSTINGS = 200000
+MAX_QUERY_TERMS = 64
+SYNC_PAGE_SIZE = 1000
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+class BM25Index:
+    def __init__(self, path: str = LEXICAL_PATH, namespace: str = "documents",
+                 k1: float = BM25_K1, b: float = BM25_B):
+        self.namespace = namespace
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS units ("
+            " namespace TEXT NOT NULL,"
+            " unit_id TEXT NOT NULL,"
+            " doc_id TEXT NOT NULL,"
+            " length INTEGER NOT NULL,"
+            " PRIMARY KEY (namespace, unit_id))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS units_doc ON units (namespace, doc_id)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS postings ("
+            " namespace TEXT NOT NULL,"
+            " term TEXT NOT NULL,"
+            " unit_id TEXT NOT NULL,"
+            " tf INTEGER NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS postings_term ON postings (namespace, term)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS postings_unit ON postings (namespace, unit_id)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS terms ("
+            " namespace TEXT NOT NULL,"
+            " term TEXT NOT NULL,"
+            " df INTEGER NOT NULL,"
+            " PRIMARY KEY (namespace, term))"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS stats ("
+            " namespace TEXT PRIMARY KEY,"
+            " units INTEGER NOT NULL,"
+            " total_length INTEGER NOT NULL)"
+        )
+        self._db.execute("INSERT OR IGNORE INTO stats (namespace, units, total_length) VALUES (?, 0, 0)", (namespace,))
+        self._db.commit()
+
+    def add(self, doc_id: str, units: Sequence[str]):
+        """Index a document as one or more text units (its chunks, or its whole text)"""
+        self.add_many([doc_id], [units])
+
+    def add_many(self, doc_ids: List[str], units: List[Sequence[str]]):
+        with self._lock:
+            self._delete(doc_ids)
+            unit_rows = []
+            posting_rows = []
+            df = Counter()
+            total_length = 0
+            for doc_id, texts in zip(doc_ids, units):
+                for i, text in enumerate(texts):
+                    unit_id = f"{doc_id}:{i:05d}"
+                    counts = Counter(tokenize(text or ""))
+                    length = sum(counts.values())
+                    unit_rows.append((self.namespace, unit_id, doc_id, length))
+                    posting_rows.extend((self.namespace, term, unit_id, tf) for term, tf in counts.items())
+                    df.update(counts.keys())
+                    total_length += length
+
+            self._db.executemany("INSERT INTO units (namespace, unit_id, doc_id, length) VALUES (?, ?, ?, ?)", unit_rows)
+            self._db.executemany("INSERT INTO postings (namespace, term, unit_id, tf) VALUES (?, ?, ?, ?)", posting_rows)
+            self._db.executemany(
+                "INSERT INTO terms (namespace, term, df) VALUES (?, ?, ?)"
+                " ON CONFLICT (namespace, term) DO UPDATE SET df = df + excluded.df",
+                [(self.namespace, term, count) for term, count in df.items()]
+            )
+            self._db.execute(
+                "UPDATE stats SET units = units + ?, total_length = total_length + ? WHERE namespace = ?",
+                (len(unit_rows), total_length, self.namespace)
+            )
+            self._db.commit()
+
+    def _delete(self, doc_ids: List[str]):
+        for start in range(0, len(doc_ids), 500):
+            batch = list(doc_ids[start:start + 500])
+            placeholders = ",".join("?" * len(batch))
+            units = self._db.execute(
+                f"SELECT unit_id, length FROM units WHERE namespace = ? AND doc_id IN ({placeholders})",
+                [self.namespace] + batch
+            ).fetchall()
+            if not units:
+                continue
+            unit_ids = [unit_id for unit_id, _ in units]
+            df = Counter()
+            for unit_start in range(0, len(unit_ids), 500):
+                unit_batch = unit_ids[unit_start:unit_start + 500]
+                unit_placeholders = ",".join("?" * len(unit_batch))
+                df.update(term for (term,) in self._db.execute(
+                    f"SELECT term FROM postings WHERE namespace = ? AND unit_id IN ({unit_placeholders})",
+                    [self.namespace] + unit_batch
+                ))
+                self._db.execute(
+                    f"DELETE FROM postings WHERE namespace = ? AND unit_id IN ({unit_placeholders})",
+                    [self.namespace] + unit_batch
+                )
+            self._db.executemany(
+                "UPDATE terms SET df = df - ? WHERE namespace = ? AND term = ?",
+                [(count, self.namespace, term) for term, count in df.items()]
+            )
+            self._db.executemany(
+                "DELETE FROM terms WHERE namespace = ? AND term = ? AND df <= 0",
+                [(self.namespace, term) for term in df]
+            )
+            self._db.execute(
+                f"DELETE FROM units WHERE namespace = ? AND doc_id IN ({placeholders})",
+                [self.namespace] + batch
+            )
+            self._db.execute(
+                "UPDATE stats SET units = units - ?, total_length = total_length - ? WHERE namespace = ?",
+                (len(units), sum(length for _, length in units), self.namespace)
+            )
+
+    def remove(self, doc_ids: Iterable[str]):
+        with self._lock:
+            self._delete(list(doc_ids))
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            for table in ("units", "postings", "terms"):
+                self._db.execute(f"DELETE FROM {table} WHERE namespace = ?", (self.namespace,))
+            self._db.execute("UPDATE stats SET units = 0, total_length = 0 WHERE namespace = ?", (self.namespace,))
+            self._db.commit()
+
+    def search(self, query: str, limit: Optional[int] = 10,
+               candidates: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
+        """(doc_id, BM25 score of its best unit), best first; limit=None returns every match.
+
+        With candidates, only those documents are ranked, so a filter applied
+        afterwards can't leave fewer than limit hits.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+        if not terms:
+            return []
+
+        with self._lock:
+            unit_count, total_length = self._db.execute(
+                "SELECT units, total_length FROM stats WHERE namespace = ?", (self.namespace,)
+            ).fetchone()
+            if not unit_count:
+                return []
+            placeholders = ",".join("?" * len(terms))
+            frequencies = sorted(self._db.execute(
+                f"SELECT term, df FROM terms WHERE namespace = ? AND term IN ({placeholders})",
+                [self.namespace] + terms
+            ).fetchall(), key=lambda row: row[1])
+
+            selected = []
+            loaded = 0
+            for term, df in frequencies:
+                if selected and loaded + df > MAX_POSTINGS:
+                    break
+                selected.append((term, df))
+                loaded += df
+            if not selected:
+                return []
+
+            idf = {
+                term: math.log(1 + (unit_count - df + 0.5) / (df + 0.5))
+                for term, df in selected
+            }
+            placeholders = ",".join("?" * len(selected))
+            rows = self._db.execute(
+                "SELECT p.term, p.unit_id, p.tf, u.length, u.doc_id FROM postings p"
+                " JOIN units u ON u.namespace = p.namespace AND u.unit_id = p.unit_id"
+                f" WHERE p.namespace = ? AND p.term IN ({placeholders})",
+                [self.namespace] + [term for term, _ in selected]
+            ).fetchall()
+
+        average_length = (total_length / unit_count) or 1.0
+        unit_scores: Dict[str, float] = {}
+        unit_docs: Dict[str, str] = {}
+        for term, unit_id, tf, length, doc_id in rows:
+            norm = self.k1 * (1 - self.b + self.b * length / average_length)
+            unit_scores[unit_id] = unit_scores.get(unit_id, 0.0) + idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            unit_docs[unit_id] = doc_id
+
+        doc_scores: Dict[str, float] = {}
+        for unit_id, score in unit_scores.items():
+            doc_id = unit_docs[unit_id]
+            if candidates is not None and doc_id not in candidates:
+                continue
+            if score > doc_scores.get(doc_id, 0.0):
+                doc_scores[doc_id] = score
+        ranked = sorted(doc_scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked if limit is None else ranked[:limit]
+
+    def __contains__(self, doc_id: str) -> bool:
+        with self._lock:
+            return self._db.execute(
+                "SELECT 1 FROM units WHERE namespace = ? AND doc_id = ? LIMIT 1",
+                (self.namespace, doc_id)
+            ).fetchone() is not None
+
+    def sync(self, collection, chunk_collection, page_size: int = SYNC_PAGE_SIZE) -> "BM25Index":
+        """Index documents stored before the index existed, a page at a time"""
+        with self._lock:
+            known = {row[0] for row in self._db.execute(
+                "SELECT DISTINCT doc_id FROM units WHERE namespace = ?", (self.namespace,)
+            )}
+        offset = 0
+        while True:
+            page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+            missing = [
+                (doc_id, metadata) for doc_id, metadata in zip(page['ids'], page['metadatas'])
+                if doc_id not in known
+            ]
+            if missing:
+                chunked = [doc_id for doc_id, metadata in missing if (metadata or {}).get("chunk_count")]
+                units: Dict[str, List[str]] = {}
+                if chunked:
+                    chunks = chunk_collection.get(
+                        where={"parent_id": {"$in": chunked}},
+                        include=["documents", "metadatas"]
+                    )
+                    ordered = sorted(
+                        zip(chunks['metadatas'], chunks['documents']),
+                        key=lambda item: (item[0]['parent_id'], item[0].get('chunk_index', 0))
+                    )
+                    for metadata, text in ordered:
+                        units.setdefault(metadata['parent_id'], []).append(text)
+                whole = [doc_id for doc_id, _ in missing if doc_id not in units]
+                if whole:
+                    documents = collection.get(ids=whole, include=["documents"])
+                    for doc_id, text in zip(documents['ids'], documents['documents']):
+                        units[doc_id] = [text or ""]
+                self.add_many(list(units), list(units.values()))
+            if len(page['ids']) < page_size:
+                break
+            offset += page_size
+        return self
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], weights: Optional[List[float]] = None,
+                           k: int = RRF_K) -> List[Tuple[str, float]]:
+    """Fuse ranked id lists: each id scores sum(weight / (k + rank)), best first"""
+    weights = weights or [1.0] * len(rankings)
+    scores: Dict[str, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
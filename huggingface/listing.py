@@ -0,0 +1,123 @@
+"""
+Paginated, projection-aware document listing.
+
+Listing used to call collection.get() with no limit, pulling every stored
+document body (whole arXiv papers included) into memory and into one JSON
+response. Pages are fetched with limit/offset, only the requested fields are
+read from Chroma, and content can be cut down to a preview. A preview no
+longer than the one Chroma keeps under TEXT_STORE=blob is served from it,
+without reading the compressed body.
+"""
+
+from typing import Dict, Iterator, Optional, Tuple
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_PAGE_SIZE = 500
+
+LISTING_FIELDS = ("content", "metadata")
+
+
+def parse_fields(fields) -> Tuple[bool, bool]:
+    """Turn "content,metadata" (or a list) into (include_content, include_metadata).
+
+    None selects both; an empty string or list selects ids only.
+    """
+    if fields is None:
+        return True, True
+    if isinstance(fields, str):
+        fields = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in fields if field not in LISTING_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Choose from: {', '.join(LISTING_FIELDS)}")
+    return "content" in fields, "metadata" in fields
+
+
+def _format(doc_id: str, content: Optional[str], metadata: Optional[Dict],
+            include_content: bool, include_metadata: bool, preview_length: Optional[int],
+            length: Optional[int] = None) -> Dict:
+    document = {"id": doc_id}
+    if include_content:
+        if preview_length:
+            document["content"] = content[:preview_length]
+            document["truncated"] = (len(content) if length is None else length) > preview_length
+        else:
+            document["content"] = content
+    if include_metadata:
+        document["metadata"] = metadata
+    return document
+
+
+def _include(include_content: bool, include_metadata: bool) -> list:
+    include = []
+    if include_content:
+        include.append("documents")
+    if include_metadata:
+        include.append("metadatas")
+    return include
+
+
+def _get_page(collection, limit: int, offset: int, include: list, preview_length: Optional[int]) -> Dict:
+    # Only the compact store has get_previews; its previews are preview_chars long
+    get_previews = getattr(collection, "get_previews", None)
+    if (preview_length and "documents" in include and get_previews is not None
+            and preview_length <= collection.preview_chars):
+        return get_previews(limit=limit, offset=offset, include=include)
+    return collection.get(limit=limit, offset=offset, include=include)
+
+
+def page_documents(collection, limit: int = DEFAULT_PAGE_SIZE, offset: int = 0,
+                   include_content: bool = True, include_metadata: bool = True,
+                   preview_length: Optional[int] = None) -> Dict:
+    """Fetch one page of documents with only the requested fields"""
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    offset = max(0, int(offset))
+
+    page = _get_page(collection, limit, offset, _include(include_content, include_metadata), preview_length)
+    lengths = page.get('lengths')
+
+    documents = []
+    for i, doc_id in enumerate(page['ids']):
+        documents.append(_format(
+            doc_id,
+            page['documents'][i] if include_content else None,
+            page['metadatas'][i] if include_metadata else None,
+            include_content,
+            include_metadata,
+            preview_length,
+            lengths[i] if lengths else None
+        ))
+
+    total = collection.count()
+    next_offset = offset + len(documents)
+    return {
+        "documents": documents,
+        "count": len(documents),
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "next_offset": next_offset if next_offset < total else None
+    }
+
+
+def iter_documents(collection, include_content: bool = True, include_metadata: bool = True,
+                   preview_length: Optional[int] = None, offset: int = 0,
+                   page_size: int = STREAM_PAGE_SIZE) -> Iterator[Dict]:
+    """Yield every document from offset onwards, reading one page at a time"""
+    include = _include(include_content, include_metadata)
+    while True:
+        page = _get_page(collection, page_size, offset, include, preview_length)
+        lengths = page.get('lengths')
+        for i, doc_id in enumerate(page['ids']):
+            yield _format(
+                doc_id,
+                page['documents'][i] if include_content else None,
+                page['metadatas'][i] if include_metadata else None,
+                include_content,
+                include_metadata,
+                preview_length,
+                lengths[i] if lengths else None
+            )
+        if len(page['ids']) < page_size:
+            return
+        offset += page_size
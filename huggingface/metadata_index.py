@@ -0,0 +1,161 @@
+"""
+In-memory secondary index over document metadata.
+
+Chroma answers `where` filters by scanning its sqlite metadata table, so the
+arXiv dedup check and the arXiv paper listing each paid for a scan. This index
+maps (field, value) -> ids for a few fields, is loaded once at startup and is
+kept current by the add/delete paths, making those lookups dictionary hits.
+"""
+
+import threading
+from typing import Dict, Iterable, List, Optional, Set
+
+INDEXED_FIELDS = ("arxiv_id", "source", "subject_matter")
+# Kept per document for sorting listings, range filters and sizing exact
+# searches, but not indexed by value
+STORED_FIELDS = ("added_date", "published", "chunk_count")
+
+LOAD_PAGE_SIZE = 5000
+
+
+class MetadataIndex:
+    def __init__(self, fields: Iterable[str] = INDEXED_FIELDS, stored_fields: Iterable[str] = STORED_FIELDS):
+        self.fields = tuple(fields)
+        self.stored_fields = tuple(stored_fields)
+        self._postings: Dict[str, Dict[object, Set[str]]] = {field: {} for field in self.fields}
+        self._docs: Dict[str, Dict] = {}
+        self._lock = threading.RLock()
+
+    def load(self, collection, page_size: int = LOAD_PAGE_SIZE):
+        """Rebuild the index from a collection's metadata, a page at a time"""
+        with self._lock:
+            self.clear()
+            offset = 0
+            while True:
+                page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+                for doc_id, metadata in zip(page['ids'], page['metadatas']):
+                    self.add(doc_id, metadata)
+                if len(page['ids']) < page_size:
+                    break
+                offset += page_size
+        return self
+
+    def add(self, doc_id: str, metadata: Optional[Dict]):
+        metadata = metadata or {}
+        with self._lock:
+            if doc_id in self._docs:
+                self._unlink(doc_id)
+            entry = {}
+            for field in self.fields + self.stored_fields:
+                if metadata.get(field) is not None:
+                    entry[field] = metadata[field]
+            self._docs[doc_id] = entry
+            for field in self.fields:
+                if field in entry:
+                    self._postings[field].setdefault(entry[field], set()).add(doc_id)
+
+    def add_many(self, doc_ids: List[str], metadatas: List[Optional[Dict]]):
+        with self._lock:
+            for doc_id, metadata in zip(doc_ids, metadatas):
+                self.add(doc_id, metadata)
+
+    def remove(self, doc_ids: Iterable[str]):
+        with self._lock:
+            for doc_id in doc_ids:
+                if doc_id in self._docs:
+                    self._unlink(doc_id)
+                    del self._docs[doc_id]
+
+    def _unlink(self, doc_id: str):
+        for field, value in self._docs[doc_id].items():
+            if field not in self._postings:
+                continue
+            ids = self._postings[field].get(value)
+            if ids is not None:
+                ids.discard(doc_id)
+                if not ids:
+                    del self._postings[field][value]
+
+    def clear(self):
+        with self._lock:
+            self._postings = {field: {} for field in self.fields}
+            self._docs = {}
+
+    def lookup(self, **criteria) -> Set[str]:
+        """Ids whose metadata matches every field=value given (all ids if none)"""
+        for field in criteria:
+            if field not in self._postings:
+                raise KeyError(f"Field is not indexed: {field}")
+        with self._lock:
+            if not criteria:
+                return set(self._docs)
+            # Intersect starting from the smallest posting list
+            postings = sorted(
+                (self._postings[field].get(value, set()) for field, value in criteria.items()),
+                key=len
+            )
+            result = set(postings[0])
+            for ids in postings[1:]:
+                result &= ids
+            return result
+
+    def lookup_any(self, field: str, values: Iterable) -> Set[str]:
+        """Ids whose field equals any of values"""
+        if field not in self._postings:
+            raise KeyError(f"Field is not indexed: {field}")
+        with self._lock:
+            result = set()
+            for value in values:
+                result |= self._postings[field].get(value, set())
+            return result
+
+    def lookup_range(self, field: str, gt=None, gte=None, lt=None, lte=None,
+                     within: Optional[Set[str]] = None) -> Set[str]:
+        """Ids whose field lies in the given bounds, optionally only among within.
+
+        Works for string fields (ISO dates compare correctly as text), which
+        Chroma's $gt/$lt filters don't support. Scans the recorded documents.
+        """
+        if field not in self.fields + self.stored_fields:
+            raise KeyError(f"Field is not recorded: {field}")
+        with self._lock:
+            doc_ids = self._docs if within is None else [doc_id for doc_id in within if doc_id in self._docs]
+            result = set()
+            for doc_id in doc_ids:
+                value = self._docs[doc_id].get(field)
+                if value is None:
+                    continue
+                try:
+                    if gt is not None and not value > gt:
+                        continue
+                    if gte is not None and not value >= gte:
+                        continue
+                    if lt is not None and not value < lt:
+                        continue
+                    if lte is not None and not value <= lte:
+                        continue
+                except TypeError:
+                    # Mixed types (e.g. a number stored where dates usually are)
+                    continue
+                result.add(doc_id)
+            return result
+
+    def contains(self, field: str, value) -> bool:
+        with self._lock:
+            return bool(self._postings[field].get(value))
+
+    def values(self, field: str) -> Dict[object, int]:
+        """Distinct values of an indexed field with their document counts"""
+        with self._lock:
+            return {value: len(ids) for value, ids in self._postings[field].items()}
+
+    def get(self, doc_id: str) -> Dict:
+        """The indexed and stored fields recorded for a document"""
+        with self._lock:
+            return dict(self._docs.get(doc_id, {}))
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._docs
+
+    def __len__(self) -> int:
+        return len(self._docs)
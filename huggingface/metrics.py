@@ -0,0 +1,337 @@
+"""
+Per-stage latency metrics in the Prometheus text format.
+
+A slow /search could be spent encoding the query, in the HNSW query or
+building the JSON response, and the request total doesn't say which. The hot
+path is timed in stages:
+
+    encode          encoder.encode (cache lookups included), via InstrumentedEncoder
+    chroma_<op>     collection get/add/upsert/update/delete/query, via InstrumentedCollection
+    pdf_extract     PdfExtractor.extract_text
+    arxiv_search    arXiv API search requests
+    arxiv_download  arXiv PDF downloads
+    response        JSON serialization of Flask responses
+
+Every stage feeds writeguard_stage_seconds{stage=...}, and failures count in
+writeguard_stage_errors_total. Each request feeds writeguard_request_seconds
+and writeguard_requests_total, labelled by endpoint. render() returns the text
+served at /metrics; serve() runs a standalone server for it, for front ends
+that can't add the route themselves (Gradio's launch()).
+
+Inside request_timer() the stage durations are also summed for that one
+request. Front ends return this breakdown when asked, as a Server-Timing
+header or a "timings" field. Stages run in worker threads (the arXiv
+harvester's pools) only reach the histograms, because context variables
+don't follow work handed to a thread pool.
+
+A timed stage costs two perf_counter() calls and an uncontended lock, a few
+microseconds, while the stages themselves take milliseconds, so the overhead
+stays well under 1%. Stages wrap whole calls, never per-item loops.
+METRICS_ENABLED=0 turns the timing off altogether.
+"""
+
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, List, Optional, Tuple
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1').lower() in ('1', 'true', 'yes')
+# Gradio API endpoints add a "timings" field to their responses
+METRICS_TIMINGS = os.environ.get('METRICS_TIMINGS', '0').lower() in ('1', 'true', 'yes')
+
+# Port of the standalone /metrics server (serve()); 0 turns it off
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '9464'))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_value(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class HistogramFamily:
+    """Histograms sharing a name and buckets, one per label value"""
+
+    def __init__(self, name: str, help_text: str, label: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._counts = {}
+        self._sums = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, seconds: float):
+        # Buckets are upper bounds (le), so a value on a bound counts in that bucket
+        position = bisect_left(self.buckets, seconds)
+        with self._lock:
+            counts = self._counts.get(label_value)
+            if counts is None:
+                counts = self._counts[label_value] = [0] * (len(self.buckets) + 1)
+                self._sums[label_value] = 0.0
+            counts[position] += 1
+            self._sums[label_value] += seconds
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = {value: (list(counts), self._sums[value]) for value, counts in self._counts.items()}
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for value in sorted(series):
+            counts, total = series[value]
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _labels((self.label,), (value,), 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels((self.label,), (value,))} {total!r}")
+            lines.append(f"{self.name}_count{_labels((self.label,), (value,))} {cumulative}")
+        return lines
+
+
+class CounterFamily:
+    """Monotonic counters keyed by a tuple of label values"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values in sorted(values):
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {values[label_values]}")
+        return lines
+
+
+stage_seconds = HistogramFamily("writeguard_stage_seconds", "Time spent in one hot-path stage", "stage")
+stage_errors = CounterFamily("writeguard_stage_errors_total", "Stages that raised", ("stage",))
+request_seconds = HistogramFamily("writeguard_request_seconds", "Request handling time", "endpoint")
+requests_total = CounterFamily("writeguard_requests_total", "Handled requests", ("endpoint", "status"))
+search_cache_lookups = CounterFamily(
+    "writeguard_search_cache_total", "Search result cache lookups", ("collection", "result")
+)
+
+_FAMILIES = (stage_seconds, stage_errors, request_seconds, requests_total, search_cache_lookups)
+
+
+class RequestTimings:
+    """Stage durations summed over one request"""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.elapsed = None
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage_name: str, seconds: float):
+        with self._lock:
+            self.stages[stage_name] = self.stages.get(stage_name, 0.0) + seconds
+
+    def finish(self) -> float:
+        self.elapsed = time.perf_counter() - self.started
+        return self.elapsed
+
+    def breakdown(self) -> Dict:
+        """{"total_ms", "stages": {stage: ms}, "other_ms"}; other is time outside any stage"""
+        total = self.elapsed if self.elapsed is not None else time.perf_counter() - self.started
+        with self._lock:
+            stages = dict(self.stages)
+        return {
+            "total_ms": round(total * 1000, 3),
+            "stages": {name: round(seconds * 1000, 3) for name, seconds in stages.items()},
+            "other_ms": round(max(0.0, total - sum(stages.values())) * 1000, 3)
+        }
+
+    def server_timing(self) -> str:
+        """Server-Timing header value, which browser dev tools show per request"""
+        breakdown = self.breakdown()
+        parts = [f"{name};dur={ms}" for name, ms in breakdown["stages"].items()]
+        parts.append(f"total;dur={breakdown['total_ms']}")
+        return ", ".join(parts)
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+class _Stage:
+    """Context manager behind stage(); a class rather than a generator keeps entry and exit cheap"""
+
+    __slots__ = ("name", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = None
+
+    def __enter__(self):
+        if METRICS_ENABLED:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if self.started is None:
+            return False
+        elapsed = time.perf_counter() - self.started
+        if exc_type is not None:
+            stage_errors.inc(self.name)
+        stage_seconds.observe(self.name, elapsed)
+        timings = _current.get()
+        if timings is not None:
+            timings.add(self.name, elapsed)
+        return False
+
+
+def stage(name: str) -> _Stage:
+    """Time a with block as stage name"""
+    return _Stage(name)
+
+
+def start_request(endpoint: str):
+    """Begin timing a request; returns (timings, token) for finish_request"""
+    timings = RequestTimings(endpoint)
+    return timings, _current.set(timings)
+
+
+def finish_request(timings: RequestTimings, token, status: str):
+    _current.reset(token)
+    elapsed = timings.finish()
+    if METRICS_ENABLED:
+        request_seconds.observe(timings.endpoint, elapsed)
+        requests_total.inc(timings.endpoint, str(status))
+
+
+@contextmanager
+def request_timer(endpoint: str):
+    """Time a request; stages run inside are summed into the yielded RequestTimings"""
+    timings, token = start_request(endpoint)
+    status = "ok"
+    try:
+        yield timings
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        finish_request(timings, token, status)
+
+
+def timed_endpoint(endpoint: str, breakdown: bool = METRICS_TIMINGS):
+    """Decorator for API functions returning dicts; adds "timings" to the result when breakdown is on.
+
+    A dict with an "error" key counts as an error in writeguard_requests_total.
+    """
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            timings, token = start_request(endpoint)
+            status = "error"
+            try:
+                result = fn(*args, **kwargs)
+                status = "error" if isinstance(result, dict) and "error" in result else "ok"
+            finally:
+                finish_request(timings, token, status)
+            if breakdown and isinstance(result, dict):
+                result = {**result, "timings": timings.breakdown()}
+            return result
+        return wrapper
+    return decorate
+
+
+class InstrumentedEncoder:
+    """Encoder proxy timing encode() and aencode() as the encode stage"""
+
+    def __init__(self, encoder):
+        self._encoder = encoder
+
+    def encode(self, *args, **kwargs):
+        with stage("encode"):
+            return self._encoder.encode(*args, **kwargs)
+
+    async def aencode(self, *args, **kwargs):
+        with stage("encode"):
+            return await self._encoder.aencode(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self._encoder, attr)
+
+
+class InstrumentedCollection:
+    """Chroma collection proxy timing reads and writes as chroma_<operation> stages"""
+
+    _TIMED = {operation: f"chroma_{operation}" for operation in ("get", "add", "upsert", "update", "delete", "query")}
+    # Listing reads previews through the compact store; it is still a get
+    _TIMED["get_previews"] = "chroma_get"
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, attr):
+        value = getattr(self._collection, attr)
+        stage_name = self._TIMED.get(attr)
+        if stage_name is None:
+            return value
+
+        def timed(*args, **kwargs):
+            with stage(stage_name):
+                return value(*args, **kwargs)
+        return timed
+
+
+def instrument_encoder(encoder):
+    return InstrumentedEncoder(encoder) if METRICS_ENABLED else encoder
+
+
+def instrument_collection(collection):
+    return InstrumentedCollection(collection) if METRICS_ENABLED else collection
+
+
+def render() -> str:
+    """Every metric in the Prometheus text exposition format"""
+    lines = []
+    for family in _FAMILIES:
+        lines.extend(family.render())
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int = METRICS_PORT, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve render() at http://host:port/metrics from a daemon thread"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
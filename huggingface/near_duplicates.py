@@ -0,0 +1,255 @@
+"""
+MinHash/LSH near-duplicate index.
+
+Exact dedup goes through generate_doc_id, an md5 of the full text, so a
+resubmission with one character changed was encoded and stored again. Each
+document is reduced to a MinHash signature over word shingles; signatures are
+split into bands and every band is hashed into a bucket, so documents sharing
+any bucket are candidates whose Jaccard similarity is then estimated from
+their signatures. No model call is involved, which makes the check cheap
+enough to run before encoding, and the same candidates serve as a lexical
+pre-filter for plagiarism checks.
+
+Signatures and buckets live in sqlite (one namespace per collection) and are
+updated per add/delete, so nothing is rebuilt at startup.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+NEAR_DUP_PATH = os.environ.get('NEAR_DUP_PATH', './near_duplicates.db')
+NEAR_DUP_THRESHOLD = float(os.environ.get('NEAR_DUP_THRESHOLD', '0.8'))
+# skip: don't store a near-duplicate; link: store it with near_duplicate_of
+# metadata; off: exact dedup only
+NEAR_DUP_ACTION = os.environ.get('NEAR_DUP_ACTION', 'link').lower()
+NEAR_DUP_ACTIONS = ("skip", "link", "off")
+
+SHINGLE_WORDS = 5
+NUM_PERM = 128
+# 16 bands of 8 rows: pairs above ~0.7 Jaccard share a bucket with high probability
+BANDS = 16
+SEED = 1
+SYNC_PAGE_SIZE = 1000
+
+# Hashes are taken mod a Mersenne prime small enough that a * x + b fits in uint64
+_PRIME = (1 << 31) - 1
+_MAX_HASH = np.uint64(_PRIME)
+_HASH_BLOCK = 4096
+_WORD_RE = re.compile(r"\w+")
+
+
+def shingle_hashes(text: str, size: int = SHINGLE_WORDS) -> np.ndarray:
+    """Distinct 32-bit hashes of the text's lowercased word n-grams"""
+    words = _WORD_RE.findall(text.lower())
+    if not words:
+        return np.zeros(0, dtype=np.uint64)
+    if len(words) < size:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    return np.fromiter(
+        (zlib.crc32(shingle.encode()) for shingle in shingles),
+        dtype=np.uint64,
+        count=len(shingles)
+    ) % _MAX_HASH
+
+
+class MinHasher:
+    """Fixed-seed universal hash family, so signatures are comparable across runs"""
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = SEED):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self._a = rng.randint(1, _PRIME, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, _PRIME, size=num_perm).astype(np.uint64)
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """None for text without a single word; its all-maximum signature would match every other such text"""
+        hashes = shingle_hashes(text)
+        if not len(hashes):
+            return None
+        signature = np.full(self.num_perm, _PRIME, dtype=np.uint64)
+        # Blocks keep the (shingles x permutations) matrix small for long papers
+        for start in range(0, len(hashes), _HASH_BLOCK):
+            block = hashes[start:start + _HASH_BLOCK, None]
+            permuted = (block * self._a + self._b) % _MAX_HASH
+            np.minimum(signature, permuted.min(axis=0), out=signature)
+        return signature.astype(np.uint32)
+
+
+def estimate_jaccard(signature: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """Estimated Jaccard similarity of one signature against each row of others"""
+    return (others == signature).mean(axis=1)
+
+
+class NearDuplicateIndex:
+    def __init__(self, path: str = NEAR_DUP_PATH, namespace: str = "documents",
+                 threshold: float = NEAR_DUP_THRESHOLD, num_perm: int = NUM_PERM, bands: int = BANDS):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.namespace = namespace
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm)
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS signatures ("
+            " namespace TEXT NOT NULL,"
+            " doc_id TEXT NOT NULL,"
+            " signature BLOB NOT NULL,"
+            " PRIMARY KEY (namespace, doc_id))"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            " namespace TEXT NOT NULL,"
+            " band INTEGER NOT NULL,"
+            " bucket BLOB NOT NULL,"
+            " doc_id TEXT NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS buckets_lookup ON buckets (namespace, band, bucket)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS buckets_doc ON buckets (namespace, doc_id)")
+        self._db.commit()
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        return self.hasher.signature(text)
+
+    def _buckets(self, signature: np.ndarray) -> List[Tuple[int, bytes]]:
+        return [
+            (band, hashlib.blake2b(signature[band * self.rows:(band + 1) * self.rows].tobytes(), digest_size=8).digest())
+            for band in range(self.bands)
+        ]
+
+    def add(self, doc_id: str, signature: Optional[np.ndarray]):
+        self.add_many([doc_id], [signature])
+
+    def add_many(self, doc_ids: List[str], signatures: List[Optional[np.ndarray]]):
+        with self._lock:
+            self._delete(doc_ids)
+            # Documents without a signature (no words) are never indexed or matched
+            indexed = [(doc_id, signature) for doc_id, signature in zip(doc_ids, signatures) if signature is not None]
+            doc_ids = [doc_id for doc_id, _ in indexed]
+            signatures = [signature for _, signature in indexed]
+            self._db.executemany(
+                "INSERT INTO signatures (namespace, doc_id, signature) VALUES (?, ?, ?)",
+                [(self.namespace, doc_id, signature.tobytes()) for doc_id, signature in zip(doc_ids, signatures)]
+            )
+            self._db.executemany(
+                "INSERT INTO buckets (namespace, band, bucket, doc_id) VALUES (?, ?, ?, ?)",
+                [
+                    (self.namespace, band, bucket, doc_id)
+                    for doc_id, signature in zip(doc_ids, signatures)
+                    for band, bucket in self._buckets(signature)
+                ]
+            )
+            self._db.commit()
+
+    def _delete(self, doc_ids: List[str]):
+        for start in range(0, len(doc_ids), 500):
+            batch = list(doc_ids[start:start + 500])
+            placeholders = ",".join("?" * len(batch))
+            for table in ("signatures", "buckets"):
+                self._db.execute(
+                    f"DELETE FROM {table} WHERE namespace = ? AND doc_id IN ({placeholders})",
+                    [self.namespace] + batch
+                )
+
+    def remove(self, doc_ids: Iterable[str]):
+        with self._lock:
+            self._delete(list(doc_ids))
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            for table in ("signatures", "buckets"):
+                self._db.execute(f"DELETE FROM {table} WHERE namespace = ?", (self.namespace,))
+            self._db.commit()
+
+    def query(self, signature: Optional[np.ndarray], threshold: Optional[float] = None,
+              limit: Optional[int] = None, exclude: Optional[str] = None) -> List[Tuple[str, float]]:
+        """(doc_id, estimated Jaccard) for bucket-sharing documents at or above threshold, best first"""
+        if signature is None:
+            return []
+        threshold = self.threshold if threshold is None else threshold
+        buckets = self._buckets(signature)
+        with self._lock:
+            clause = " OR ".join("(band = ? AND bucket = ?)" for _ in buckets)
+            params = [value for pair in buckets for value in pair]
+            candidates = [row[0] for row in self._db.execute(
+                f"SELECT DISTINCT doc_id FROM buckets WHERE namespace = ? AND ({clause})",
+                [self.namespace] + params
+            ).fetchall() if row[0] != exclude]
+
+            rows = []
+            for start in range(0, len(candidates), 500):
+                batch = candidates[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows.extend(self._db.execute(
+                    f"SELECT doc_id, signature FROM signatures WHERE namespace = ? AND doc_id IN ({placeholders})",
+                    [self.namespace] + batch
+                ).fetchall())
+
+        if not rows:
+            return []
+        others = np.vstack([np.frombuffer(blob, dtype=np.uint32) for _, blob in rows])
+        scores = estimate_jaccard(signature, others)
+        matches = [(doc_id, float(score)) for (doc_id, _), score in zip(rows, scores) if score >= threshold]
+        matches.sort(key=lambda item: item[1], reverse=True)
+        return matches[:limit] if limit else matches
+
+    def find_duplicate(self, signature: Optional[np.ndarray]) -> Optional[Tuple[str, float]]:
+        """The closest stored document at or above the near-duplicate threshold"""
+        matches = self.query(signature, limit=1)
+        return matches[0] if matches else None
+
+    def __contains__(self, doc_id: str) -> bool:
+        with self._lock:
+            return self._db.execute(
+                "SELECT 1 FROM signatures WHERE namespace = ? AND doc_id = ?",
+                (self.namespace, doc_id)
+            ).fetchone() is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM signatures WHERE namespace = ?", (self.namespace,)
+            ).fetchone()[0]
+
+    def sync(self, collection, page_size: int = SYNC_PAGE_SIZE) -> "NearDuplicateIndex":
+        """Add signatures for documents stored before the index existed, a page at a time"""
+        with self._lock:
+            known = {row[0] for row in self._db.execute(
+                "SELECT doc_id FROM signatures WHERE namespace = ?", (self.namespace,)
+            )}
+        offset = 0
+        while True:
+            page = collection.get(include=[], limit=page_size, offset=offset)
+            missing = [doc_id for doc_id in page['ids'] if doc_id not in known]
+            if missing:
+                documents = collection.get(ids=missing, include=["documents"])
+                self.add_many(
+                    documents['ids'],
+                    [self.signature(text or "") for text in documents['documents']]
+                )
+            if len(page['ids']) < page_size:
+                break
+            offset += page_size
+        return self
+
+
+def near_duplicate_metadata(match: Tuple[str, float]) -> Dict:
+    """Metadata recorded on a document stored as a near-duplicate in link mode"""
+    return {"near_duplicate_of": match[0], "near_duplicate_jaccard": round(match[1], 4)}
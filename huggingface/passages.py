@@ -0,0 +1,196 @@
+"""
+Passage-level plagiarism localization.
+
+compare returns one score for two whole documents, which says whether a
+submission is close to a stored paper but not where. Here both sides are
+split into the same token windows used for chunked storage, every submission
+chunk is scored against every stored chunk with one matmul, and pairs are
+aligned greedily (best pair first, each chunk used at most once). Aligned
+pairs that continue each other on both sides are merged into passages.
+
+The stored side is the expensive part for long papers: its chunk vectors come
+from the chunk collection (or are computed once for documents stored without
+chunks) and are kept in a small LRU, so checking many submissions against the
+same paper only encodes the submissions.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from chunking import ENCODE_BATCH_SIZE, chunk_text
+from embedding_engine import normalize_rows
+
+PASSAGE_THRESHOLD = float(os.environ.get('PASSAGE_THRESHOLD', '0.8'))
+PASSAGE_CACHE_DOCS = int(os.environ.get('PASSAGE_CACHE_DOCS', '64'))
+PASSAGE_MAX_PAIRS = 500
+PREVIEW_LENGTH = 300
+
+
+class ChunkVectorCache:
+    """LRU of doc_id -> (chunk texts, unit chunk vectors) for stored documents"""
+
+    def __init__(self, max_docs: int = PASSAGE_CACHE_DOCS):
+        self.max_docs = max_docs
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, doc_id: str) -> Optional[Tuple[List[str], np.ndarray]]:
+        with self._lock:
+            entry = self._entries.get(doc_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(doc_id)
+            self.hits += 1
+            return entry
+
+    def put(self, doc_id: str, chunks: List[str], vectors: np.ndarray):
+        with self._lock:
+            self._entries[doc_id] = (chunks, vectors)
+            self._entries.move_to_end(doc_id)
+            while len(self._entries) > self.max_docs:
+                self._entries.popitem(last=False)
+
+    def discard(self, doc_ids):
+        with self._lock:
+            for doc_id in doc_ids:
+                self._entries.pop(doc_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def embed_chunks(encoder, text: str) -> Tuple[List[str], np.ndarray]:
+    """Chunk text and return (chunks, unit chunk vectors)"""
+    chunks = chunk_text(text, getattr(encoder, "tokenizer", None))
+    if not chunks:
+        raise ValueError("Document has no text to compare")
+    vectors = np.asarray(encoder.encode(chunks, batch_size=ENCODE_BATCH_SIZE), dtype=np.float32)
+    return chunks, normalize_rows(vectors)
+
+
+def stored_chunks(collection, chunk_collection, encoder, doc_id: str,
+                  cache: Optional[ChunkVectorCache] = None) -> Tuple[List[str], np.ndarray]:
+    """Chunks and unit vectors of a stored document; KeyError if it doesn't exist"""
+    if cache is not None:
+        entry = cache.get(doc_id)
+        if entry is not None:
+            return entry
+
+    found = chunk_collection.get(
+        where={"parent_id": doc_id},
+        include=["documents", "embeddings", "metadatas"]
+    )
+    if found['ids']:
+        order = sorted(
+            range(len(found['ids'])),
+            key=lambda i: (found['metadatas'][i] or {}).get("chunk_index", i)
+        )
+        chunks = [found['documents'][i] for i in order]
+        vectors = normalize_rows(np.asarray([found['embeddings'][i] for i in order], dtype=np.float32))
+    else:
+        # Stored before chunking existed, or short enough not to need it
+        document = collection.get(ids=[doc_id], include=["documents"])
+        if not document['ids']:
+            raise KeyError("Document not found")
+        chunks, vectors = embed_chunks(encoder, document['documents'][0] or "")
+
+    if cache is not None:
+        cache.put(doc_id, chunks, vectors)
+    return chunks, vectors
+
+
+def greedy_align(matrix: np.ndarray, threshold: float, max_pairs: int = PASSAGE_MAX_PAIRS) -> List[Tuple[int, int, float]]:
+    """One-to-one (row, column, score) pairs at or above threshold, taken best first"""
+    rows, columns = np.nonzero(matrix >= threshold)
+    if not len(rows):
+        return []
+    scores = matrix[rows, columns]
+    order = np.argsort(-scores, kind="stable")
+
+    used_rows = np.zeros(matrix.shape[0], dtype=bool)
+    used_columns = np.zeros(matrix.shape[1], dtype=bool)
+    limit = min(max_pairs, matrix.shape[0], matrix.shape[1])
+    pairs = []
+    for n in order:
+        i, j = rows[n], columns[n]
+        if used_rows[i] or used_columns[j]:
+            continue
+        used_rows[i] = used_columns[j] = True
+        pairs.append((int(i), int(j), float(scores[n])))
+        if len(pairs) >= limit:
+            break
+    return pairs
+
+
+def merge_runs(pairs: List[Tuple[int, int, float]]) -> List[Dict]:
+    """Group aligned pairs where both sides advance by one chunk into passages"""
+    passages = []
+    for i, j, score in sorted(pairs):
+        last = passages[-1] if passages else None
+        if last is not None and i == last["submission_end"] + 1 and j == last["source_end"] + 1:
+            last["submission_end"] = i
+            last["source_end"] = j
+            last["scores"].append(score)
+        else:
+            passages.append({
+                "submission_start": i, "submission_end": i,
+                "source_start": j, "source_end": j,
+                "scores": [score]
+            })
+    return passages
+
+
+def locate_passages(collection, chunk_collection, encoder, content: str, doc_id: str,
+                    threshold: float = PASSAGE_THRESHOLD, cache: Optional[ChunkVectorCache] = None,
+                    max_pairs: int = PASSAGE_MAX_PAIRS) -> Dict:
+    """Aligned passages of content that closely match the stored document doc_id.
+
+    Chunk indexes are positions in each side's chunk list. Scores are cosine
+    similarities of chunk embeddings; a passage reports its best and mean
+    score. coverage is the share of submission chunks inside a passage.
+    """
+    if not content or not content.strip():
+        raise ValueError("Content is required")
+    if not doc_id:
+        raise ValueError("Document id is required")
+    if not -1 <= threshold <= 1:
+        raise ValueError("threshold must be between -1 and 1")
+
+    source_chunks, source_vectors = stored_chunks(collection, chunk_collection, encoder, doc_id, cache)
+    submission_chunks, submission_vectors = embed_chunks(encoder, content)
+
+    matrix = submission_vectors @ source_vectors.T
+    pairs = greedy_align(matrix, threshold, max_pairs)
+
+    passages = []
+    for run in merge_runs(pairs):
+        submission_text = " ".join(submission_chunks[run["submission_start"]:run["submission_end"] + 1])
+        source_text = " ".join(source_chunks[run["source_start"]:run["source_end"] + 1])
+        passages.append({
+            "submission_chunks": [run["submission_start"], run["submission_end"]],
+            "source_chunks": [run["source_start"], run["source_end"]],
+            "similarity": max(run["scores"]),
+            "mean_similarity": sum(run["scores"]) / len(run["scores"]),
+            "submission_preview": submission_text[:PREVIEW_LENGTH],
+            "source_preview": source_text[:PREVIEW_LENGTH]
+        })
+    passages.sort(key=lambda passage: passage["similarity"], reverse=True)
+
+    return {
+        "id": doc_id,
+        "threshold": threshold,
+        "submission_chunk_count": len(submission_chunks),
+        "source_chunk_count": len(source_chunks),
+        "matched_chunks": len(pairs),
+        "coverage": len(pairs) / len(submission_chunks),
+        "max_similarity": float(matrix.max()),
+        "passages": passages
+    }
@@ -0,0 +1,291 @@
+"""
+Process-pool PDF text extraction.
+
+pdfplumber is pure Python and holds the GIL, so extracting a long paper on a
+request thread stalls every other request in the process. Extraction runs in
+up to PDF_WORKERS worker processes instead. A document's page range is split
+across workers, and each worker runs one range at a time under an
+address-space cap. A range that runs past its document's timeout gets its own
+worker killed and replaced. Ranges of other documents extracting on other
+workers are unaffected.
+
+Workers are fresh interpreters running this file (python pdf_extract.py
+--worker), started with subprocess. Forking the app process, with the
+encoder, torch and Gradio threads running, risks copying a lock some thread
+holds at that moment. multiprocessing's spawn and forkserver re-import the
+app's __main__ in every worker.
+
+PDF_BACKEND picks the extractor:
+    pdfplumber  layout-aware, slowest (default, matches earlier output)
+    pdfminer    pdfminer.six with layout analysis disabled
+    pypdfium2   PDFium text layer, fastest
+"""
+
+import io
+import os
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Connection
+from typing import List, Tuple
+
+from metrics import stage
+
+PDF_BACKEND = os.environ.get('PDF_BACKEND', 'pdfplumber')
+PDF_WORKERS = int(os.environ.get('PDF_WORKERS', str(min(4, os.cpu_count() or 1))))
+PDF_TIMEOUT_SEC = float(os.environ.get('PDF_TIMEOUT_SEC', '60'))
+PDF_WORKER_MEMORY_MB = int(os.environ.get('PDF_WORKER_MEMORY_MB', '1024'))
+# Don't fan out documents shorter than this; process start-up would dominate
+PDF_PAGES_PER_TASK = int(os.environ.get('PDF_PAGES_PER_TASK', '8'))
+# A worker is replaced after this many ranges, which bounds leaks in the parsers
+PDF_TASKS_PER_WORKER = 100
+
+BACKENDS = ("pdfplumber", "pdfminer", "pypdfium2")
+
+
+def _extract_pdfplumber(pdf_bytes: bytes, start: int, end: int) -> List[str]:
+    import pdfplumber
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+        return [page.extract_text() or "" for page in pdf.pages[start:end]]
+
+
+def _extract_pdfminer(pdf_bytes: bytes, start: int, end: int) -> List[str]:
+    from pdfminer.converter import TextConverter
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
+
+    manager = PDFResourceManager()
+    output = io.StringIO()
+    # laparams=None skips layout analysis entirely
+    device = TextConverter(manager, output, laparams=None)
+    interpreter = PDFPageInterpreter(manager, device)
+    texts = []
+    for page in PDFPage.get_pages(io.BytesIO(pdf_bytes), pagenos=set(range(start, end))):
+        interpreter.process_page(page)
+        texts.append(output.getvalue().rstrip("\x0c"))
+        output.seek(0)
+        output.truncate()
+    device.close()
+    return texts
+
+
+def _extract_pypdfium2(pdf_bytes: bytes, start: int, end: int) -> List[str]:
+    import pypdfium2
+    pdf = pypdfium2.PdfDocument(pdf_bytes)
+    try:
+        return [pdf[i].get_textpage().get_text_range() for i in range(start, min(end, len(pdf)))]
+    finally:
+        pdf.close()
+
+
+_EXTRACTORS = {
+    "pdfplumber": _extract_pdfplumber,
+    "pdfminer": _extract_pdfminer,
+    "pypdfium2": _extract_pypdfium2,
+}
+
+
+def _extract_range(pdf_bytes: bytes, backend: str, start: int, end: int) -> List[str]:
+    return _EXTRACTORS[backend](pdf_bytes, start, end)
+
+
+def _limit_memory(limit_mb: int):
+    """Let this worker grow by at most limit_mb of address space"""
+    if limit_mb <= 0:
+        return
+    try:
+        import resource
+        # Cap growth beyond what the fresh worker already maps
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+        limit = current + limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError):
+        # Not available on every platform; run uncapped
+        pass
+
+
+def _page_count(pdf_bytes: bytes) -> int:
+    # pdfplumber depends on pypdfium2, so this is always available and
+    # counting pages with it is cheap next to a full parse
+    import pypdfium2
+    pdf = pypdfium2.PdfDocument(pdf_bytes)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def _serve(task_fd: int, result_fd: int, memory_mb: int):
+    """Worker loop: extract (backend, start, end, pdf_bytes) tasks until the parent closes the pipe"""
+    _limit_memory(memory_mb)
+    tasks = Connection(task_fd, writable=False)
+    results = Connection(result_fd, readable=False)
+    while True:
+        try:
+            backend, start, end, pdf_bytes = tasks.recv()
+        except EOFError:
+            return
+        try:
+            results.send(("ok", _extract_range(pdf_bytes, backend, start, end)))
+        except BaseException as e:
+            try:
+                results.send(("error", e))
+            except Exception:
+                # The exception itself may not pickle
+                results.send(("error", RuntimeError(repr(e))))
+
+
+class _Worker:
+    """One worker process and the two pipes to it"""
+
+    def __init__(self, memory_mb: int):
+        task_read, task_write = os.pipe()
+        result_read, result_write = os.pipe()
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--worker", str(task_read), str(result_write), str(memory_mb)],
+            pass_fds=(task_read, result_write),
+            stdin=subprocess.DEVNULL
+        )
+        os.close(task_read)
+        os.close(result_write)
+        self.tasks = Connection(task_write, readable=False)
+        self.results = Connection(result_read, writable=False)
+        self.completed = 0
+
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        self.tasks.close()
+        self.results.close()
+
+
+class PdfExtractor:
+    def __init__(self, backend: str = PDF_BACKEND, workers: int = PDF_WORKERS,
+                 timeout: float = PDF_TIMEOUT_SEC, memory_mb: int = PDF_WORKER_MEMORY_MB):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown PDF backend: {backend} (expected one of {', '.join(BACKENDS)})")
+        self.backend = backend
+        self.workers = workers
+        self.timeout = timeout
+        self.memory_mb = memory_mb
+        self._idle: List[_Worker] = []
+        self._running = 0
+        self._available = threading.Condition()
+
+    def _checkout(self, count: int, deadline: float) -> List[_Worker]:
+        """count workers at once, so a document never holds some while waiting for more"""
+        with self._available:
+            ready = self._available.wait_for(
+                lambda: len(self._idle) + self.workers - self._running >= count,
+                timeout=max(0.0, deadline - time.monotonic())
+            )
+            if not ready:
+                raise TimeoutError(f"PDF extraction timed out after {self.timeout:.0f}s waiting for a worker")
+            taken = [self._idle.pop() for _ in range(min(count, len(self._idle)))]
+            # Reserve places for the workers still to start
+            self._running += count - len(taken)
+        started = []
+        try:
+            while len(taken) + len(started) < count:
+                started.append(_Worker(self.memory_mb))
+        except Exception:
+            with self._available:
+                self._running -= count - len(taken) - len(started)
+            self._checkin(taken + started, retire=True)
+            raise
+        return taken + started
+
+    def _checkin(self, workers: List[_Worker], retire: bool = False):
+        """Return workers to the idle list, or kill them (retire) and free their places"""
+        with self._available:
+            for worker in workers:
+                if retire or worker.completed >= PDF_TASKS_PER_WORKER or worker.process.poll() is not None:
+                    worker.kill()
+                    self._running -= 1
+                else:
+                    self._idle.append(worker)
+            self._available.notify_all()
+
+    def _page_ranges(self, page_count: int) -> List[Tuple[int, int]]:
+        parts = max(1, min(self.workers, page_count // PDF_PAGES_PER_TASK))
+        size = -(-page_count // parts)
+        return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+    def _result(self, worker: _Worker, deadline: float) -> List[str]:
+        if not worker.results.poll(max(0.0, deadline - time.monotonic())):
+            raise TimeoutError(f"PDF extraction timed out after {self.timeout:.0f}s")
+        try:
+            status, payload = worker.results.recv()
+        except EOFError:
+            # Died without answering: the memory cap or a crash in the parser
+            worker.process.wait()
+            raise MemoryError(
+                f"PDF extraction worker exited with code {worker.process.returncode} "
+                f"(worker memory cap {self.memory_mb} MB)"
+            )
+        worker.completed += 1
+        if status == "error":
+            if isinstance(payload, MemoryError):
+                raise MemoryError(f"PDF extraction exceeded the {self.memory_mb} MB worker memory cap")
+            raise payload
+        return payload
+
+    def extract_pages(self, pdf_bytes: bytes) -> List[str]:
+        """Return the text of every page, in order"""
+        page_count = _page_count(pdf_bytes)
+        if self.workers <= 0:
+            return _extract_range(pdf_bytes, self.backend, 0, page_count)
+        if page_count == 0:
+            return []
+
+        ranges = self._page_ranges(page_count)
+        # The timeout covers the whole document, waiting for workers included
+        deadline = time.monotonic() + self.timeout
+        workers = self._checkout(len(ranges), deadline)
+        answered = []
+        try:
+            for worker, (start, end) in zip(workers, ranges):
+                worker.tasks.send((self.backend, start, end, pdf_bytes))
+            pages = []
+            for worker in workers:
+                pages.extend(self._result(worker, deadline))
+                answered.append(worker)
+            return pages
+        finally:
+            # Workers that never answered overran, died or were never read; only they are killed
+            self._checkin(answered)
+            self._checkin([worker for worker in workers if worker not in answered], retire=True)
+
+    def extract_text(self, pdf_bytes: bytes) -> str:
+        with stage("pdf_extract"):
+            pages = self.extract_pages(pdf_bytes)
+        text_parts = [text for text in pages if text]
+        return '\n\n'.join(text_parts).strip()
+
+    def close(self):
+        """Stop the idle workers; busy ones stop when their document is done"""
+        with self._available:
+            idle, self._idle = self._idle, []
+            self._running -= len(idle)
+        for worker in idle:
+            worker.kill()
+
+
+_default_extractor = None
+_default_lock = threading.Lock()
+
+
+def get_extractor() -> PdfExtractor:
+    """Process-wide extractor configured from the environment"""
+    global _default_extractor
+    with _default_lock:
+        if _default_extractor is None:
+            _default_extractor = PdfExtractor()
+        return _default_extractor
+
+
+if __name__ == "__main__" and sys.argv[1:2] == ["--worker"]:
+    _serve(int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]))
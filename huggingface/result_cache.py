@@ -0,0 +1,116 @@
+"""
+Search result cache.
+
+The front end re-runs a search on every debounced keystroke, so the same
+query arrives many times in a row. Each run pays for the HNSW query, BM25 and
+the Chroma fetches again. SearchResultCache keeps recent responses keyed by
+
+    (collection version, query embedding hash, n_results, mode, filters)
+
+The engine bumps the version after every write (add, bulk add, delete,
+clear). A search records the version before it reads anything, so a response
+computed before a write can never be served after it, and a bump drops the
+entries it made stale. Entries also expire after SEARCH_CACHE_TTL seconds.
+Past SEARCH_CACHE_SIZE entries the least recently used go first;
+SEARCH_CACHE_SIZE=0 turns the cache off.
+
+The version only counts this process's writes. Writes from other workers or
+from another client of a shared Chroma server can't bump it. So the engine
+turns the cache off unless it is the collections' only writer.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from embedding_engine import normalize_rows
+from metrics import search_cache_lookups
+
+SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', '1024'))
+SEARCH_CACHE_TTL = float(os.environ.get('SEARCH_CACHE_TTL', '300'))
+# Vector components are rounded to this many decimals before hashing
+EMBEDDING_KEY_DECIMALS = 4
+
+
+def embedding_key(embedding) -> str:
+    """Hash of the unit query vector, rounded so float noise from batching doesn't split entries"""
+    vector = normalize_rows(np.asarray([embedding], dtype=np.float32))[0]
+    quantized = np.round(vector * 10 ** EMBEDDING_KEY_DECIMALS).astype(np.int32)
+    return hashlib.blake2b(quantized.tobytes(), digest_size=16).hexdigest()
+
+
+def filters_key(where: Optional[Dict], where_document: Optional[Dict]) -> str:
+    """Canonical form of a search's filters; key order doesn't matter"""
+    return json.dumps([where or None, where_document or None], sort_keys=True, default=str)
+
+
+def _copy_response(response: Dict) -> Dict:
+    # Callers may add fields to the response or its results; the cached copy stays as computed
+    return {**response, "results": [dict(result) for result in response.get("results", [])]}
+
+
+class SearchResultCache:
+    """LRU of search responses with a TTL, invalidated by bump() on every write"""
+
+    def __init__(self, name: str = "", max_entries: int = SEARCH_CACHE_SIZE, ttl: float = SEARCH_CACHE_TTL):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def key(self, version: int, embedding, n_results: int, mode: str, where: Optional[Dict] = None,
+            where_document: Optional[Dict] = None, query: str = "") -> Tuple:
+        """Cache key; query (lower-cased, whitespace collapsed) only matters for modes using BM25"""
+        lexical_query = " ".join(query.lower().split()) if mode != "vector" else ""
+        return (version, embedding_key(embedding), n_results, mode, filters_key(where, where_document), lexical_query)
+
+    def get(self, key: Tuple) -> Optional[Dict]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        search_cache_lookups.inc(self.name, "miss" if entry is None else "hit")
+        return None if entry is None else _copy_response(entry[1])
+
+    def put(self, key: Tuple, response: Dict):
+        if not self.enabled:
+            return
+        with self._lock:
+            # Computed against a version a write has since replaced
+            if key[0] != self.version:
+                return
+            self._entries[key] = (time.monotonic(), _copy_response(response))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def bump(self):
+        """Record a write: every cached response is stale"""
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
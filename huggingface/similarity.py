@@ -0,0 +1,154 @@
+"""
+Many-to-many document comparison.
+
+compare only scores one pair per request, so checking a submission against
+dozens of candidates meant dozens of round trips and encode calls. Here both
+sides are resolved up front (stored ids reuse their stored embeddings, texts
+are chunked and mean-pooled like stored documents, with all their chunks
+encoded in one call) and the full similarity matrix comes from a single
+matmul over unit-normalised vectors.
+"""
+
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from chunking import embed_documents
+from embedding_engine import normalize_rows
+
+COMPARE_MAX_DOCS = int(os.environ.get('COMPARE_MAX_DOCS', '256'))  # Per side
+COMPARE_DEFAULT_TOP_K = 5
+COMPARE_MAX_PAIRS = 10000
+PREVIEW_LENGTH = 100
+
+
+def _parse_item(item) -> Tuple[Optional[str], Optional[str]]:
+    """Return (doc_id, text) for a plain string, {"id": ...} or {"text": ...}"""
+    if isinstance(item, str):
+        return None, item
+    if isinstance(item, dict):
+        if item.get("id"):
+            return str(item["id"]), None
+        text = item.get("text") or item.get("content")
+        if isinstance(text, str):
+            return None, text
+    raise ValueError("Each document must be a string, {\"id\": ...} or {\"text\": ...}")
+
+
+def resolve_documents(collection, encoder, items: List) -> Tuple[np.ndarray, List[Dict]]:
+    """Embed a mix of texts and stored ids, returning (unit vectors, descriptors)"""
+    parsed = [_parse_item(item) for item in items]
+    for doc_id, text in parsed:
+        if doc_id is None and not text.strip():
+            raise ValueError("Documents must not be empty")
+
+    stored = {}
+    wanted = sorted({doc_id for doc_id, _ in parsed if doc_id is not None})
+    if wanted:
+        found = collection.get(ids=wanted, include=["embeddings", "documents"])
+        for doc_id, embedding, content in zip(found['ids'], found['embeddings'], found['documents']):
+            stored[doc_id] = (np.asarray(embedding, dtype=np.float32), content or "")
+        missing = [doc_id for doc_id in wanted if doc_id not in stored]
+        if missing:
+            raise KeyError(f"Documents not found: {', '.join(missing)}")
+
+    # Chunked and mean-pooled like stored documents, so text past the
+    # model's 256 token window counts too
+    texts = [text for doc_id, text in parsed if doc_id is None]
+    encoded = iter(embed_documents(encoder, texts)) if texts else iter(())
+
+    vectors = []
+    descriptors = []
+    for position, (doc_id, text) in enumerate(parsed):
+        if doc_id is not None:
+            vector, content = stored[doc_id]
+            descriptors.append({"index": position, "id": doc_id, "preview": content[:PREVIEW_LENGTH]})
+        else:
+            vector = next(encoded)
+            descriptors.append({"index": position, "preview": text[:PREVIEW_LENGTH]})
+        vectors.append(vector)
+
+    return normalize_rows(np.vstack(vectors).astype(np.float32)), descriptors
+
+
+def similarity_matrix(queries: np.ndarray, references: np.ndarray) -> np.ndarray:
+    """Cosine similarity of every query row against every reference row"""
+    return normalize_rows(queries) @ normalize_rows(references).T
+
+
+def top_k_per_row(matrix: np.ndarray, k: int) -> List[List[Dict]]:
+    """The k highest-scoring references for each query row, best first"""
+    k = max(1, min(int(k), matrix.shape[1]))
+    if k < matrix.shape[1]:
+        candidates = np.argpartition(-matrix, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.tile(np.arange(matrix.shape[1]), (matrix.shape[0], 1))
+    rows = []
+    for i, columns in enumerate(candidates):
+        columns = columns[np.argsort(-matrix[i, columns], kind="stable")]
+        rows.append([
+            {"reference": int(j), "similarity": float(matrix[i, j])}
+            for j in columns
+            if np.isfinite(matrix[i, j])
+        ])
+    return rows
+
+
+def threshold_pairs(matrix: np.ndarray, threshold: float, limit: int = COMPARE_MAX_PAIRS) -> Tuple[List[Dict], bool]:
+    """(query, reference) pairs scoring at least threshold, best first, and whether the list was cut at limit"""
+    rows, columns = np.nonzero(matrix >= threshold)
+    scores = matrix[rows, columns]
+    order = np.argsort(-scores, kind="stable")
+    truncated = len(order) > limit
+    pairs = [
+        {"query": int(rows[n]), "reference": int(columns[n]), "similarity": float(scores[n])}
+        for n in order[:limit]
+    ]
+    return pairs, truncated
+
+
+def compare_matrix(collection, encoder, queries: List, references: Optional[List] = None,
+                   top_k: Optional[int] = None, threshold: Optional[float] = None) -> Dict:
+    """Score N query documents against M references in one pass.
+
+    Documents may be texts or stored ids. With no references the queries are
+    compared with each other, ignoring each document's match with itself.
+    Returns the top_k references per query, or with threshold set, every pair
+    scoring at least threshold as a sparse list.
+    """
+    if not queries:
+        raise ValueError("At least one query document is required")
+    self_compare = not references
+    if len(queries) > COMPARE_MAX_DOCS or (references and len(references) > COMPARE_MAX_DOCS):
+        raise ValueError(f"At most {COMPARE_MAX_DOCS} documents per side")
+    if self_compare and len(queries) < 2:
+        raise ValueError("Need at least two documents to compare")
+
+    query_vectors, query_docs = resolve_documents(collection, encoder, queries)
+    if self_compare:
+        reference_vectors, reference_docs = query_vectors, query_docs
+    else:
+        reference_vectors, reference_docs = resolve_documents(collection, encoder, references)
+
+    matrix = query_vectors @ reference_vectors.T
+    if self_compare:
+        np.fill_diagonal(matrix, -np.inf)
+
+    result = {
+        "queries": query_docs,
+        "references": reference_docs,
+        "shape": [len(query_docs), len(reference_docs)]
+    }
+
+    if threshold is not None:
+        if self_compare:
+            # Each unordered pair once
+            matrix[np.tril_indices(len(query_docs))] = -np.inf
+        pairs, truncated = threshold_pairs(matrix, float(threshold))
+        result.update({"threshold": float(threshold), "pairs": pairs, "truncated": truncated})
+    else:
+        top_k = top_k or COMPARE_DEFAULT_TOP_K
+        result.update({"top_k": int(top_k), "matches": top_k_per_row(matrix, top_k)})
+
+    return result